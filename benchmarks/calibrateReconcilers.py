@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Calibrate the rule table of the "auto" reconciler.  Each reconciler is run
+    on every polytomy of the SCM trees of the simulated datasets, and its time
+    and accuracy are recorded by polytomy size (degree) bucket.  Accuracy is
+    the change in the number of FP and FN bipartitions (against the model
+    tree) that resolving the polytomy alone brings about.  The report, written
+    as JSON, holds the measurements and a rule table picking, for each bucket,
+    the most accurate reconciler (the fastest one, among ties).  Written to
+    superfine/defaultRules.json, it gives the default rule table.
+'''
+
+import copy
+import glob
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from superfine.SuperFine import *
+from superfine.selection import validateRules
+
+
+# upper bounds of the degree buckets
+BUCKETS = (7, 15, 31, 63, 127)
+
+
+def findBucket(degree):
+    '''Return the upper bound of the degree bucket of a polytomy (None for the last bucket).'''
+    for bound in BUCKETS:
+        if degree <= bound:
+            return (bound)
+    return None
+
+
+
+def findDatasets(directory, replicates):
+    '''Return (source trees file, model tree file) pairs of the first replicates of each simulated dataset.'''
+    datasets = []
+    for sourcesFile in sorted(glob.glob(os.path.join(directory, "*", "*", "sm_data.*.source_trees"))):
+        replicate = int(os.path.basename(sourcesFile).split(".")[1])
+        modelFile = sourcesFile[:-len("source_trees")] + "model_tree"
+        if replicate < replicates and os.path.exists(modelFile):
+            datasets.append((sourcesFile, modelFile))
+    return (datasets)
+
+
+
+def measurePolytomy(tree, polytomy, polytomyIndex, sourceTrees, modelTree, options):
+    '''Resolve a single polytomy of (a copy of) the SCM tree; return the time taken and the change in FP + FN.'''
+    start = time.time()
+    bipartitions = refinePolytomy(polytomy, sourceTrees, Logger(), options, polytomyIndex)
+    seconds = time.time() - start
+
+    (refined, refinedPolytomy) = copy.deepcopy((tree, polytomy))
+    if bipartitions:
+        expandTree({refinedPolytomy: bipartitions})
+    (before, after) = [getRawFpFn(modelTree, scored) for scored in (tree, refined)]
+    return (seconds, (after[0] + after[1]) - (before[0] + before[1]))
+
+
+
+def deriveRules(buckets, reconcilers):
+    '''Pick the best reconciler of each bucket, and merge neighboring buckets picking the same one.'''
+    rules = []
+    for bound in BUCKETS + (None,):
+        measured = [(buckets[(bound, reconciler)]["meanErrorChange"], buckets[(bound, reconciler)]["meanSeconds"],
+                     reconciler) for reconciler in reconcilers if (bound, reconciler) in buckets]
+        if not measured:
+            continue
+        best = min(measured)[2]
+        if rules and rules[-1]["reconciler"] == best:
+            rules[-1]["maxDegree"] = bound
+        else:
+            rules.append({"maxDegree": bound, "reconciler": best})
+
+    if not rules:
+        rules.append({"reconciler": reconcilers[0]})
+    del rules[-1]["maxDegree"]  # the last rule matches all larger polytomies
+    return validateRules(rules)
+
+
+
+desc = '''
+           This script measures the time and accuracy of reconcilers on the 
+           polytomies of simulated datasets, and writes a report (including a 
+           rule table for the "auto" reconciler) in JSON format.
+       '''
+
+parser = OptionParser(usage = "usage: %prog [options]", description = desc)
+parser.add_option("-d", "--datasets", dest = "datasets", metavar = "DIR",
+                  default = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         "datasets", "simulated"),
+                  help = "read simulated datasets from DIR [default: %default]")
+parser.add_option("-r", "--reconcilers", dest = "reconcilers", default = "qmc,gmrp,fml", metavar = "LIST",
+                  help = "calibrate the comma-separated reconcilers in LIST [default: %default]")
+parser.add_option("-n", "--replicates", dest = "replicates", type = "int", default = 2, metavar = "N",
+                  help = "use the first N replicates of each dataset [default: %default]")
+parser.add_option("-i", "--numIters", dest = "numIters", type = "int", default = 100, metavar = "N",
+                  help = "use N ratchet iterations with MRP [default: %default]")
+parser.add_option("-t", "--timeout", dest = "timeout", type = "float", metavar = "SECONDS",
+                  help = "cancel a reconciler on a polytomy after SECONDS [default: %default]")
+parser.add_option("-o", "--out", dest = "out", metavar = "FILE",
+                  help = "write the report to FILE instead of stdout")
+
+(options, args) = parser.parse_args()
+reconcilers = options.reconcilers.split(",")
+
+measurements = {}   # (bucket, reconciler) -> list of (seconds, change in FP + FN)
+for (sourcesFile, modelFile) in findDatasets(options.datasets, options.replicates):
+    sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(sourcesFile)]
+    tree = mergeTrees(sourceTrees, None)
+    modelTree = restrict(readNewickFile(modelFile), set(tree.get_leaves_identifiers()))
+    polytomyIndex = PolytomyIndex(tree, sourceTrees)
+
+    for polytomy in polytomyIndex.polytomies:
+        bucket = findBucket(polytomy.degree)
+        for reconciler in reconcilers:
+            reconcilerOptions = copy.copy(options)
+            (reconcilerOptions.reconciler, reconcilerOptions.compress) = (reconciler, False)
+            measurement = measurePolytomy(tree, polytomy, polytomyIndex, sourceTrees, modelTree, reconcilerOptions)
+            measurements.setdefault((bucket, reconciler), []).append(measurement)
+            sys.stderr.write("%s: degree %d, %s: %.2f s, FP + FN change %d\n"
+                             % (sourcesFile, polytomy.degree, reconciler, measurement[0], measurement[1]))
+
+buckets = {}
+for ((bucket, reconciler), values) in measurements.items():
+    buckets[(bucket, reconciler)] = {"maxDegree": bucket, "reconciler": reconciler, "polytomies": len(values),
+                                     "meanSeconds": sum([seconds for (seconds, change) in values]) / len(values),
+                                     "meanErrorChange": 1.0 * sum([change for (seconds, change) in values]) / len(values)}
+
+report = {"datasets": options.datasets,
+          "replicates": options.replicates,
+          "buckets": [buckets[key] for key in sorted(buckets.keys(), key = lambda key: (key[0] is None, key))],
+          "rules": deriveRules(buckets, reconcilers)}
+
+if options.out:
+    f = open(options.out, 'w')
+    json.dump(report, f, indent = 2)
+    f.close()
+else:
+    print(json.dumps(report, indent = 2))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Generate simulated datasets in the layout of datasets/simulated, at any
+    scale: for each number of taxa and replicate, a pure-birth model tree and
+    source trees sampled from it, namely a set of clade-based trees (each on
+    the taxa of a random clade of the model tree) and, for each scaffold
+    density, a scaffold tree on a random sample of that percentage of the
+    taxa.  Scaffolds of a replicate are nested (the taxa of the 20% scaffold
+    are among those of the 50% one, and so on), and its clade-based trees are
+    shared by all densities, as in datasets/simulated.  Source trees can be
+    perturbed by random NNI moves, to stand in for estimation error.
+
+    The files are written to DIR/<N>-taxa/<density>/sm_data.<replicate>.model_tree
+    and .source_trees (the scaffold first), so that DIR can be passed to the
+    benchmark scripts.
+'''
+
+import os
+import random
+import sys
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spruce.simulation import SimulatedTree
+
+
+def sampleSourceTrees(modelTree, rng, densities, cladeTrees, cladeSizes, moves):
+    '''
+        Return the clade-based source trees of a replicate, and its scaffold
+        tree for each density (as a dict), in Newick format.
+    '''
+    taxa = modelTree.taxa()
+    (minSize, maxSize) = [max(4, int(round(fraction * len(taxa)))) for fraction in cladeSizes]
+
+    def sample(taxonSet):
+        sourceTree = modelTree.restrict(taxonSet)
+        sourceTree.perturb(rng, moves)
+        return sourceTree.newick()
+
+    clades = []
+    for i in range(cladeTrees):
+        clade = modelTree.sampleClade(rng, minSize, maxSize)
+        if clade != None:
+            clades.append(sample(set(clade)))
+
+    order = list(taxa)
+    rng.shuffle(order)
+    scaffolds = {}
+    for density in densities:
+        scaffolds[density] = sample(set(order[:max(4, int(round(density * len(taxa) / 100.0)))]))
+    return (clades, scaffolds)
+
+
+
+desc = '''
+           This script generates model trees of any number of taxa, and source
+           trees sampled from them, in the layout of datasets/simulated.
+       '''
+
+parser = OptionParser(usage = "usage: %prog [options] DIR", description = desc)
+parser.add_option("-t", "--taxa", dest = "taxa", default = "1000", metavar = "LIST",
+                  help = "generate model trees of each comma-separated number of taxa in LIST "
+                         "[default: %default]")
+parser.add_option("-d", "--densities", dest = "densities", default = "20,50,75,100", metavar = "LIST",
+                  help = "sample a scaffold tree on each comma-separated percentage of the taxa in LIST "
+                         "[default: %default]")
+parser.add_option("-n", "--replicates", dest = "replicates", type = "int", default = 1, metavar = "N",
+                  help = "generate N replicates of each dataset [default: %default]")
+parser.add_option("-c", "--clade-trees", dest = "cladeTrees", type = "int", default = 5, metavar = "N",
+                  help = "sample N clade-based source trees per replicate [default: %default]")
+parser.add_option("--clade-sizes", dest = "cladeSizes", default = "0.3,0.9", metavar = "MIN,MAX",
+                  help = "sample clades of between the fractions MIN and MAX of the taxa "
+                         "[default: %default]")
+parser.add_option("--nni", dest = "moves", type = "int", default = 0, metavar = "N",
+                  help = "perturb each source tree by N random NNI moves [default: %default]")
+parser.add_option("--birth-rate", dest = "birthRate", type = "float", default = 1.0, metavar = "RATE",
+                  help = "grow model trees at the birth rate RATE [default: %default]")
+parser.add_option("--seed", dest = "seed", type = "int", default = 0, metavar = "N",
+                  help = "seed the random number generator with N [default: %default]")
+
+(options, args) = parser.parse_args()
+if len(args) != 1:
+    parser.error("Incorrect number of arguments. Try the -h flag for help.")
+try:
+    sizes = [int(size) for size in options.taxa.split(",")]
+    densities = [int(density) for density in options.densities.split(",")]
+    cladeSizes = [float(fraction) for fraction in options.cladeSizes.split(",")]
+except ValueError as e:
+    parser.error(str(e))
+if len(cladeSizes) != 2 or not 0 < cladeSizes[0] <= cladeSizes[1] < 1:
+    parser.error("--clade-sizes takes two fractions, 0 < MIN <= MAX < 1")
+if [density for density in densities if not 0 < density <= 100]:
+    parser.error("densities are percentages of the taxa, between 1 and 100")
+
+rng = random.Random(options.seed)
+for size in sizes:
+    for replicate in range(options.replicates):
+        modelTree = SimulatedTree.pureBirth(["t%d" % i for i in range(size)], rng, options.birthRate)
+        (clades, scaffolds) = sampleSourceTrees(modelTree, rng, densities, options.cladeTrees, cladeSizes,
+                                                options.moves)
+        modelNewick = modelTree.newick(False)
+
+        for density in densities:
+            directory = os.path.join(args[0], "%d-taxa" % size, str(density))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            prefix = os.path.join(directory, "sm_data.%d." % replicate)
+
+            f = open(prefix + "model_tree", 'w')
+            f.write(modelNewick + "\n")
+            f.close()
+            f = open(prefix + "source_trees", 'w')
+            f.write("\n".join([scaffolds[density]] + clades) + "\n")
+            f.close()
+
+        sys.stderr.write("%d taxa, replicate %d: %d clade-based source trees\n" % (size, replicate, len(clades)))
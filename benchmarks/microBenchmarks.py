@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Time the hot kernels of SuperFine (Newick parsing, bipartition and quartet
+    enumeration, restriction, the strict consensus merger, matrix
+    representation, and source tree collapsing) on random trees of increasing
+    size, and report each kernel's scaling exponent: the slope of its time
+    against the number of taxa, on a log-log scale.  Each kernel is expected
+    to scale no worse than the size of its output; a larger exponent (e.g. a
+    quadratic kernel with a linear output) is flagged.
+'''
+
+import json
+import math
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dendropy.dataio import trees_from_newick
+from dendropy.scripts.strict_consensus_merge import strict_consensus_merge
+from matrix_representation.MatrixRepresentation import MatrixRepresentation
+from newick_modified.tree import parse_tree
+from spruce.unrooted import findDisplayedQtrees, restrict, xfindBipartitions
+from superfine.SuperFine import collapseTree
+from superfine.adapters import SCMAdapter
+from superfine.relabeling import RelabeledView
+
+
+def randomNewick(rng, taxa):
+    '''
+        Return a random binary tree on the given taxa, in Newick format; sibling
+        clades are joined at random, so that it is built in O(n log n) time.
+    '''
+    clades = [str(taxon) for taxon in taxa]
+    while len(clades) > 3:
+        pair = []
+        for i in range(2):
+            j = rng.randrange(len(clades))
+            (clades[j], clades[-1]) = (clades[-1], clades[j])
+            pair.append(clades.pop())
+        clades.append("(%s,%s)" % tuple(pair))
+    return "(%s);" % ",".join(clades)
+
+
+
+def makeTaxa(size):
+    return ["t%d" % i for i in range(size)]
+
+
+
+def sampleSources(rng, size, trees = 10, density = 0.5):
+    '''Return Newick source trees, each on a random sample of the given fraction of the taxa.'''
+    taxa = makeTaxa(size)
+    return [randomNewick(rng, rng.sample(taxa, max(4, int(size * density)))) for i in range(trees)]
+
+
+
+def prepareParse(rng, size):
+    return randomNewick(rng, makeTaxa(size))
+
+def prepareTree(rng, size):
+    return parse_tree(randomNewick(rng, makeTaxa(size)))
+
+def prepareRestrict(rng, size):
+    taxa = makeTaxa(size)
+    return (parse_tree(randomNewick(rng, taxa)), set(rng.sample(taxa, size // 2)))
+
+def prepareGetNextPair(rng, size):
+    # source trees of 50 taxa, one per ten taxa of the supertree
+    taxa = makeTaxa(size)
+    return SCMAdapter([parse_tree(randomNewick(rng, rng.sample(taxa, 50))) for i in range(size // 10)], "scm")
+
+def prepareMerge(rng, size):
+    # two trees overlapping on half of their taxa, as dendropy trees
+    taxa = makeTaxa(size)
+    rng.shuffle(taxa)
+    (left, right) = (taxa[:size * 3 // 4], taxa[size // 4:])
+    data = trees_from_newick((randomNewick(rng, left), randomNewick(rng, right)))
+    return [block[0] for block in data.trees_blocks]
+
+def prepareMatrix(rng, size):
+    return [parse_tree(source) for source in sampleSources(rng, size)]
+
+def prepareRenderers(rng, size):
+    return MatrixRepresentation(prepareMatrix(rng, size))
+
+def prepareCollapse(rng, size):
+    # a source tree relabeled by the 16 groups of a polytomy, each of them a clade
+    taxa = makeTaxa(size)
+    groups = [taxa[i::16] for i in range(16)]
+    clades = [randomNewick(rng, group)[:-1] for group in groups]
+    tree = parse_tree(randomNewick(rng, clades))
+    relabeling = dict([(taxon, i) for (i, group) in enumerate(groups) for taxon in group])
+    return RelabeledView(tree, relabeling, len(groups)).materialize()
+
+def renderMatrix(matrix):
+    for format in MatrixRepresentation.supported_formats():
+        matrix.to_string(format)
+
+
+# name: (preparation of the input of a given size, kernel, expected exponent, largest size);
+#   the expected exponent is that of the size of the output (e.g. a tree's bipartitions list
+#   O(n) taxa each, and a tree displays O(n^4) quartet trees); kernels with a quadratic (or
+#   worse) output are timed up to the largest size only, and the quartet trees are enumerated
+#   only on trees of the size of a collapsed source tree
+KERNELS = {"parse_tree": (prepareParse, parse_tree, 1, None),
+           "xfindBipartitions": (prepareTree, lambda tree: list(xfindBipartitions(tree)), 2, 1000),
+           "findDisplayedQtrees": (prepareTree, findDisplayedQtrees, 4, 40),
+           "restrict": (prepareRestrict, lambda args: restrict(*args), 1, None),
+           "SCMAdapter.getNextPair": (prepareGetNextPair, lambda adapter: adapter.getNextPair(), 2, None),
+           "strict_consensus_merge": (prepareMerge, strict_consensus_merge, 1, None),
+           "MatrixRepresentation": (prepareMatrix, MatrixRepresentation, 2, 320),
+           "MatrixRepresentation.to_string": (prepareRenderers, renderMatrix, 2, 320),
+           "collapseTree": (prepareCollapse, collapseTree, 1, None)}
+
+# sizes of the quartet trees' ladder
+QUARTET_SIZES = (10, 14, 20, 28, 40)
+
+
+def timeKernel(prepare, kernel, size, repeats, seed):
+    '''
+        Return the least time (in seconds) of a kernel on inputs of the given
+        size.  Inputs are prepared afresh (and untimed) for each call, since
+        some kernels consume theirs; calls quicker than a millisecond are
+        batched.
+    '''
+    rng = random.Random(seed)
+    best = None
+    number = 1
+    for repeat in range(repeats):
+        inputs = [prepare(rng, size) for i in range(number)]
+        start = time.perf_counter()
+        for input in inputs:
+            kernel(input)
+        seconds = (time.perf_counter() - start) / number
+        if best == None or seconds < best:
+            best = seconds
+        if seconds * number < 0.001:
+            number = min(100, number * 10)
+    return (best)
+
+
+
+def fitExponent(sizes, times):
+    '''Return the least-squares slope of log(time) against log(size).'''
+    points = [(math.log(size), math.log(seconds)) for (size, seconds) in zip(sizes, times) if seconds > 0]
+    if len(points) < 2:
+        return None
+    meanX = sum([x for (x, y) in points]) / len(points)
+    meanY = sum([y for (x, y) in points]) / len(points)
+    variance = sum([(x - meanX) ** 2 for (x, y) in points])
+    return sum([(x - meanX) * (y - meanY) for (x, y) in points]) / variance
+
+
+
+desc = '''
+           This script times SuperFine's hot kernels on random trees of
+           increasing size and reports their scaling exponents.
+       '''
+
+parser = OptionParser(usage = "usage: %prog [options] [KERNEL ...]", description = desc)
+parser.add_option("-s", "--sizes", dest = "sizes", metavar = "LIST",
+                  default = "100,180,320,560,1000,1800,3200,5600,10000",
+                  help = "time the kernels on trees of the comma-separated numbers of taxa in LIST "
+                         "[default: %default]")
+parser.add_option("-k", "--repeat", dest = "repeat", type = "int", default = 5, metavar = "N",
+                  help = "keep the best of N timings of each kernel and size [default: %default]")
+parser.add_option("--seed", dest = "seed", type = "int", default = 0, metavar = "N",
+                  help = "seed the random trees with N [default: %default]")
+parser.add_option("--tolerance", dest = "tolerance", type = "float", default = 0.3, metavar = "X",
+                  help = "flag kernels whose exponent exceeds the expected one by more than X "
+                         "[default: %default]")
+parser.add_option("--check", action = "store_true", dest = "check", default = False,
+                  help = "exit with status 1 if a kernel is flagged [default: %default]")
+parser.add_option("-o", "--out", dest = "out", metavar = "FILE",
+                  help = "also write the timings and exponents to FILE in JSON format")
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+    for name in args:
+        if name not in KERNELS:
+            parser.error("unknown kernel %s (one of %s)" % (name, ", ".join(sorted(KERNELS))))
+    sizes = [int(size) for size in options.sizes.split(",")]
+
+    report = {}
+    flagged = []
+    for name in sorted(args or KERNELS):
+        (prepare, kernel, expected, largest) = KERNELS[name]
+        ladder = QUARTET_SIZES if name == "findDisplayedQtrees" else [size for size in sizes
+                                                                        if largest == None or size <= largest]
+        times = [timeKernel(prepare, kernel, size, options.repeat, options.seed) for size in ladder]
+        exponent = fitExponent(ladder, times)
+        report[name] = {"sizes": ladder, "seconds": times, "exponent": exponent, "expected": expected}
+
+        mark = ""
+        if exponent != None and exponent > expected + options.tolerance:
+            flagged.append(name)
+            mark = "  SLOWER THAN EXPECTED"
+        print("%-32s %s  exponent %s (expected %d)%s"
+              % (name, " ".join(["%d: %.2e s" % (size, seconds) for (size, seconds) in zip(ladder, times)]),
+                 "%.2f" % exponent if exponent != None else "n/a", expected, mark))
+        sys.stdout.flush()
+
+    if options.out:
+        f = open(options.out, 'w')
+        json.dump(report, f, indent = 2)
+        f.close()
+    if options.check and flagged:
+        sys.exit(1)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Run SuperFine end to end on the simulated datasets and record the wall
+    time, CPU time and peak memory of each of its phases (read, scm, refine,
+    expand, write).  Polytomies are resolved by an in-process stub in place of
+    the external reconciler, so that no QMC, PAUP* or FastTree is needed and
+    the times are those of SuperFine's own code.  Each run is made in a fresh
+    process, so that peak memory is not carried over from one run to the next.
+
+    The results are stored in a JSON file, keyed by git revision, and the
+    phase totals (over all datasets) can be compared against those of a
+    baseline revision; the script exits with status 1 if a phase is slower,
+    or the runs use more memory, than the thresholds allow.
+'''
+
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from multiprocessing import Pipe, Process, set_start_method
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import superfine.SuperFine
+from superfine.SuperFine import SuperFine
+from runSuperFine import parse_options
+
+
+# the stages of a run, as recorded by the logger
+PHASES = ("read", "scm", "refine", "expand", "write")
+
+
+class StubAdapter(object):
+    '''
+        Stand in for an external reconciler: resolve the groups named by the
+        quartet trees (or the relabeled source trees) into a caterpillar, in
+        order of group number, without calling a subprocess.
+    '''
+
+    def __init__(self, trees):
+        self.trees = trees
+
+    def get_tree(self):
+        if isinstance(self.trees, dict):  # quartet trees, as "a,b|c,d"
+            labels = set([label for qTree in self.trees for label in qTree.replace('|', ',').split(',')])
+        else:
+            labels = set([label for tree in self.trees for label in tree.get_leaves_identifiers()])
+        groups = sorted([int(label) for label in labels])
+
+        tree = str(groups[0])
+        for group in groups[1:]:
+            tree = "(%s,%d)" % (tree, group)
+        return (tree + ";")
+
+
+
+def findStubTiers(trees, options):
+    '''Return the stub as the only reconciler to try on a polytomy.'''
+    return [("stub (%s)" % options.reconciler, StubAdapter(trees))]
+
+
+
+def findDatasets(directory, replicates):
+    '''Return (name, source trees file) pairs of the first replicates of each simulated dataset.'''
+    datasets = []
+    for sourcesFile in sorted(glob.glob(os.path.join(directory, "*", "*", "sm_data.*.source_trees"))):
+        replicate = int(os.path.basename(sourcesFile).split(".")[1])
+        if replicate < replicates:
+            name = os.path.relpath(sourcesFile, directory)[:-len(".source_trees")]
+            datasets.append((name, sourcesFile))
+    return (datasets)
+
+
+
+def findRevision():
+    '''Return the git revision of the tree (marked as dirty if it has uncommitted changes), or None.'''
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT,
+                                           stderr = subprocess.STDOUT, universal_newlines = True).strip()
+        changes = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd = ROOT,
+                                          stderr = subprocess.STDOUT, universal_newlines = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if changes:
+        revision += "-dirty"
+    return (revision)
+
+
+
+def runSuperFine(input, arguments, sender, stub):
+    '''
+        Run SuperFine on the input (in a child process), with the stub in place
+        of the external reconciler if asked; send back the records of its
+        stages.
+    '''
+    if stub:    # inherited by SuperFine's own workers, which are forked
+        superfine.SuperFine.findReconcilerTiers = findStubTiers
+    f = tempfile.NamedTemporaryFile(suffix = ".json", delete = False)
+    statsFile = f.name
+    f.close()
+
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # the SuperFine tree
+    try:
+        (input, options) = parse_options(arguments + ["--stats", statsFile, input])
+        SuperFine(input, options)
+        f = open(statsFile)
+        phases = json.load(f)["phases"]
+        f.close()
+        sender.send((None, phases))
+    except Exception as e:
+        sender.send(("%s: %s" % (e.__class__.__name__, e), None))
+    finally:
+        sys.stdout = stdout
+        os.remove(statsFile)
+
+
+
+def measureRun(input, arguments, stub):
+    '''
+        Run SuperFine on the input in a fresh process; return the wall time,
+        CPU time and peak memory of each stage.
+    '''
+    (receiver, sender) = Pipe(False)
+    process = Process(target = runSuperFine, args = (input, arguments, sender, stub))
+    process.start()
+    (error, phases) = receiver.recv()
+    process.join()
+    if error:
+        raise RuntimeError("SuperFine failed on %s: %s" % (input, error))
+
+    measurements = {}
+    for record in phases:
+        peakRss = max([record[key] or 0 for key in ("peakRssKb", "peakChildRssKb")])
+        measurements[record["phase"]] = {"wallSeconds": record["wallSeconds"],
+                                         "cpuSeconds": record["cpuSeconds"],
+                                         "peakRssKb": peakRss or None}
+    return (measurements)
+
+
+
+def measureDataset(input, arguments, repeats, stub):
+    '''Return the best (least) time and memory of each stage over repeated runs on the input.'''
+    best = {}
+    for repeat in range(repeats):
+        for (phase, measurement) in measureRun(input, arguments, stub).items():
+            if phase not in best:
+                best[phase] = measurement
+                continue
+            for (metric, value) in measurement.items():
+                if value != None and (best[phase][metric] == None or value < best[phase][metric]):
+                    best[phase][metric] = value
+    return (best)
+
+
+
+def totalPhases(datasets):
+    '''
+        Return the time of each stage summed over the datasets, and its peak
+        memory as the largest over them.
+    '''
+    totals = {}
+    for phases in datasets.values():
+        for (phase, measurement) in phases.items():
+            total = totals.setdefault(phase, {"wallSeconds": 0.0, "cpuSeconds": 0.0, "peakRssKb": None})
+            total["wallSeconds"] += measurement["wallSeconds"]
+            total["cpuSeconds"] += measurement["cpuSeconds"]
+            if measurement["peakRssKb"] != None:
+                total["peakRssKb"] = max(total["peakRssKb"] or 0, measurement["peakRssKb"])
+    return (totals)
+
+
+
+def compareResults(baseline, current, maxSlowdown, maxGrowth, minSeconds):
+    '''
+        Compare the stage totals of a run against those of a baseline run, over
+        the datasets both measured.  Return a row (phase, metric, baseline
+        value, current value, regressed) for the wall time of each stage, which
+        regresses if it grows by more than the fraction maxSlowdown (and by at
+        least minSeconds), and one for the peak memory of the runs, which
+        regresses if it grows by more than the fraction maxGrowth.  The peak
+        memory recorded with a stage is that of the process so far, so only
+        the overall peak is compared: a stage which allocates nothing would
+        otherwise be blamed for the growth of any stage before it.
+    '''
+    names = set(baseline["datasets"]) & set(current["datasets"])
+    (before, after) = [totalPhases(dict([(name, results["datasets"][name]) for name in names]))
+                       for results in (baseline, current)]
+
+    rows = []
+    for phase in [phase for phase in PHASES if phase in before and phase in after]:
+        (old, new) = (before[phase]["wallSeconds"], after[phase]["wallSeconds"])
+        rows.append((phase, "wallSeconds", old, new, new > old * (1 + maxSlowdown) and new - old >= minSeconds))
+    (old, new) = [max([total["peakRssKb"] or 0 for total in totals.values()] + [0]) for totals in (before, after)]
+    if old and new:
+        rows.append(("all", "peakRssKb", old, new, new > old * (1 + maxGrowth)))
+    return (rows)
+
+
+
+desc = '''
+           This script runs SuperFine, with an in-process stub in place of the
+           external reconciler, on simulated datasets; records the time and
+           peak memory of each phase as JSON, keyed by git revision; and
+           compares them against a baseline revision.
+       '''
+
+parser = OptionParser(usage = "usage: %prog [options]", description = desc)
+parser.add_option("-d", "--datasets", dest = "datasets", metavar = "DIR",
+                  default = os.path.join(ROOT, "datasets", "simulated"),
+                  help = "read simulated datasets from DIR [default: %default]")
+parser.add_option("-n", "--replicates", dest = "replicates", type = "int", default = 1, metavar = "N",
+                  help = "use the first N replicates of each dataset [default: %default]")
+parser.add_option("-r", "--reconcile", dest = "reconciler", default = "qmc", metavar = "ALG",
+                  choices = ("qmc", "gmrp", "rmrp", "fml", "rml", "auto"),
+                  help = "refine polytomies as for ALG: quartet trees are encoded for qmc, and "
+                         "relabeled source trees are kept otherwise [default: %default]")
+parser.add_option("-e", "--external", action = "store_true", dest = "external", default = False,
+                  help = "call the external reconciler instead of the stub [default: %default]")
+parser.add_option("-j", "--jobs", dest = "jobs", type = "int", default = 1, metavar = "N",
+                  help = "run SuperFine with N worker processes [default: %default]")
+parser.add_option("-k", "--repeat", dest = "repeat", type = "int", default = 3, metavar = "N",
+                  help = "run SuperFine N times on each dataset, keeping the best times [default: %default]")
+parser.add_option("-o", "--results", dest = "results", metavar = "FILE",
+                  default = os.path.join(ROOT, "benchmarks", "results.json"),
+                  help = "add the results to those of other revisions in FILE [default: %default]")
+parser.add_option("-l", "--label", dest = "label", metavar = "NAME",
+                  help = "store the results under NAME instead of the git revision")
+parser.add_option("-b", "--baseline", dest = "baseline", metavar = "REV",
+                  help = "compare the results against those stored for REV")
+parser.add_option("--max-slowdown", dest = "maxSlowdown", type = "float", default = 0.1, metavar = "FRACTION",
+                  help = "fail if a phase takes more than FRACTION longer than in the baseline "
+                         "[default: %default]")
+parser.add_option("--max-memory-growth", dest = "maxGrowth", type = "float", default = 0.1, metavar = "FRACTION",
+                  help = "fail if the peak memory of the runs is more than FRACTION larger than in the baseline "
+                         "[default: %default]")
+parser.add_option("--min-seconds", dest = "minSeconds", type = "float", default = 0.05, metavar = "SECONDS",
+                  help = "ignore slowdowns of less than SECONDS [default: %default]")
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+    label = options.label or findRevision()
+    if label == None:
+        parser.error("not in a git repository; name the results with --label")
+
+    stored = {}
+    if os.path.exists(options.results):
+        f = open(options.results)
+        stored = json.load(f)
+        f.close()
+    if options.baseline and options.baseline not in stored:
+        parser.error("no results for %s in %s" % (options.baseline, options.results))
+
+    if not options.external:
+        # the stub is installed in each run's process, and reaches the workers of
+        #   the run only if they are forked from it
+        set_start_method("fork")
+    arguments = ["-r", options.reconciler, "-j", str(options.jobs)]
+
+    datasets = {}
+    for (name, sourcesFile) in findDatasets(options.datasets, options.replicates):
+        datasets[name] = measureDataset(sourcesFile, arguments, options.repeat, not options.external)
+        sys.stderr.write("%s: %s\n" % (name, ", ".join(["%s %.3f s" % (phase, datasets[name][phase]["wallSeconds"])
+                                                        for phase in PHASES if phase in datasets[name]])))
+
+    results = {"date": datetime.datetime.now().isoformat(),
+               "python": platform.python_version(),
+               "reconciler": options.reconciler if options.external else "stub (%s)" % options.reconciler,
+               "jobs": options.jobs,
+               "repeat": options.repeat,
+               "datasets": datasets,
+               "totals": totalPhases(datasets)}
+    stored[label] = results
+    f = open(options.results, 'w')
+    json.dump(stored, f, indent = 1, sort_keys = True)
+    f.write("\n")
+    f.close()
+
+    if options.baseline:
+        baseline = stored[options.baseline]
+        for key in ("reconciler", "jobs"):
+            if baseline[key] != results[key]:
+                sys.stderr.write("warning: %s was run with %s %s, not %s\n"
+                                 % (options.baseline, key, baseline[key], results[key]))
+
+        rows = compareResults(baseline, results, options.maxSlowdown, options.maxGrowth, options.minSeconds)
+        print("%-8s %-12s %14s %14s %8s" % ("phase", "metric", options.baseline, label, "change"))
+        for (phase, metric, old, new, regressed) in rows:
+            change = "%+.1f%%" % (100.0 * (new - old) / old) if old else "n/a"
+            print("%-8s %-12s %14.3f %14.3f %8s%s"
+                  % (phase, metric, old, new, change, "  REGRESSION" if regressed else ""))
+        if [row for row in rows if row[4]]:
+            sys.exit(1)
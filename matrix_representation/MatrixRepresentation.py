@@ -53,7 +53,7 @@ class MatrixRepresentation(object):
         combining overlapping gene data sets. Alg Mol Bio. 2010;5:37-53.
     """
 
-    def __init__(self, source_trees, unknown_site_as_indel=False, nucleotide=False, validate=False):
+    def __init__(self, source_trees, unknown_site_as_indel=False, nucleotide=False, validate=False, compress=False):
         """
         Creates a new instance of ``MatrixRepresentation``.
 
@@ -70,6 +70,8 @@ class MatrixRepresentation(object):
         otherwise a matrix over ``{A, C, ?}`` or over ``{A, C, -}``
         :param validate: Allows to bypass the validation of parameters ``source_trees``, ``unknown_site_as_indel``, and
         ``nucleotide``.  In other words, it allows to say:  - In user we trust!  Thus, performance is improved.
+        :param compress: If ``True`` then identical sites are collapsed into a single site pattern,
+        and the multiplicity of each site pattern is kept in ``site_weights``
 
 
         References:
@@ -92,6 +94,8 @@ class MatrixRepresentation(object):
                 raise TypeError("The given \"unknown_site_as_indel\" is NOT an instance of Boolean.")
             if not isinstance(nucleotide, bool):
                 raise TypeError("The given \"nucleotide\" is NOT an instance of Boolean.")
+            if not isinstance(compress, bool):
+                raise TypeError("The given \"compress\" is NOT an instance of Boolean.")
 
         self.__SOURCE_TREES = source_trees
         self.__UNKNOWN_SITE = '?' if (not unknown_site_as_indel) else '-'
@@ -107,6 +111,10 @@ class MatrixRepresentation(object):
         self.__number_of_sites = 0
         # the matrix representation of the given source trees
         self.__SUPERMATRIX = self.__compute_supermatrix()
+        self.__number_of_original_sites = self.__number_of_sites
+        self.__site_weights = [1] * self.__number_of_sites
+        if compress:
+            self.__compress_supermatrix()
 
     @staticmethod
     def source_trees_from_file(filename, validate=False):
@@ -207,6 +215,33 @@ class MatrixRepresentation(object):
 
         return supermatrix
 
+    def __compress_supermatrix(self):
+        """
+        Collapses identical sites of the supermatrix into unique site patterns, keeping the first occurrence of each
+        site pattern and counting its multiplicity in ``site_weights``.
+        """
+        taxa = list(self.__SUPERMATRIX.keys())
+        patterns = {}
+        kept_sites = []
+        site_weights = []
+
+        for (site, pattern) in enumerate(zip(*[self.__SUPERMATRIX[taxon] for taxon in taxa])):
+            index = patterns.get(pattern)
+            if index is None:
+                patterns[pattern] = len(kept_sites)
+                kept_sites.append(site)
+                site_weights.append(1)
+            else:
+                site_weights[index] += 1
+
+        if len(kept_sites) < self.__number_of_sites:
+            for taxon in taxa:
+                sites = self.__SUPERMATRIX[taxon]
+                self.__SUPERMATRIX[taxon] = [sites[site] for site in kept_sites]
+
+        self.__number_of_sites = len(kept_sites)
+        self.__site_weights = site_weights
+
     def __get_number_of_species(self):
         """
         Returns the number of species that the supermatrix has.
@@ -223,6 +258,22 @@ class MatrixRepresentation(object):
         """
         return self.__number_of_sites
 
+    def __get_number_of_original_sites(self):
+        """
+        Returns the number of sites that the supermatrix had before being compressed.
+
+        :return: The number of sites that the supermatrix had before being compressed.
+        """
+        return self.__number_of_original_sites
+
+    def __get_site_weights(self):
+        """
+        Returns the multiplicity of each site of the supermatrix (all ones if it was not compressed).
+
+        :return: The multiplicity of each site of the supermatrix.
+        """
+        return self.__site_weights
+
     def __get_supermatrix(self):
         """
         Returns the supermatrix.
@@ -370,6 +421,10 @@ class MatrixRepresentation(object):
                                 "Returns the number of species that the supermatrix has.")
     number_of_sites = property(__get_number_of_sites, None, None,
                                 "Returns the number of sites that the supermatrix has.")
+    number_of_original_sites = property(__get_number_of_original_sites, None, None,
+                                "Returns the number of sites that the supermatrix had before being compressed.")
+    site_weights = property(__get_site_weights, None, None,
+                                "Returns the multiplicity of each site of the supermatrix.")
     matrix = property(__get_supermatrix, None, None,
                                 "Returns the supermatrix.")
     fasta_format = property(__fasta_format, None, None,
@@ -27,8 +27,12 @@
 #   The license is exactly the same of the baseline implementation (see above).                                        #
 ########################################################################################################################
 
+import os, sys
 from optparse import OptionParser, OptionGroup
 from superfine.SuperFine import SuperFine
+from superfine.checkpoint import CheckpointError
+from superfine.selection import readRules
+from superfine.workqueue import HEARTBEAT_SECONDS
 
 
 def parse_options(command_line=None):
@@ -36,26 +40,46 @@ def parse_options(command_line=None):
 
     desc = "This script runs the superfine algorithm on a set of input trees given in a file, in Newick format."
 
-    parser = OptionParser(usage="usage: %prog [options] input_trees_file > output",
+    parser = OptionParser(usage="usage: %prog [options] input_trees_file > output\n"
+                                "       %prog --batch [options] input_trees_file_or_glob ...\n"
+                                "       %prog --serve SOCKET [options]\n"
+                                "       %prog --work DIR [options]",
                           version="%prog 1.0", description=desc)
 
-    parser.set_defaults(reconciler="qmc", numIters=100, writeData=None)
+    parser.set_defaults(reconciler="qmc", numIters=100, compress=False, writeData=None, verbose=False, jobs=1,
+                        timeout=None, rules=None, reconcilerRules=None, checkpointDir=None,
+                        update=None, stats=None, profile=None, profileSlowest=0,
+                        trace=None, batch=False, serve=None, maxJobs=4, maxQueued=16,
+                        queue=None, lease=60.0, work=None, idle=None)
 
     group4InfoString = "These options enable selection of the supertree algorithm " \
                        "to be used as a subroutine within superfine for resolving polytomies.  " \
                        "The 'qmc' option requires that Quartets MaxCut be installed; " \
                        "the 'gmrp' (greedy consensus of MP trees) and 'rmrp' (random MP tree) options " \
                        "require that PAUP* be installed; " \
-                       "the 'fml' option requires that FastTree be installed; and " \
-                       "the 'rml' option requires that RAxML be installed.  " \
+                       "the 'fml' option requires that FastTree be installed; " \
+                       "the 'rml' option requires that RAxML be installed; and " \
+                       "the 'auto' option picks one of these for each polytomy, by its size.  " \
                        "Note that the selected subroutine's binary must be in the system's executable search path."
     group4 = OptionGroup(parser, "Quartet Tree Reconciliation Options".upper(), group4InfoString)
-    group4.add_option("-r", "--reconcile", choices=("qmc", "gmrp", "rmrp", "fml", "rml"),
+    group4.add_option("-r", "--reconcile", choices=("qmc", "gmrp", "rmrp", "fml", "rml", "auto"),
                       dest="reconciler", metavar="ALG",
                       help="use ALG to reconcile relabeled trees, "
-                           "where ALG is one of {qmc, gmrp, rmrp} [default: %default]")
+                           "where ALG is one of {qmc, gmrp, rmrp, fml, rml, auto} [default: %default]")
+    group4.add_option("--rules", dest="rules", metavar="FILE",
+                      help="with '-r auto', pick each polytomy's reconciler by the rule table in the "
+                           "JSON file FILE (e.g. as written by benchmarks/calibrateReconcilers.py) "
+                           "instead of the built-in one [default: %default]")
     group4.add_option("-n", "--numIters", type="int", dest="numIters", metavar="N",
                       help="use N ratchet iterations when resolving with MRP [default: %default]")
+    group4.add_option("-c", "--compress", action="store_true", dest="compress",
+                      help="collapse identical matrix characters into weighted site patterns "
+                           "when resolving with MRP or MRL [default: %default]")
+    group4.add_option("-t", "--timeout", type="float", dest="timeout", metavar="SECONDS",
+                      help="give the subroutine SECONDS in all on a polytomy: MRP is cancelled after nine "
+                           "tenths of them, then falls back to fewer ratchet iterations for the time left; "
+                           "a polytomy left out of time stays unresolved; fallbacks are reported with -v and "
+                           "in the --stats file [default: %default]")
     parser.add_option_group(group4)
 
     group5InfoString = ' '.join(["This option causes output of both the final",
@@ -71,15 +95,115 @@ def parse_options(command_line=None):
                            "to written file names [default: %default]")
     parser.add_option_group(group5)
 
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                      help="print run statistics to stderr [default: %default]")
+    parser.add_option("--stats", dest="stats", metavar="FILE",
+                      help="write the wall time, CPU time, peak memory and counts (trees, quartets, "
+                           "sites, degree) of each phase of the run, and of each polytomy's steps, "
+                           "to FILE in JSON format [default: %default]")
+    parser.add_option("--profile", dest="profile", metavar="DIR",
+                      help="profile each stage of the run (and each polytomy resolved by a worker "
+                           "process) with cProfile, writing .pstats files and collapsed stacks for "
+                           "flame graphs to DIR [default: %default]")
+    parser.add_option("--profile-slowest", type="int", dest="profileSlowest", metavar="N",
+                      help="with --profile, also write the profiles of the N slowest polytomies "
+                           "[default: %default]")
+    parser.add_option("--trace", dest="trace", metavar="FILE",
+                      help="write a timeline of the run's phases, of each polytomy resolved by a "
+                           "worker process and of each external command to FILE in Chrome trace "
+                           "format, for chrome://tracing or Perfetto [default: %default]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", metavar="N",
+                      help="relabel source trees and resolve polytomies using a pool of N "
+                           "worker processes [default: %default]")
+    parser.add_option("--checkpoint-dir", dest="checkpointDir", metavar="DIR",
+                      help="save the merger tree and each resolved polytomy to DIR as the run goes; "
+                           "rerun with the same DIR to resume an interrupted run [default: %default]")
+    parser.add_option("-u", "--update", dest="update", metavar="DIR",
+                      help="update the run checkpointed in DIR with the source trees of input_trees_file "
+                           "which it did not have: merge them into its merger tree and reuse the "
+                           "polytomies which they do not inform; the number of recomputed polytomies "
+                           "is reported with -v [default: %default]")
+
+    parser.add_option("--batch", action="store_true", dest="batch",
+                      help="run on each of the input files (or files matched by glob patterns) in "
+                           "turn, in a single process with one pool of -j worker processes shared by "
+                           "all of them; each merger tree and final tree is written next to its input "
+                           "file as with -w (whose suffix defaults to 'tre'), and --stats reports on "
+                           "every dataset [default: %default]")
+
+    parser.add_option("--serve", dest="serve", metavar="SOCKET",
+                      help="run as a server taking jobs (source trees and options, in JSON format) on "
+                           "the Unix domain socket SOCKET, and streaming back their trees and stats; "
+                           "jobs run on one warm pool of -j worker processes, with the other options "
+                           "as defaults (see superfine/server.py) [default: %default]")
+    parser.add_option("--max-jobs", type="int", dest="maxJobs", metavar="N",
+                      help="with --serve, run at most N jobs at once [default: %default]")
+    parser.add_option("--max-queued", type="int", dest="maxQueued", metavar="N",
+                      help="with --serve, let at most N more jobs wait for a free slot, and turn "
+                           "others down as busy [default: %default]")
+
+    parser.add_option("--queue", dest="queue", metavar="DIR",
+                      help="reconcile polytomies on the workers serving the work queue in the directory "
+                           "DIR, which may be shared by several hosts (see --work); source trees are "
+                           "still relabeled by the -j local worker processes [default: %default]")
+    parser.add_option("--lease", type="float", dest="lease", metavar="SECONDS",
+                      help="with --queue, requeue a polytomy whose worker has given no sign of life "
+                           "(which workers give every %g seconds) for SECONDS, at least %g, for another "
+                           "worker to reconcile [default: %%default]" % (HEARTBEAT_SECONDS, 3 * HEARTBEAT_SECONDS))
+    parser.add_option("--work", dest="work", metavar="DIR",
+                      help="run -j worker processes reconciling the polytomies queued in the directory "
+                           "DIR by runs with --queue, until interrupted; anyone who can write to DIR can "
+                           "run code as these workers, so keep it writable by trusted users only "
+                           "[default: %default]")
+    parser.add_option("--idle", type="float", dest="idle", metavar="SECONDS",
+                      help="with --work, stop once no polytomy has been queued for SECONDS "
+                           "[default: %default]")
+
     if command_line:
          (options, args) = parser.parse_args(command_line)
     else:
         (options, args) = parser.parse_args()
 
-    if len(args) != 1:
+    if options.batch:
+        if len(args) == 0:
+            parser.error("Incorrect number of arguments. Try the -h flag for help.")
+        if options.checkpointDir or options.update or options.profile or options.trace:
+            parser.error("--batch cannot be combined with --checkpoint-dir, --update, --profile or --trace")
+        if not options.writeData:
+            options.writeData = "tre"
+        input = args
+    elif options.work:
+        if len(args) != 0:
+            parser.error("Incorrect number of arguments. Try the -h flag for help.")
+        input = options.work
+    elif options.serve:
+        if len(args) != 0:
+            parser.error("Incorrect number of arguments. Try the -h flag for help.")
+        if options.checkpointDir or options.update or options.profile or options.trace or \
+                options.writeData or options.stats or options.queue:
+            parser.error("--serve cannot be combined with --checkpoint-dir, --update, --profile, --trace, "
+                         "--write, --stats or --queue")
+        if options.maxJobs < 1 or options.maxQueued < 0:
+            parser.error("--max-jobs must be positive, and --max-queued cannot be negative")
+        input = options.serve
+    elif len(args) != 1:
         parser.error("Incorrect number of arguments. Try the -h flag for help.")
+    else:
+        input = args[0]
+
+    if options.lease < 3 * HEARTBEAT_SECONDS:
+        parser.error("--lease must be at least %g seconds, three times the interval between workers' signs of life"
+                     % (3 * HEARTBEAT_SECONDS))
+
+    if options.update and options.checkpointDir and \
+            os.path.abspath(options.update) == os.path.abspath(options.checkpointDir):
+        parser.error("the updated run must be checkpointed to a new directory")
 
-    input = args[0]
+    if options.rules:
+        try:
+            options.reconcilerRules = readRules(options.rules)
+        except (IOError, ValueError) as e:
+            parser.error("cannot read reconciler rules from %s: %s" % (options.rules, e))
 
     return (input, options)
 
@@ -88,4 +212,24 @@ def parse_options(command_line=None):
 if __name__ == '__main__':
     (input, options) = parse_options()
 
-    SuperFine(input, options)
+    if options.batch:
+        from superfine.batch import SuperFineBatch
+        try:
+            sys.exit(1 if SuperFineBatch(input, options) else 0)
+        except IOError as e:
+            sys.exit("%s: error: %s" % (os.path.basename(sys.argv[0]), e))
+
+    if options.work:
+        from superfine.workqueue import SuperFineWork
+        SuperFineWork(input, options)
+        sys.exit(0)
+
+    if options.serve:
+        from superfine.server import SuperFineServe
+        SuperFineServe(input, options)
+        sys.exit(0)
+
+    try:
+        SuperFine(input, options)
+    except CheckpointError as e:
+        sys.exit("%s: error: %s" % (os.path.basename(sys.argv[0]), e))
@@ -22,6 +22,8 @@
 
 import os
 import tempfile
+from multiprocessing import Pool
+from operator import add
 from subprocess import Popen, PIPE
 
 from spruce.unrooted import *
@@ -97,7 +99,80 @@ def getRawFpFn (trueTree, estimatedTree, twoWay = False):
 
 
 
-def sumErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False):
+# bipartitions of the tree being scored by a worker process of getErrorsPerSource()
+_scoredCladeMasks = None
+
+
+def _setScoredTree(cladeMasks):
+    '''Keep the tree being scored in a worker process.'''
+    global _scoredCladeMasks
+    _scoredCladeMasks = cladeMasks
+
+
+
+def _scoreAgainstSource(task):
+    '''Score the tree kept by _setScoredTree() against one source tree.'''
+    (sourceCladeMasks, taxaMask) = task
+    return _getRawFpFnFromMasks(sourceCladeMasks, _scoredCladeMasks, taxaMask)
+
+
+
+def _getRawFpFnFromMasks(trueCladeMasks, estimatedCladeMasks, taxaMask):
+    '''Return the numbers of FP, FN, and TP, given the clade bitmasks of two trees and their common taxa.'''
+
+    trueBPs = getSplitMasks(trueCladeMasks, taxaMask)
+    estimatedBPs = getSplitMasks(estimatedCladeMasks, taxaMask)
+
+    falsePositives = estimatedBPs - trueBPs
+    falseNegatives = trueBPs - estimatedBPs
+
+    return(len(falsePositives), len(falseNegatives), len(trueBPs), len(estimatedBPs))
+
+
+
+def getErrorsPerSource(sourceTrees, tree, twoWay = False, jobs = 1):
+    '''
+        Return, for each source tree, the raw FP, FN, and TP numbers (as given
+        by getRawFpFn()) of the tree restricted to the leaf set of the source
+        tree and scored against that source tree.  The tree's bipartitions are
+        found once, as bitmasks, and restricted to each source tree's leaf set
+        by masking.  The (optional) third argument is as in getRawFpFn(); the
+        (optional) fourth argument sets the number of processes used.
+    '''
+
+    treeTaxa = set(tree.get_leaves_identifiers())
+    taxonIndex = buildTaxonIndex(list(treeTaxa) + [identifier for source in sourceTrees
+                                                         for identifier in source.get_leaves_identifiers()])
+    treeMask = getTaxaMask(treeTaxa, taxonIndex)
+    treeCladeMasks = findCladeMasks(tree, taxonIndex)
+
+    tasks = []
+    for source in sourceTrees:
+        taxaMask = getTaxaMask(source.get_leaves_identifiers(), taxonIndex)
+        if taxaMask & ~treeMask:
+            if twoWay:
+                taxaMask &= treeMask
+            else:
+                raise Exception('Leaf sets are not identical.')
+
+        tasks.append((findCladeMasks(source, taxonIndex), taxaMask))
+
+    if jobs <= 1:
+        return [_getRawFpFnFromMasks(sourceCladeMasks, treeCladeMasks, taxaMask)
+                for (sourceCladeMasks, taxaMask) in tasks]
+
+    pool = Pool(jobs, _setScoredTree, (treeCladeMasks,))
+    try:
+        errors = pool.map(_scoreAgainstSource, tasks, max(1, len(tasks) // (4 * jobs)))
+    finally:
+        pool.close()
+        pool.join()
+
+    return (errors)
+
+
+
+def sumErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False, jobs = 1):
     '''
         Return the sums of FP, FN, and Robinson-Foulds scores of the tree 
         restricted to the leaf set of each source tree and scored against that 
@@ -105,7 +180,8 @@ def sumErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False
         scores are normalized.  If the (optional) fourth argument is set to 
         True, each source tree is also restricted to the estimated tree's leaf 
         set prior to scoring; otherwise, an exception is raised if the source 
-        tree contains taxa that the estimated tree doesn't.
+        tree contains taxa that the estimated tree doesn't.  The (optional) 
+        fifth argument sets the number of processes used for scoring.
     '''
 
     sum = {}
@@ -115,10 +191,7 @@ def sumErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False
     sum["trueBPs"] = 0
     sum["estimatedBPs"] = 0
 
-    for source in sourceTrees:
-        restrictedTree = restrict(tree, set(source.get_leaves_identifiers()))
-
-        (fp, fn, trueBPs, estimatedBPs) = getRawFpFn (source, restrictedTree, twoWay)
+    for (fp, fn, trueBPs, estimatedBPs) in getErrorsPerSource(sourceTrees, tree, twoWay, jobs):
         rf = fp + fn
 
         sum["fp"] += fp
@@ -147,6 +220,307 @@ def sumErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False
 
 
 
+def getRfMatrices (trees, normalized = False):
+    '''
+        Return the all-pairs FP, FN, and Robinson-Foulds matrices of the given
+        trees, where entry [i][j] scores tree j (as the estimated tree) against
+        tree i (as the true tree).  If the (optional) second argument is set to
+        True, rates (as given by getFpFnRfRates()) are returned instead of raw
+        numbers.  The trees must have identical leaf sets; otherwise, an
+        exception is raised.  The bipartitions of each tree are found once, as
+        normalized bitmasks, and the numbers of shared bipartitions are
+        accumulated through an index from each bipartition to the trees
+        displaying it.
+    '''
+
+    numTrees = len(trees)
+    if numTrees == 0:
+        return ([], [], [])
+
+    taxa = set(trees[0].get_leaves_identifiers())
+    taxonIndex = buildTaxonIndex(taxa)
+    taxaMask = getTaxaMask(taxa, taxonIndex)
+
+    # key: bipartition, value: ids of the trees displaying it
+    treesByBipartition = {}
+    numBPs = []
+    for (i, tree) in enumerate(trees):
+        if set(tree.get_leaves_identifiers()) != taxa:
+            raise Exception('Leaf sets are not identical')
+
+        bipartitions = getSplitMasks(findCladeMasks(tree, taxonIndex), taxaMask)
+        numBPs.append(len(bipartitions))
+        for bipartition in bipartitions:
+            treesByBipartition.setdefault(bipartition, []).append(i)
+
+    # bipartitions displayed by the very same trees add up to the same entries
+    multiplicities = {}
+    for treeIds in treesByBipartition.values():
+        treeIds = tuple(treeIds)
+        multiplicities[treeIds] = multiplicities.get(treeIds, 0) + 1
+
+    shared = [[0] * numTrees for i in range(numTrees)]
+    for (treeIds, multiplicity) in multiplicities.items():
+        for i in treeIds:
+            row = shared[i]
+            for j in treeIds:
+                row[j] += multiplicity
+
+    fp = [[numBPs[j] - shared[i][j] for j in range(numTrees)] for i in range(numTrees)]
+    fn = [[numBPs[i] - shared[i][j] for j in range(numTrees)] for i in range(numTrees)]
+
+    if not normalized:
+        rf = [[fp[i][j] + fn[i][j] for j in range(numTrees)] for i in range(numTrees)]
+        return (fp, fn, rf)
+
+    for i in range(numTrees):
+        for j in range(numTrees):
+            fp[i][j] = None if numBPs[j] == 0 else 1.0*fp[i][j]/numBPs[j]
+            fn[i][j] = None if numBPs[i] == 0 else 1.0*fn[i][j]/numBPs[i]
+
+    rf = [[None if fp[i][j] == None or fn[i][j] == None else (fp[i][j] + fn[i][j])/2.0
+           for j in range(numTrees)] for i in range(numTrees)]
+    return (fp, fn, rf)
+
+
+
+def _indexNodes (tree):
+    '''
+        Return the children (as lists of indices), parents, leaf identifiers
+        (None for internal nodes), and clade sizes of the nodes of a tree,
+        indexed in postorder; the root is the last node.
+    '''
+    children = []
+    parents = []
+    identifiers = []
+    sizes = []
+
+    stack = [(tree, False)]
+    pending = [[]]
+    while stack:
+        (node, visited) = stack.pop()
+        index = len(children)
+        if visited:
+            kids = pending.pop()
+            children.append(kids)
+            identifiers.append(None)
+            sizes.append(sum([sizes[kid] for kid in kids]))
+        elif isNonLeaf(node):
+            stack.append((node, True))
+            pending.append([])
+            for edge in reversed(node.get_edges()):
+                stack.append((edge[0], False))
+            continue
+        else:
+            children.append([])
+            identifiers.append(node.identifier)
+            sizes.append(1)
+        parents.append(-1)
+        pending[-1].append(index)
+
+    for (index, kids) in enumerate(children):
+        for kid in kids:
+            parents[kid] = index
+
+    return (children, parents, identifiers, sizes)
+
+
+
+def _countButterflies (intersections):
+    '''
+        Given the sizes of the intersections of the subtrees around a node of
+        one tree (rows) with those around a node of another tree (columns),
+        return the number of (quartet, side) pairs such that both leaves of the
+        side lie in a single cell, and the other two leaves lie in distinct
+        rows and distinct columns, other than the cell's.
+    '''
+    rowSums = [sum(row) for row in intersections]
+    columns = list(zip(*intersections))
+    columnSums = [sum(column) for column in columns]
+    total = sum(rowSums)
+
+    rowSquares = [sum([m * m for m in row]) for row in intersections]
+    columnSquares = [sum([m * m for m in column]) for column in columns]
+    squares = sum(rowSquares)
+
+    # sums of squared row (column) sums once a column (row) is removed
+    rowDeviations = [sum([(rowSum - m) ** 2 for (rowSum, m) in zip(rowSums, column)]) for column in columns]
+    columnDeviations = [sum([(columnSum - m) ** 2 for (columnSum, m) in zip(columnSums, row)])
+                        for row in intersections]
+
+    butterflies = 0
+    for (i, row) in enumerate(intersections):
+        for (j, m) in enumerate(row):
+            if m < 2:
+                continue
+            others = total - rowSums[i] - columnSums[j] + m
+            sameRow = rowDeviations[j] - (rowSums[i] - m) ** 2
+            sameColumn = columnDeviations[i] - (columnSums[j] - m) ** 2
+            sameCell = squares - rowSquares[i] - columnSquares[j] + m * m
+            pairs = (others * others - sameRow - sameColumn + sameCell) // 2
+            butterflies += m * (m - 1) // 2 * pairs
+
+    return (butterflies)
+
+
+
+def countResolvedQuartets (tree):
+    '''Return the number of (resolved) quartet trees displayed by a tree.'''
+
+    if (tree == None or not isNonLeaf(tree)):
+        return 0
+
+    (children, parents, identifiers, sizes) = _indexNodes(tree)
+    numTaxa = sizes[-1]
+
+    count = 0
+    for (node, kids) in enumerate(children):
+        sides = [sizes[kid] for kid in kids]
+        if parents[node] >= 0:
+            sides.append(numTaxa - sizes[node])
+        squares = sum([side * side for side in sides])
+        for side in sides:
+            # pairs of leaves on two other sides
+            pairs = ((numTaxa - side) ** 2 - (squares - side * side)) // 2
+            count += side * (side - 1) // 2 * pairs
+
+    return (count // 2)
+
+
+
+def countSharedQuartets (tree1, tree2):
+    '''
+        Return the number of (resolved) quartet trees displayed by both of two
+        trees on the same leaf set.  Rather than enumerating quartets, this
+        counts, for every pair of nodes, the quartets both trees resolve around
+        those nodes from the sizes of the intersections of the subtrees around
+        them, in O(n^2) time (for trees of bounded degree).
+    '''
+
+    if (tree1 == None or not isNonLeaf(tree1) or tree2 == None or not isNonLeaf(tree2)):
+        return 0
+
+    (children1, parents1, identifiers1, sizes1) = _indexNodes(tree1)
+    (children2, parents2, identifiers2, sizes2) = _indexNodes(tree2)
+    numTaxa = sizes1[-1]
+    leaves2 = dict([(identifier, node) for (node, identifier) in enumerate(identifiers2) if identifier != None])
+
+    # clades[x][y]: number of taxa shared by the clades of x (tree1) and y (tree2)
+    clades = []
+    for (node, kids) in enumerate(children1):
+        if kids:
+            row = clades[kids[0]]
+            for kid in kids[1:]:
+                row = list(map(add, row, clades[kid]))
+        else:
+            row = [0] * len(children2)
+            ancestor = leaves2[identifiers1[node]]
+            while ancestor >= 0:
+                row[ancestor] = 1
+                ancestor = parents2[ancestor]
+        clades.append(row)
+
+    # nodes which can join two sides of a quartet, i.e. of degree >= 3
+    nodes1 = [node for node in range(len(children1)) if len(children1[node]) + (parents1[node] >= 0) >= 3]
+    nodes2 = [node for node in range(len(children2)) if len(children2[node]) + (parents2[node] >= 0) >= 3]
+
+    butterflies = 0
+    for node1 in nodes1:
+        kids1 = children1[node1]
+        rows = [clades[kid] for kid in kids1]
+        isRoot1 = parents1[node1] < 0
+        for node2 in nodes2:
+            kids2 = children2[node2]
+            intersections = [[row[kid] for kid in kids2] for row in rows]
+
+            # the sides leading to the nodes' parents are clade complements
+            if parents2[node2] >= 0:
+                for (kid, row) in zip(kids1, intersections):
+                    row.append(sizes1[kid] - clades[kid][node2])
+            if not isRoot1:
+                row = [sizes2[kid] - clades[node1][kid] for kid in kids2]
+                if parents2[node2] >= 0:
+                    row.append(numTaxa - sizes1[node1] - sizes2[node2] + clades[node1][node2])
+                intersections.append(row)
+
+            butterflies += _countButterflies(intersections)
+
+    # each shared quartet is counted once around each of its two sides
+    return (butterflies // 2)
+
+
+
+def getQuartetFpFn (trueTree, estimatedTree, twoWay = False):
+    '''
+        Return actual numbers of FP and FN quartet trees, and of quartet trees
+        displayed by the true & estimated trees.  If the (optional) third
+        argument is set to True, the trees will first be restricted to the
+        intersection of their taxa; otherwise, an exception will be raised if
+        their leaf sets are not identical.
+    '''
+
+    if set(trueTree.get_leaves_identifiers()) != set(estimatedTree.get_leaves_identifiers()):
+        if twoWay:
+            intersection = set(trueTree.get_leaves_identifiers()) & set(estimatedTree.get_leaves_identifiers())
+            trueTree = restrict(trueTree, intersection)
+            estimatedTree = restrict(estimatedTree, intersection)
+        else:
+            raise Exception('Leaf sets are not identical.')
+
+    numShared = countSharedQuartets(trueTree, estimatedTree)
+    numTrue = countResolvedQuartets(trueTree)
+    numEstimated = countResolvedQuartets(estimatedTree)
+
+    return(numEstimated - numShared, numTrue - numShared, numTrue, numEstimated)
+
+
+
+def sumQuartetErrorsAcrossSources(sourceTrees, tree, normalized = False, twoWay = False):
+    '''
+        Return the sums of quartet FP, FN, and distance scores of the tree
+        restricted to the leaf set of each source tree and scored against that
+        source tree.  The optional arguments are as in sumErrorsAcrossSources().
+    '''
+
+    treeTaxa = set(tree.get_leaves_identifiers())
+    index = RestrictionIndex(tree)
+
+    (sumFP, sumFN, sumTrueQs, sumEstimatedQs) = (0, 0, 0, 0)
+    for source in sourceTrees:
+        taxa = set(source.get_leaves_identifiers())
+        if not taxa <= treeTaxa:
+            if twoWay:
+                taxa &= treeTaxa
+                source = restrict(source, taxa)
+            else:
+                raise Exception('Leaf sets are not identical.')
+
+        (fp, fn, trueQs, estimatedQs) = getQuartetFpFn(source, index.restrict(taxa))
+        sumFP += fp
+        sumFN += fn
+        sumTrueQs += trueQs
+        sumEstimatedQs += estimatedQs
+
+    if normalized:
+        if sumEstimatedQs == 0:
+            normalizedSumFP = None
+        else:
+            normalizedSumFP = 1.0*sumFP/sumEstimatedQs
+
+        if sumTrueQs == 0:
+            normalizedSumFN = None
+            normalizedSumQD = None
+        else:
+            normalizedSumFN = 1.0*sumFN/sumTrueQs
+            normalizedSumQD = 1.0*(sumFP + sumFN)/(2*sumTrueQs)
+
+        return (normalizedSumFP, normalizedSumFN, normalizedSumQD)
+
+    else:
+        return(sumFP, sumFN, sumFP + sumFN)
+
+
+
 def getResolution (tree):
     '''Return the percent resolution of the tree.'''
 
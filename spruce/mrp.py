@@ -60,6 +60,71 @@ def matrixRepresentation (trees):
 
 
 
+def compressMatrix (matrix, informativeOnly = True):
+    '''
+        Collapse identical characters of the given matrix into unique site
+        patterns.  Under parsimony a character is unchanged by swapping its 0
+        and 1 states, so such characters are collapsed as well.  If the
+        (optional) second argument is set to True, parsimony-uninformative
+        characters (i.e. those with fewer than two taxa in either state) are
+        discarded.  Return a 3-tuple containing the list of taxa, the list of
+        unique characters, and the list of weights (i.e. multiplicities) of
+        those characters.
+    '''
+
+    (taxa, columns) = (matrix[0], matrix[1])
+    patterns = {}
+    uniqueColumns = []
+    weights = []
+
+    for column in columns:
+        zeroes = frozenset([taxon for taxon in column if column[taxon] == 0])
+        ones = frozenset([taxon for taxon in column if column[taxon] == 1])
+
+        if informativeOnly and (len(zeroes) < 2 or len(ones) < 2):
+            continue
+
+        pattern = frozenset([zeroes, ones])
+        index = patterns.get(pattern)
+
+        if index == None:
+            patterns[pattern] = len(uniqueColumns)
+            uniqueColumns.append(column)
+            weights.append(1)
+        else:
+            weights[index] += 1
+
+    return (taxa, uniqueColumns, weights)
+
+
+
+def getWeightsStatement (weights, indices = None, factor = 1):
+    '''
+        Return a PAUP* weights statement assigning the given weights to the
+        characters of a matrix.  Characters are numbered from 1.  Only the
+        characters in the (optional) second argument are given a weight, which
+        is further multiplied by the (optional) third argument; characters left
+        with weight 1 are omitted, unless they are upweighted by the factor.
+    '''
+
+    if indices == None:
+        indices = range(1, len(weights) + 1)
+
+    charactersByWeight = {}
+    for index in indices:
+        weight = weights[index - 1] * factor
+        if weight != 1 or factor != 1:
+            charactersByWeight.setdefault(weight, []).append(str(index))
+
+    if not charactersByWeight:
+        return None
+
+    assignments = ['%d: %s' % (weight, ' '.join(charactersByWeight[weight]))
+                   for weight in sorted(charactersByWeight.keys())]
+    return 'weights %s;' % ', '.join(assignments)
+
+
+
 def readMatrixFromFile (file):
     '''
         Read a matrix (into the data structure described above) from the 
@@ -197,12 +262,15 @@ def writeRatchetInputFile (matrix,
                            numRatchetIterations = 100, 
                            percentToUpweight = .25, 
                            weight = 2, 
-                           startingTree = None):
+                           startingTree = None,
+                           characterWeights = None):
     '''
         Write the given matrix and PAUP* commands for performing a ratcheted MRP
         analysis to the given stream.  The third parameter sets the prefix for 
         names of files generated by PAUP* upon running the file.  Other 
-        parameters determine the details of the ratchet analysis.
+        parameters determine the details of the ratchet analysis.  If
+        character weights are given (see compressMatrix()), each character
+        counts as many times as its weight, including while upweighted.
     '''
 
     (taxa, columns) = (matrix[0], matrix[1])
@@ -221,6 +289,10 @@ def writeRatchetInputFile (matrix,
 
     lines = getMatrixString(matrix)
 
+    baseWeights = None
+    if characterWeights:
+        baseWeights = getWeightsStatement(characterWeights)
+
     treeBlock = []
     if (startingTree):
         treeBlock = ['begin trees;',
@@ -236,8 +308,12 @@ def writeRatchetInputFile (matrix,
                  '\tset autoclose = yes warntree = no warnreset = no notifybeep = no monitor = yes taxlabels = full;',
                  '\tlog file = %s replace;' % logFile,
                  '\tset criterion = parsimony;',
-                 '\tpset collapse = no;',
-                 '\n\t[!][!*** Replicate 0 (initial tree) ***]']
+                 '\tpset collapse = no;']
+
+    if baseWeights:
+        paupBlock += ['\t%s' % baseWeights]
+
+    paupBlock += ['\n\t[!][!*** Replicate 0 (initial tree) ***]']
 
     if not startingTree:
         paupBlock += ['\thsearch addseq = random nreps = 1 rseed = %d swap = TBR multrees = no dstatus = 60;' % randomSeed]
@@ -254,13 +330,21 @@ def writeRatchetInputFile (matrix,
 
     #for replicate in xrange(numRatchetIterations):
     for replicate in range(numRatchetIterations):
-        selectedIndices = map(str, sorted(random.sample(listOfIndices, numCharactersToSelect)))
+        selectedIndices = sorted(random.sample(listOfIndices, numCharactersToSelect))
+
+        if characterWeights:
+            upweighting = getWeightsStatement(characterWeights, selectedIndices, weight) or \
+                          'weights %d: ;' % weight
+            resetWeights = ['\tweights 1: all;', '\t%s' % baseWeights] if baseWeights else ['\tweights 1: all;']
+        else:
+            upweighting = 'weights %d: %s;' % (weight, ' '.join(map(str, selectedIndices)))
+            resetWeights = ['\tweights 1: all;']
 
         replicateBlock = ['\n\t[!][!*** Replicate #%d ***]' % (replicate + 1),
-                          '\tweights %d: %s;' % (weight, ' '.join(selectedIndices)),
-                          '\thsearch start = current swap = TBR multrees = no dstatus = 60;',
-                          '\tweights 1: all;',
-                          '\thsearch start = current swap = TBR multrees = no dstatus = 60;',
+                          '\t%s' % upweighting,
+                          '\thsearch start = current swap = TBR multrees = no dstatus = 60;'] + \
+                         resetWeights + \
+                         ['\thsearch start = current swap = TBR multrees = no dstatus = 60;',
                           '\tsavetrees file = %s format = altnex append;' % treeFile,
                           '\tsavetrees file = %s.nex format = nexus append;\n' % treeFile]
         fileStream.write('\n'.join(replicateBlock))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+import os
+import sys
+from optparse import OptionParser
+from spruce.unrooted import *
+from spruce.metrics import *
+
+desc = '''
+           This script reads trees (all on the same leaf set) from one or more 
+           files and writes the matrices of FP, FN, and Robinson-Foulds scores 
+           of every pair of trees.  Entry (i, j) of a matrix scores the j-th 
+           tree against the i-th tree.
+       '''
+
+parser = OptionParser(usage = "usage: %prog [options] FILE [FILE ...]", description = desc)
+parser.add_option("-o", "--out", dest = "prefix", metavar = "PREFIX",
+                  help = "write matrices to PREFIX.fp, PREFIX.fn, and PREFIX.rf files, "
+                         "instead of writing the RF matrix to stdout")
+parser.add_option("-f", "--format", dest = "format", choices = ("csv", "npy"), default = "csv", metavar = "FORMAT",
+                  help = "write matrices in FORMAT, one of {csv, npy}; npy requires NumPy [default: %default]")
+parser.add_option("-n", "--normalized", dest = "normalized", action = "store_true", default = False,
+                  help = "write rates instead of numbers of bipartitions [default: %default]")
+
+(options, args) = parser.parse_args()
+if len(args) == 0:
+    parser.error("at least one file of trees must be given\ntry running with the --help flag")
+if options.format == "npy" and options.prefix == None:
+    parser.error("the npy format requires an output prefix (-o)")
+
+labels = []
+trees = []
+for file in args:
+    sources = readMultipleTreesFromFile(file)
+    name = os.path.basename(file)
+    for i in range(len(sources)):
+        labels.append(name if len(sources) == 1 else "%s:%d" % (name, i + 1))
+        trees.append(parse_tree(sources[i]))
+
+(fp, fn, rf) = getRfMatrices(trees, options.normalized)
+
+
+def writeCsv(matrix, stream):
+    stream.write(','.join([''] + labels) + '\n')
+    for (label, row) in zip(labels, matrix):
+        stream.write(','.join([label] + ['' if value == None else str(value) for value in row]) + '\n')
+
+
+if options.prefix == None:
+    writeCsv(rf, sys.stdout)
+elif options.format == "csv":
+    for (name, matrix) in (("fp", fp), ("fn", fn), ("rf", rf)):
+        f = open("%s.%s.csv" % (options.prefix, name), 'w')
+        writeCsv(matrix, f)
+        f.close()
+    f = open("%s.labels" % options.prefix, 'w')
+    f.write('\n'.join(labels) + '\n')
+    f.close()
+else:
+    try:
+        import numpy
+    except ImportError:
+        parser.error("the npy format requires NumPy to be installed")
+
+    for (name, matrix) in (("fp", fp), ("fn", fn), ("rf", rf)):
+        numpy.save("%s.%s.npy" % (options.prefix, name),
+                   numpy.array([[numpy.nan if value == None else value for value in row] for row in matrix]))
+    f = open("%s.labels" % options.prefix, 'w')
+    f.write('\n'.join(labels) + '\n')
+    f.close()
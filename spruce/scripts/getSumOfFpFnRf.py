@@ -24,12 +24,17 @@ from spruce.metrics import *
 
 desc = '''
            This script reads a tree and a set of source trees and prints the 
-           Sum-FP, Sum-FN, and Sum-RF scores of the tree.
+           Sum-FP, Sum-FN, and Sum-RF scores of the tree (or, optionally, its 
+           quartet-based Sum-FP, Sum-FN, and Sum-QD scores).
        '''
 
 parser = OptionParser(usage = "usage: %prog [options]", description = desc)
 parser.add_option("-t", "--tree", dest = "estimate_tree", help = "read estimate tree from FILE", metavar = "FILE")
 parser.add_option("-s", "--sources", dest = "sources_file", help = "read source trees from FILE", metavar = "FILE")
+parser.add_option("-j", "--jobs", dest = "jobs", type = "int", default = 1, metavar = "N",
+                  help = "score source trees using N processes [default: %default]")
+parser.add_option("-q", "--quartets", dest = "quartets", action = "store_true", default = False,
+                  help = "score quartet trees instead of bipartitions [default: %default]")
 
 (options, args) = parser.parse_args()
 if (options.estimate_tree == None or options.sources_file == None):
@@ -38,4 +43,7 @@ if (options.estimate_tree == None or options.sources_file == None):
 sources = [parse_tree(source) for source in readMultipleTreesFromFile(options.sources_file)]
 estimate = readNewickFile(options.estimate_tree)
 
-print sumErrorsAcrossSources(sources, estimate, normalized = True)
+if options.quartets:
+    print(sumQuartetErrorsAcrossSources(sources, estimate, normalized = True))
+else:
+    print(sumErrorsAcrossSources(sources, estimate, normalized = True, jobs = options.jobs))
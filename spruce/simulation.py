@@ -0,0 +1,182 @@
+'''
+    This module simulates model trees and samples source trees from them, in
+    time linear in the number of taxa, for supertree benchmarks.
+'''
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+
+class SimulatedTree(object):
+    '''
+        A rooted tree held as arrays indexed by node number (the root being
+        node 0): each node's parent, children, and the length of the edge
+        leading to it, and each leaf's label.  Unlike a newick_modified Tree,
+        it is built, restricted and written out without recursion, and without
+        rescanning the leaves (as dendropy.treegen.uniform_pure_birth does on
+        every birth), so that trees of 100,000 taxa take linear time.
+    '''
+
+    def __init__(self, parents, lengths, labels):
+        self.parents = parents      # -1 for the root
+        self.lengths = lengths      # None for the root
+        self.labels = labels        # None for internal nodes
+        self.children = [[] for node in parents]
+        for (node, parent) in enumerate(parents):
+            if parent >= 0:
+                self.children[parent].append(node)
+
+    @staticmethod
+    def pureBirth(taxa, rng, birthRate = 1.0):
+        '''
+            Grow a tree on the given taxa by a pure-birth (Yule) process: a leaf
+            picked uniformly at random splits in two, until there is a leaf per
+            taxon.  Edge lengths are the waiting times between births.
+        '''
+        (parents, lengths) = ([-1], [None])
+        leaves = [0]
+        while len(leaves) < len(taxa):
+            # swap the splitting leaf to the end of the list, to drop it in O(1)
+            index = rng.randrange(len(leaves))
+            (leaves[index], leaves[-1]) = (leaves[-1], leaves[index])
+            parent = leaves.pop()
+            length = rng.expovariate((len(leaves) + 1) / birthRate)
+            for i in range(2):
+                leaves.append(len(parents))
+                parents.append(parent)
+                lengths.append(length)
+
+        labels = [None] * len(parents)
+        for (leaf, taxon) in zip(leaves, taxa):
+            labels[leaf] = taxon
+        return SimulatedTree(parents, lengths, labels)
+
+    def preorder(self):
+        '''Return the nodes in preorder.'''
+        order = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(reversed(self.children[node]))
+        return (order)
+
+    def taxa(self):
+        return [label for label in self.labels if label != None]
+
+    def sampleClade(self, rng, minSize, maxSize):
+        '''
+            Return the taxa of a clade (other than the whole tree) picked at
+            random among those of between minSize and maxSize taxa, or None if
+            there is no such clade.
+        '''
+        order = self.preorder()
+        (taxa, nodes) = ([0] * len(order), [1] * len(order))     # taxa and nodes below each node
+        for node in reversed(order):
+            if self.labels[node] != None:
+                taxa[node] = 1
+            if node != 0:
+                taxa[self.parents[node]] += taxa[node]
+                nodes[self.parents[node]] += nodes[node]
+
+        candidates = [position for position in range(1, len(order)) if minSize <= taxa[order[position]] <= maxSize]
+        if not candidates:
+            return None
+        # a subtree's nodes are consecutive in preorder
+        start = rng.choice(candidates)
+        return [self.labels[node] for node in order[start:start + nodes[order[start]]] if self.labels[node] != None]
+
+    def restrict(self, taxonSet):
+        '''
+            Return the tree induced by the given taxa, with the nodes left with
+            a single child suppressed (their edge lengths being added up).
+        '''
+        order = self.preorder()
+        kept = [0] * len(self.parents)      # number of kept taxa below each node
+        for node in reversed(order):
+            if self.labels[node] != None and self.labels[node] in taxonSet:
+                kept[node] = 1
+            if node != 0:
+                kept[self.parents[node]] += kept[node]
+
+        (parents, lengths, labels) = ([], [], [])
+        mapped = {}     # node -> node number within the restriction
+        for node in order:
+            if not kept[node]:
+                continue
+            branches = [child for child in self.children[node] if kept[child]]
+            if len(branches) == 1:   # suppressed, and replaced by its only branch
+                continue
+            (parent, length) = (self.parents[node], self.lengths[node])
+            while parent >= 0 and parent not in mapped:
+                if length != None and self.lengths[parent] != None:
+                    length += self.lengths[parent]
+                parent = self.parents[parent]
+            mapped[node] = len(parents)
+            parents.append(mapped[parent] if parent >= 0 else -1)
+            lengths.append(length if parents[-1] >= 0 else None)
+            labels.append(self.labels[node])
+        return SimulatedTree(parents, lengths, labels)
+
+    def perturb(self, rng, moves):
+        '''
+            Apply random nearest neighbor interchanges: each swaps a child of an
+            internal node with that node's sibling.  Below a root of degree 2,
+            whose edges make up a single edge of the unrooted tree, a swap
+            would leave the tree unchanged, so none is made there.
+        '''
+        candidates = [node for node in range(1, len(self.parents))
+                      if self.children[node] and len(self.children[self.parents[node]]) > 1 and
+                      (self.parents[node] != 0 or len(self.children[0]) > 2)]
+        for move in range(moves):
+            if not candidates:
+                return
+            node = rng.choice(candidates)
+            parent = self.parents[node]
+            sibling = rng.choice([child for child in self.children[parent] if child != node])
+            child = rng.choice(self.children[node])
+
+            self.children[node][self.children[node].index(child)] = sibling
+            self.children[parent][self.children[parent].index(sibling)] = child
+            (self.parents[sibling], self.parents[child]) = (node, parent)
+
+    def newick(self, lengths = True):
+        '''Return the tree in Newick format, with or without its edge lengths.'''
+        parts = []
+        stack = [(0, True)]
+        while stack:
+            (node, entering) = stack.pop()
+            if entering:
+                if self.labels[node] != None:
+                    parts.append(self.labels[node])
+                else:
+                    parts.append("(")
+                    stack.append((node, False))
+                    for (i, child) in enumerate(reversed(self.children[node])):
+                        stack.append((child, True))
+                        if i < len(self.children[node]) - 1:
+                            stack.append((None, None))   # a comma between siblings
+                    continue
+            elif entering == None:
+                parts.append(",")
+                continue
+            else:
+                parts.append(")")
+            if lengths and self.lengths[node] != None:
+                parts.append(":%.8f" % self.lengths[node])
+        return ("".join(parts) + ";")
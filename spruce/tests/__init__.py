@@ -0,0 +1,32 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    spruce testing suite
+'''
+
+import os
+
+DATASETS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "datasets")
+
+
+def datasetPath(*path):
+    '''Return the full path of a file within the datasets directory.'''
+    return os.path.join(DATASETS_PATH, *path)
@@ -0,0 +1,141 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the error metrics.
+'''
+
+import random
+import unittest
+
+from spruce.metrics import *
+from spruce.tests import datasetPath
+
+
+def readSources(density, replicate):
+    return [parse_tree(source) for source in readMultipleTreesFromFile(
+        datasetPath("simulated", "100-taxa", density, "sm_data.%d.source_trees" % replicate))]
+
+
+def readModelTree(density, replicate):
+    return readNewickFile(datasetPath("simulated", "100-taxa", density, "sm_data.%d.model_tree" % replicate))
+
+
+def randomTree(rng, numTaxa):
+    '''Return a random tree on taxa t0, t1, ..., with a few polytomies.'''
+    clades = ["t%d" % i for i in range(numTaxa)]
+    while len(clades) > 3:
+        rng.shuffle(clades)
+        size = min(rng.choice((2, 2, 2, 3)), len(clades) - 2)
+        clades = clades[size:] + ["(%s)" % ",".join(clades[:size])]
+    return parse_tree("(%s);" % ",".join(clades))
+
+
+class ErrorsPerSourceTest(unittest.TestCase):
+
+    def testMatchesRestrictAndScore(self):
+        for density in ("20", "75"):
+            sourceTrees = readSources(density, 1)
+            tree = readModelTree(density, 1)
+            expected = [getRawFpFn(source, restrict(tree, set(source.get_leaves_identifiers())))
+                        for source in sourceTrees]
+            self.assertEqual(getErrorsPerSource(sourceTrees, tree), expected)
+
+    def testTwoWay(self):
+        sourceTrees = readSources("50", 2)
+        tree = readModelTree("50", 2)
+        taxa = tree.get_leaves_identifiers()
+        tree = restrict(tree, set(random.Random(7).sample(taxa, len(taxa) - 20)))
+
+        expected = [getRawFpFn(source, restrict(tree, set(source.get_leaves_identifiers())), twoWay = True)
+                    for source in sourceTrees]
+        self.assertEqual(getErrorsPerSource(sourceTrees, tree, twoWay = True), expected)
+        self.assertRaises(Exception, getErrorsPerSource, sourceTrees, tree)
+
+    def testParallelSums(self):
+        sourceTrees = readSources("50", 0)
+        tree = readModelTree("50", 0)
+        self.assertEqual(sumErrorsAcrossSources(sourceTrees, tree, jobs = 2),
+                         sumErrorsAcrossSources(sourceTrees, tree))
+        self.assertEqual(sumErrorsAcrossSources(sourceTrees, tree, normalized = True, jobs = 2),
+                         sumErrorsAcrossSources(sourceTrees, tree, normalized = True))
+
+
+class RfMatricesTest(unittest.TestCase):
+
+    def setUp(self):
+        sourceTrees = readSources("75", 0)
+        modelTrees = [readModelTree("75", replicate) for replicate in (0, 1)]
+        taxa = set(sourceTrees[0].get_leaves_identifiers()) & set(sourceTrees[2].get_leaves_identifiers())
+        taxa &= set(modelTrees[1].get_leaves_identifiers())
+        self.trees = [restrict(tree, taxa) for tree in [sourceTrees[0], sourceTrees[2]] + modelTrees + [sourceTrees[0]]]
+
+    def testMatchesPairwiseScores(self):
+        (fp, fn, rf) = getRfMatrices(self.trees)
+        for (i, trueTree) in enumerate(self.trees):
+            for (j, estimatedTree) in enumerate(self.trees):
+                (numFp, numFn, numTrueBPs, numEstimatedBPs) = getRawFpFn(trueTree, estimatedTree)
+                self.assertEqual((fp[i][j], fn[i][j], rf[i][j]), (numFp, numFn, numFp + numFn))
+
+    def testNormalized(self):
+        (fp, fn, rf) = getRfMatrices(self.trees, normalized = True)
+        for (i, trueTree) in enumerate(self.trees):
+            for (j, estimatedTree) in enumerate(self.trees):
+                self.assertEqual((fp[i][j], fn[i][j], rf[i][j]), getFpFnRfRates(trueTree, estimatedTree))
+
+    def testDifferentLeafSets(self):
+        self.assertRaises(Exception, getRfMatrices, readSources("75", 0))
+
+
+class QuartetErrorsTest(unittest.TestCase):
+
+    def testMatchesEnumeration(self):
+        rng = random.Random(11)
+        for trial in range(100):
+            numTaxa = rng.randint(4, 10)
+            (trueTree, estimatedTree) = (randomTree(rng, numTaxa), randomTree(rng, numTaxa))
+            trueQtrees = set(findDisplayedQtrees(trueTree))
+            estimatedQtrees = set(findDisplayedQtrees(estimatedTree))
+
+            self.assertEqual(countSharedQuartets(trueTree, estimatedTree), len(trueQtrees & estimatedQtrees))
+            self.assertEqual(getQuartetFpFn(trueTree, estimatedTree),
+                             (len(estimatedQtrees - trueQtrees), len(trueQtrees - estimatedQtrees),
+                              len(trueQtrees), len(estimatedQtrees)))
+
+    def testTwoWay(self):
+        rng = random.Random(5)
+        trueTree = randomTree(rng, 9)
+        estimatedTree = restrict(randomTree(rng, 10), set(["t%d" % i for i in range(1, 10)]))
+        intersection = set(["t%d" % i for i in range(1, 9)])
+
+        self.assertRaises(Exception, getQuartetFpFn, trueTree, estimatedTree)
+        self.assertEqual(getQuartetFpFn(trueTree, estimatedTree, twoWay = True),
+                         getQuartetFpFn(restrict(trueTree, intersection), restrict(estimatedTree, intersection)))
+
+    def testSumAcrossSources(self):
+        sourceTrees = readSources("20", 0)
+        tree = readModelTree("20", 0)
+        errors = [getQuartetFpFn(source, restrict(tree, set(source.get_leaves_identifiers())))
+                  for source in sourceTrees]
+        (sumFP, sumFN) = (sum([error[0] for error in errors]), sum([error[1] for error in errors]))
+        self.assertEqual(sumQuartetErrorsAcrossSources(sourceTrees, tree), (sumFP, sumFN, sumFP + sumFN))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the site-pattern compression of matrix representations.
+'''
+
+import unittest
+
+try:
+    from io import StringIO
+except ImportError:
+    from cStringIO import StringIO
+
+from newick_modified.tree import parse_tree
+from spruce.unrooted import readMultipleTreesFromFile
+from spruce.mrp import matrixRepresentation, compressMatrix, getWeightsStatement, writeRatchetInputFile
+from matrix_representation.MatrixRepresentation import MatrixRepresentation
+from spruce.tests import datasetPath
+
+
+def relabeledTrees():
+    '''Trees on polytomy groups, as given to the reconcilers, with many repeated bipartitions.'''
+    return [parse_tree(tree) for tree in ["((0,1),(2,3),4)",
+                                          "((0,1),(2,3),5)",
+                                          "((1,0),(3,2),(4,5))",
+                                          "((0,1),2,(3,(4,5)))",
+                                          "(0,1,2,3)"]]
+
+
+class CompressMatrixTest(unittest.TestCase):
+
+    def testWeightsAddUp(self):
+        matrix = matrixRepresentation(relabeledTrees())
+        (taxa, columns, weights) = compressMatrix(matrix)
+        self.assertEqual(taxa, matrix[0])
+        self.assertEqual(len(columns), len(weights))
+        self.assertEqual(sum(weights), len(matrix[1]))
+        self.assertTrue(len(columns) < len(matrix[1]))
+
+    def testPatternsAreUnique(self):
+        sourceTrees = [parse_tree(tree) for tree in readMultipleTreesFromFile(
+            datasetPath("biological", "seabirds", "kennedy.source_trees_manual"))]
+        (taxa, columns, weights) = compressMatrix(matrixRepresentation(sourceTrees))
+        patterns = set()
+        for column in columns:
+            zeroes = frozenset([taxon for taxon in column if column[taxon] == 0])
+            ones = frozenset([taxon for taxon in column if column[taxon] == 1])
+            patterns.add(frozenset([zeroes, ones]))
+        self.assertEqual(len(patterns), len(columns))
+
+    def testUninformativeCharacters(self):
+        matrix = (('a', 'b', 'c', 'd'), [{'a': 0, 'b': 0, 'c': 1, 'd': 1},
+                                         {'a': 1, 'b': 1, 'c': 0, 'd': 0},
+                                         {'a': 0, 'b': 1, 'c': 1, 'd': 1}])
+        (taxa, columns, weights) = compressMatrix(matrix)
+        self.assertEqual(weights, [2])
+        (taxa, columns, weights) = compressMatrix(matrix, informativeOnly = False)
+        self.assertEqual(weights, [2, 1])
+
+    def testWeightsStatement(self):
+        self.assertEqual(getWeightsStatement([1, 3, 1, 3, 2]), 'weights 2: 5, 3: 2 4;')
+        self.assertEqual(getWeightsStatement([1, 1]), None)
+        self.assertEqual(getWeightsStatement([1, 3, 1], [1, 2], 2), 'weights 2: 1, 6: 2;')
+
+    def testRatchetFileIsWeighted(self):
+        matrix = matrixRepresentation(relabeledTrees())
+        (taxa, columns, weights) = compressMatrix(matrix)
+        stream = StringIO()
+        writeRatchetInputFile((taxa, columns), stream, numRatchetIterations = 2, characterWeights = weights)
+        contents = stream.getvalue()
+        self.assertTrue('nchar = %d;' % len(columns) in contents)
+        self.assertTrue('\t%s' % getWeightsStatement(weights) in contents)
+
+
+class MatrixRepresentationCompressionTest(unittest.TestCase):
+
+    def testCompressedSupermatrix(self):
+        plain = MatrixRepresentation(relabeledTrees())
+        compressed = MatrixRepresentation(relabeledTrees(), compress=True)
+        self.assertEqual(compressed.number_of_original_sites, plain.number_of_sites)
+        self.assertEqual(sum(compressed.site_weights), plain.number_of_sites)
+        self.assertTrue(compressed.number_of_sites < plain.number_of_sites)
+
+        taxa = sorted(plain.matrix.keys())
+        plainSites = set(zip(*[plain.matrix[taxon] for taxon in taxa]))
+        compressedSites = list(zip(*[compressed.matrix[taxon] for taxon in taxa]))
+        self.assertEqual(len(set(compressedSites)), len(compressedSites))
+        self.assertEqual(set(compressedSites), plainSites)
+        self.assertTrue(" %d\n" % compressed.number_of_sites in compressed.phylip_format)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the simulation of model and source trees.
+'''
+
+import random
+import unittest
+
+from newick_modified.tree import *
+from spruce.simulation import SimulatedTree
+from spruce.unrooted import *
+
+
+def findSplits(newick):
+    '''Return the non-trivial bipartitions of a tree given in Newick format.'''
+    return set(xfindBipartitions(parse_tree(newick)))
+
+
+class SimulatedTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.taxa = ["t%d" % i for i in range(60)]
+        self.tree = SimulatedTree.pureBirth(self.taxa, self.rng)
+
+    def testPureBirth(self):
+        parsed = parse_tree(self.tree.newick())
+        self.assertEqual(sorted(parsed.get_leaves_identifiers()), sorted(self.taxa))
+        # rooted and binary: n leaves, n - 1 internal nodes
+        self.assertEqual(len(self.tree.parents), 2 * len(self.taxa) - 1)
+        self.assertTrue(all([len(children) in (0, 2) for children in self.tree.children]))
+        self.assertEqual(len(findSplits(self.tree.newick(False))), len(self.taxa) - 3)
+        self.assertFalse(":" in self.tree.newick(False))
+
+    def testRestrictMatchesRestrictionIndex(self):
+        model = parse_tree(self.tree.newick())
+        for size in (4, 10, 31, 60):
+            taxonSet = set(self.rng.sample(self.taxa, size))
+            restricted = self.tree.restrict(taxonSet)
+            self.assertEqual(sorted(restricted.taxa()), sorted(taxonSet))
+            self.assertTrue(all([len(children) != 1 for children in restricted.children]))
+            self.assertEqual(findSplits(restricted.newick()), set(xfindBipartitions(restrict(model, taxonSet))))
+
+    def testRestrictAddsUpLengths(self):
+        paths = []
+        for taxon in self.taxa[:2]:
+            (node, path) = (self.tree.labels.index(taxon), [])
+            while node > 0:
+                path.append(node)
+                node = self.tree.parents[node]
+            paths.append(path)
+        # the two taxa hang from their LCA, by the paths of edges up to it
+        restricted = self.tree.restrict(set(self.taxa[:2]))
+        for (taxon, path) in zip(self.taxa[:2], paths):
+            below = [node for node in path if node not in paths[0] or node not in paths[1]]
+            leaf = restricted.labels.index(taxon)
+            self.assertAlmostEqual(restricted.lengths[leaf], sum([self.tree.lengths[node] for node in below]))
+
+    def testSampleClade(self):
+        splits = findSplits(self.tree.newick())
+        for i in range(10):
+            clade = self.tree.sampleClade(self.rng, 10, 40)
+            self.assertTrue(10 <= len(clade) <= 40)
+            rest = set(self.taxa) - set(clade)
+            self.assertTrue(tuple(sorted([tuple(sorted(clade)), tuple(sorted(rest))])) in splits)
+        self.assertEqual(self.tree.sampleClade(self.rng, 61, 100), None)
+
+    def testPerturb(self):
+        before = findSplits(self.tree.newick())
+        for move in range(5):
+            self.tree.perturb(self.rng, 1)
+            after = findSplits(self.tree.newick())
+            # an NNI move replaces a single bipartition
+            self.assertEqual(len(before - after), 1)
+            self.assertEqual(len(after), len(before))
+            before = after
+        self.assertEqual(sorted(parse_tree(self.tree.newick()).get_leaves_identifiers()), sorted(self.taxa))
+
+
+if __name__ == "__main__":
+    unittest.main()
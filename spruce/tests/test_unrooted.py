@@ -0,0 +1,105 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of spruce.
+##
+##    spruce is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    spruce is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with spruce.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the operations on unrooted trees.
+'''
+
+import copy
+import random
+import unittest
+
+from newick_modified.tree import *
+from spruce.unrooted import *
+from spruce.tests import datasetPath
+
+
+def trimmingRestrict (tree, taxonSet):
+    '''Reference restriction: trim leaves from a copy of the whole tree, then suppress degree-2 nodes.'''
+
+    class LeafTrimmer(TreeVisitor):
+        def post_visit_edge(self, src, bootstrap, length, dest):
+            src._leaves_cache = None
+            if len(dest.get_leaves_identifiers()) == 0 or \
+                    (not isNonLeaf(dest) and dest.identifier not in taxonSet):
+                index = src._edges.index((dest, bootstrap, length))
+                src._edges = src._edges[:index] + src._edges[index+1:]
+                src._leaves_cache = None
+
+    class ZeroEventTrimmer(TreeVisitor):
+        def post_visit_edge(self, src, bootstrap, length, dest):
+            src._leaves_cache = None
+            addDegreeInfo(src)
+            if dest.degree == 2:
+                index = src._edges.index((dest, bootstrap, length))
+                src._edges = src._edges[:index] + src._edges[index+1:]
+                src._edges.insert(index, (dest.get_edges()[0][0], None, None))
+                src._leaves_cache = None
+
+    tree = copy.deepcopy(tree)
+    tree.dfs_traverse(LeafTrimmer())
+    tree.dfs_traverse(ZeroEventTrimmer())
+
+    tree._leaves_cache = None
+    addDegreeInfo(tree)
+    while tree.degree == 1 and isNonLeaf(tree._edges[0][0]):
+        tree = tree._edges[0][0]
+        tree._leaves_cache = None
+        addDegreeInfo(tree)
+    return (tree)
+
+
+class RestrictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(42)
+
+    def testSmallTree(self):
+        tree = parse_tree("((a:1,b:2):3,(c,(d,e)))")
+        self.assertEqual(str(restrict(tree, set(["a"]))), "(a)")
+        self.assertEqual(str(restrict(tree, set(["a", "b"]))), "(a:1.0,b:2.0)")
+        self.assertEqual(str(restrict(tree, set(["a", "c", "x"]))), "(a,c)")
+        self.assertEqual(str(restrict(tree, set(["c", "d", "e"]))), "(c,(d,e))")
+        self.assertEqual(str(restrict(tree, set(["x"]))), "()")
+        self.assertEqual(str(restrict(Leaf("a"), set(["a"]))), "a")
+        self.assertEqual(str(restrict(None, set(["a"]))), "()")
+
+    def testMatchesTrimming(self):
+        files = [datasetPath("simulated", "100-taxa", "50", "sm_data.0.model_tree"),
+                 datasetPath("simulated", "100-taxa", "50", "sm_data.0.source_trees"),
+                 datasetPath("biological", "seabirds", "kennedy.source_trees_manual")]
+        for file in files:
+            for source in readMultipleTreesFromFile(file):
+                tree = parse_tree(source)
+                index = RestrictionIndex(tree)
+                taxa = tree.get_leaves_identifiers()
+                taxonSets = [set(self.random.sample(taxa, size)) for size in (2, 3, 4, 7, len(taxa) // 2, len(taxa))]
+                restrictions = index.restrictMany(taxonSets)
+                for (taxonSet, restriction) in zip(taxonSets, restrictions):
+                    self.assertEqual(str(restriction), str(trimmingRestrict(tree, taxonSet)))
+
+    def testIndexLeavesTreeUntouched(self):
+        tree = parse_tree("((a,b),(c,d),(e,(f,g)))")
+        before = str(tree)
+        RestrictionIndex(tree).restrictMany([set(["a", "c", "f"]), set(["b", "g"])])
+        self.assertEqual(str(tree), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
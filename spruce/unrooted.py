@@ -200,10 +200,14 @@ def xfindDistinguishingQtrees (tree, src, dest):
     # assert: len(setA)*len(setB)*len(setC)*len(setD) == # of values yielded
 
     # return elements "in" {setA x setB x setC x setD}
-    for i in xrange(len(setA)):
-        for j in xrange(len(setB)):
-            for k in xrange(len(setC)):
-                for l in xrange(len(setD)):
+    #for i in xrange(len(setA)):
+    #    for j in xrange(len(setB)):
+    #        for k in xrange(len(setC)):
+    #            for l in xrange(len(setD)):
+    for i in range(len(setA)):
+        for j in range(len(setB)):
+            for k in range(len(setC)):
+                for l in range(len(setD)):
                     yield createQuartetTreeString(setA[i], setB[j], setC[k], setD[l])
 
 
@@ -218,10 +222,14 @@ def xfindDisplayedQtrees (tree, src, dest):
     (setA, setB) = (bp[0], bp[1])
     (lenA, lenB) = (len(setA), len(setB))
 
-    for i in xrange(0, lenA - 1):
-        for j in xrange(i + 1, lenA):
-            for k in xrange(0, lenB - 1):
-                for l in xrange(k + 1, lenB):
+    #for i in xrange(0, lenA - 1):
+    #    for j in xrange(i + 1, lenA):
+    #        for k in xrange(0, lenB - 1):
+    #            for l in xrange(k + 1, lenB):
+    for i in range(0, lenA - 1):
+        for j in range(i + 1, lenA):
+            for k in range(0, lenB - 1):
+                for l in range(k + 1, lenB):
                     yield createQuartetTreeString(setA[i], setA[j], setB[k], setB[l])
 
 
@@ -280,64 +288,211 @@ def xfindBipartitions (tree):
 
 
 
-def restrict (tree, taxonSet):
-    '''Return the restriction of a tree to a given taxon set.'''
-
-    class LeafTrimmer(TreeVisitor):
-        '''Remove all leaves not appearing in the given taxon set.'''
-
-        def post_visit_edge(self, src, bootstrap, length, dest):
-            src._leaves_cache = None
-
-            if len(dest.get_leaves_identifiers()) == 0:                     # case: empty subtree
-                index = src._edges.index((dest, bootstrap, length))
-                src._edges = src._edges[:index] + src._edges[index+1:]
-                src._leaves_cache = None
-
-            elif (not isNonLeaf(dest) and dest.identifier not in taxonSet): # case: "invalid" taxon
-                index = src._edges.index((dest, bootstrap, length))
-                src._edges = src._edges[:index] + src._edges[index+1:]
-                src._leaves_cache = None
-
-    class ZeroEventTrimmer(TreeVisitor):
-        '''Suppress all nodes of degree 2 (except the root, b/c that's cool).'''
-
-        def post_visit_edge(self, src, bootstrap, length, dest):
-            src._leaves_cache = None
-            addDegreeInfo(src)
-            if dest.degree == 2:
-                index = src._edges.index((dest, bootstrap, length))
-                src._edges = src._edges[:index] + src._edges[index+1:]
-                src._edges.insert(index, (dest.get_edges()[0][0], None, None))
-                src._leaves_cache = None
-
-    def rootFinder(tree):
-        '''Return the tree with root of degree 1 removed.'''
-
-        tree._leaves_cache = None
-        addDegreeInfo(tree)
-        while tree.degree == 1 and isNonLeaf(tree._edges[0][0]):
-            addDegreeInfo(tree)
-            (dest, bootstrap, length) = tree._edges[0]
-            tree._edges = []
-
-            del tree
-
-            tree = dest
-            tree._leaves_cache = None
-
-        return(tree)
-
-    if (tree == None):          # case: null tree
-        return Tree()
-    elif not isNonLeaf(tree):   # case: singleton tree
-        if tree.identifier in taxonSet:
-            return copy.deepcopy(tree)
+def buildTaxonIndex (taxa):
+    '''Map each of the given taxa to a bit position, in sorted order.'''
+    return dict([(taxon, i) for (i, taxon) in enumerate(sorted(set(taxa)))])
+
+
+
+def getTaxaMask (taxa, taxonIndex):
+    '''Return the bitmask of the given taxa.'''
+    mask = 0
+    for taxon in taxa:
+        mask |= 1 << taxonIndex[taxon]
+    return (mask)
+
+
+
+def countBits (mask):
+    '''Return the number of taxa in a bitmask.'''
+    return bin(mask).count("1")
+
+
+
+def findCladeMasks (tree, taxonIndex):
+    '''
+        Return the bitmasks of the leaf sets below each internal node of a
+        tree, except the root; i.e. one bitmask per internal edge, each
+        giving one side of the edge's bipartition.
+    '''
+    if (tree == None or not isNonLeaf(tree)):
+        return []
+
+    cladeMasks = []
+    stack = [(tree, False)]
+    masks = [0]
+    while stack:
+        (node, visited) = stack.pop()
+        if visited:
+            mask = masks.pop()
+            masks[-1] |= mask
+            cladeMasks.append(mask)
+        elif isNonLeaf(node):
+            stack.append((node, True))
+            masks.append(0)
+            for edge in node.get_edges():
+                stack.append((edge[0], False))
         else:
+            masks[-1] |= 1 << taxonIndex[node.identifier]
+
+    cladeMasks.pop()    # the root's
+    return (cladeMasks)
+
+
+
+def getSplitMasks (cladeMasks, taxaMask):
+    '''
+        Return the set of non-trivial bipartitions that the given clade
+        bitmasks induce on the given taxa, i.e. the bipartitions of the tree
+        restricted to those taxa.  Each bipartition is represented by the
+        bitmask of its side which does not hold the lowest bit of the taxa.
+    '''
+    lowestBit = taxaMask & -taxaMask
+    numTaxa = countBits(taxaMask)
+    splits = set()
+
+    for cladeMask in cladeMasks:
+        mask = cladeMask & taxaMask
+        if mask & lowestBit:
+            mask ^= taxaMask
+        size = countBits(mask)
+        if size >= 2 and numTaxa - size >= 2:
+            splits.add(mask)
+
+    return (splits)
+
+
+
+class RestrictionIndex(object):
+    '''
+        Index a tree for restricting it to many taxon sets.  The tree is
+        preprocessed once with an Euler tour and a sparse table over it, so
+        the lowest common ancestor of any two nodes is found in constant time.
+        The restriction to a set of k taxa is then built in O(k log k) time,
+        as the tree induced by those leaves and the LCAs of consecutive ones
+        (in preorder), without copying the rest of the tree.
+    '''
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.nodes = []         # nodes in preorder; a node is known by its preorder number
+        self.parents = []       # preorder number of each node's parent (-1 for the root)
+        self.edges = []         # (bootstrap, length) of the edge leading to each node
+        self.ends = []          # largest preorder number found in each node's subtree
+        self.leaves = {}        # leaf identifier -> preorder number
+        self.firsts = []        # position of each node's first occurrence in the Euler tour
+
+        eulerTour = []
+        stack = []
+        if tree != None:
+            stack.append((tree, -1, None, None))
+        while stack:
+            (node, parent, bootstrap, length) = stack.pop()
+            if node == None:    # case: all children of "parent" visited
+                self.ends[parent] = len(self.nodes) - 1
+                if self.parents[parent] >= 0:
+                    eulerTour.append(self.parents[parent])
+                continue
+
+            index = len(self.nodes)
+            self.nodes.append(node)
+            self.parents.append(parent)
+            self.edges.append((bootstrap, length))
+            self.ends.append(index)
+            self.firsts.append(len(eulerTour))
+            eulerTour.append(index)
+
+            if isNonLeaf(node):
+                stack.append((None, index, None, None))
+                for (child, childBootstrap, childLength) in reversed(node.get_edges()):
+                    stack.append((child, index, childBootstrap, childLength))
+            else:
+                self.leaves[node.identifier] = index
+                if parent >= 0:
+                    eulerTour.append(parent)
+
+        # sparse table: the minimum preorder number within a range of the Euler
+        #   tour is the preorder number of the LCA of the range's endpoints
+        self.sparseTable = [eulerTour]
+        span = 1
+        while 2 * span <= len(eulerTour):
+            previous = self.sparseTable[-1]
+            self.sparseTable.append(list(map(min, previous[:len(previous) - span], previous[span:])))
+            span *= 2
+
+    def lca(self, node1, node2):
+        '''Return the preorder number of the LCA of the two given nodes (preorder numbers).'''
+        (left, right) = (self.firsts[node1], self.firsts[node2])
+        if left > right:
+            (left, right) = (right, left)
+        level = (right - left + 1).bit_length() - 1
+        row = self.sparseTable[level]
+        return min(row[left], row[right - (1 << level) + 1])
+
+    def restrict(self, taxonSet):
+        '''Return the restriction of the indexed tree to a given taxon set.'''
+
+        if (self.tree == None):             # case: null tree
             return Tree()
-    else:                       # case: "normal" tree
-        tree = copy.deepcopy(tree)
-        tree.dfs_traverse(LeafTrimmer())
-        tree.dfs_traverse(ZeroEventTrimmer())
-        tree = rootFinder(tree)
-        return (tree)
+        elif not isNonLeaf(self.tree):      # case: singleton tree
+            if self.tree.identifier in taxonSet:
+                return copy.deepcopy(self.tree)
+            else:
+                return Tree()
+
+        leaves = sorted([self.leaves[taxon] for taxon in taxonSet if taxon in self.leaves])
+        if len(leaves) == 0:
+            return Tree()
+
+        # the induced tree's nodes, in preorder
+        nodes = set(leaves)
+        for i in range(len(leaves) - 1):
+            nodes.add(self.lca(leaves[i], leaves[i + 1]))
+        nodes = sorted(nodes)
+
+        # case: single taxon, still hanging from the (unrooted) tree's root
+        if len(nodes) == 1:
+            restriction = Tree()
+            restriction.add_edge(self.__induced_edge(0, leaves[0]))
+            return restriction
+
+        # link each node to its closest ancestor within the induced tree
+        subtrees = {}
+        stack = []
+        for node in nodes:
+            while stack and self.ends[stack[-1]] < node:
+                stack.pop()
+
+            if isNonLeaf(self.nodes[node]):
+                subtrees[node] = Tree()
+            if stack:
+                subtrees[stack[-1]].add_edge(self.__induced_edge(stack[-1], node, subtrees.get(node)))
+            stack.append(node)
+
+        return subtrees[nodes[0]]
+
+    def restrictMany(self, taxonSets):
+        '''Return the restrictions of the indexed tree to each of the given taxon sets.'''
+        return [self.restrict(taxonSet) for taxonSet in taxonSets]
+
+    def __induced_edge(self, ancestor, node, subtree = None):
+        '''
+            Return the edge from an ancestor to a node of the induced tree.
+            Edges replacing paths (i.e. suppressed nodes) lose their bootstrap
+            and length values.
+        '''
+        if subtree == None:
+            subtree = Leaf(self.nodes[node].identifier)
+        if self.parents[node] == ancestor:
+            (bootstrap, length) = self.edges[node]
+            return (subtree, bootstrap, length)
+        return (subtree, None, None)
+
+
+
+def restrict (tree, taxonSet):
+    '''
+        Return the restriction of a tree to a given taxon set.  To restrict the
+        same tree to several taxon sets, build a RestrictionIndex once instead.
+    '''
+    return RestrictionIndex(tree).restrict(taxonSet)
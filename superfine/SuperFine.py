@@ -29,69 +29,249 @@
 #   The license is exactly the same of the baseline implementation (see above).                                        #
 ########################################################################################################################
 
-import os, sys, copy
+import os, sys, copy, time
 
 from newick_modified.tree import *
 from spruce.unrooted import *
 from spruce.metrics import *
 from superfine.adapters import *
+from superfine.checkpoint import Checkpoint, describeReconciler, findGroupKeys
 from superfine.logger import *
+from superfine.relabeling import RelabeledView, PolytomyIndex
+from superfine.selection import DEFAULT_RULES, matchRule
 
 
 def SuperFine(input, options):
     """Main SuperFine loop."""
 
-    # Read phase/step
-    sourceTrees = [parse_tree(sourceTree) for sourceTree in readMultipleTreesFromFile(input)]
-
-    if options.writeData:
-        (baseName, _, _) = input.rpartition(".")
+    logger = Logger()
+    if options.profile:
+        from superfine.profiling import Profiler
+        logger.profiler = Profiler(options.profile, options.profileSlowest)
+    if options.trace:
+        logger.startTrace()
+        command_observers.append(logger.logCommand)
 
-    # SCM phase/step
-    tree = mergeTrees(sourceTrees, options)
+    # Read phase/step
+    sourceTrees = readSourceTrees(input, logger)
+
+    # SCM phase/step, unless resuming from a checkpoint which holds the SCM tree;
+    #   when updating a previous run, only the new source trees are merged into
+    #   its SCM tree
+    with logger.phase("scm") as record:
+        (checkpoint, previous, newSources) = (None, None, [])
+        tree = None
+        if options.update:
+            previous = Checkpoint(options.update)
+            newSources = previous.findNewSources(input)
+        if options.checkpointDir:
+            checkpoint = Checkpoint(options.checkpointDir, input)
+            tree = checkpoint.loadTree()
+
+        if tree == None:
+            if previous:
+                tree = mergeNewTrees(previous.loadTree(), [sourceTrees[i] for i in newSources])
+                record["trees"] = len(newSources)
+            else:
+                tree = mergeTrees(sourceTrees, options)
+                record["trees"] = len(sourceTrees)
+            if checkpoint:
+                checkpoint.saveTree(tree)
+        record["taxa"] = len(tree.get_leaves_identifiers())
 
     if options.writeData:
-        f = open(baseName + ".scmTree." + options.writeData, 'w')
-        f.write(str(tree))
-        f.write(';\n')
-        f.close()
+        writeTree(tree, input, "scmTree", options.writeData)
 
     # Refinement step/phase
     #
     # key: polytomy node, value: list of bipartitions below the polytomy to
-    #   effect; each bipartition is represented as a set of polytomy subtrees,
-    #   and the set of all other leaf labels in the tree implicitly represents
-    #   the set of leaf labels on the other side of the bipartition
+    #   effect; each bipartition is represented as a bitmask of polytomy
+    #   subtrees (bit i standing for the i-th one), and the set of all other
+    #   leaf labels in the tree implicitly represents the set of leaf labels on
+    #   the other side of the bipartition
     bipartitionsToAdd = {}
-    logger = Logger()
+    with logger.phase("refine") as record:
+        (polytomyIndex, polytomyOptions, restored, groupKeys) = indexPolytomies(tree, sourceTrees, options, logger,
+                                                                                checkpoint, previous, newSources)
+        record["polytomies"] = len(polytomyIndex.polytomies)
+
+        if options.jobs > 1 or options.queue:
+            from superfine.parallel import refinePolytomies
+            bipartitionsToAdd = refinePolytomies(polytomyIndex, polytomyOptions, restored, logger, options,
+                                                 checkpoint, groupKeys)
+        else:
+            for (position, polytomy) in enumerate(polytomyIndex.polytomies):
+                (found, bipartitions) = restored[position]
+                if not found:
+                    bipartitions = refinePolytomy(polytomy, sourceTrees, logger, polytomyOptions[position],
+                                                  polytomyIndex)
+                    if checkpoint and not isinstance(bipartitions, UnfinishedBipartitions):
+                        checkpoint.record(groupKeys[position], describeReconciler(polytomyOptions[position]),
+                                          bipartitions)
+                if bipartitions is not None:
+                    bipartitionsToAdd[polytomy] = bipartitions
+
+        for journal in (checkpoint, previous):
+            if journal:
+                journal.close()
+
+    # add new bipartitions to the original SCM tree, and print the output to
+    #   stdout (diagnostic info goes to stderr)
+    finishTree(tree, bipartitionsToAdd, input, options, logger)
+
+    if options.stats:
+        logger.writeStats(options.stats, input)
+    if logger.profiler:
+        logger.profiler.close()
+    if options.trace:
+        command_observers.remove(logger.logCommand)
+        logger.writeTrace(options.trace)
+
+    if options.verbose:
+        logger.printInfo()
+
+
+
+def readSourceTrees(input, logger):
+    '''Read the source trees from the input file.'''
+    with logger.phase("read") as record:
+        sourceTrees = [parse_tree(sourceTree) for sourceTree in readMultipleTreesFromFile(input)]
+        record["trees"] = len(sourceTrees)
+    return (sourceTrees)
+
+
+
+def writeTree(tree, input, name, suffix):
+    '''Write a tree (e.g. the SCM tree, as "scmTree") next to the input file, as input-base.name.suffix.'''
+    (baseName, _, _) = input.rpartition(".")
+    f = open(baseName + "." + name + "." + suffix, 'w')
+    f.write(str(tree))
+    f.write(';\n')
+    f.close()
+
+
+
+def indexPolytomies(tree, sourceTrees, options, logger, checkpoint = None, previous = None, newSources = []):
+    '''
+        Index the polytomies of the SCM tree, and pick the options with which
+        to resolve each one.  Return the index, the options, and the
+        polytomies found resolved already (with their group keys; see
+        restorePolytomies()).
+    '''
+    polytomyIndex = PolytomyIndex(tree, sourceTrees)
+    polytomyOptions = [chooseReconciler(polytomy, polytomyIndex, options, logger)
+                       for polytomy in polytomyIndex.polytomies]
+    (restored, groupKeys) = restorePolytomies(polytomyIndex, polytomyOptions, logger, checkpoint, previous,
+                                              newSources)
+    return (polytomyIndex, polytomyOptions, restored, groupKeys)
 
-    if options.reconciler == "qmc":
-        for polytomy in xfindPolytomies(tree):
-            (quartetTrees, delabeling) = encodeSourceTrees(polytomy, sourceTrees, logger, options)
+
+
+def finishTree(tree, bipartitionsToAdd, input, options, logger):
+    '''
+        Refine the SCM tree with the bipartitions found for its polytomies, and
+        write it out: to stdout, or next to the input file (with options.writeData).
+    '''
+    with logger.phase("expand", bipartitions = sum([len(bipartitions) for bipartitions in bipartitionsToAdd.values()])):
+        expandTree(bipartitionsToAdd)
+
+    with logger.phase("write"):
+        if options.writeData:
+            writeTree(tree, input, "SuperFineTree", options.writeData)
+        else:
+            print(str(tree) + ';')
+
+
+
+def chooseReconciler(polytomy, polytomyIndex, options, logger = None):
+    '''
+        Return the options with which to resolve the polytomy.  Unless the
+        "auto" reconciler is selected, these are the given options; otherwise,
+        they are a copy naming the reconciler picked for the polytomy by the
+        rule table (options.reconcilerRules, or the default one).
+    '''
+    if options.reconciler != "auto":
+        return (options)
+
+    rules = options.reconcilerRules or DEFAULT_RULES
+    degree = polytomy.degree
+    reconciler = matchRule(rules, degree, len(polytomyIndex.informativeSources(polytomy)),
+                           polytomyIndex.estimateQuartets(polytomy))
+    if logger:
+        logger.logChoice(degree, reconciler)
+
+    polytomyOptions = copy.copy(options)
+    polytomyOptions.reconciler = reconciler
+    return (polytomyOptions)
+
+
+
+def restorePolytomies(polytomyIndex, polytomyOptions, logger, checkpoint = None, previous = None, newSources = []):
+    '''
+        Find the polytomies which need not be reconciled: those journaled in
+        the checkpoint (by an interrupted run) and, when updating the run of
+        the previous checkpoint with new source trees, those which that run
+        resolved and which no new source tree is informative about.  Return,
+        for each polytomy, a pair (found, bipartitions), and the group hashes
+        by which to journal the others to the checkpoint.
+    '''
+    reconcilers = [describeReconciler(polytomyOption) for polytomyOption in polytomyOptions]
+    restored = [(False, None)] * len(polytomyIndex.polytomies)
+    groupKeys = None
+
+    if checkpoint:
+        groupKeys = findGroupKeys(polytomyIndex)
+        for position in range(len(restored)):
+            restored[position] = checkpoint.restore(groupKeys[position], reconcilers[position])
+            if restored[position][0]:
+                logger.logRestored()
+
+    if previous:
+        # the previous run's source trees only have its taxa, so their
+        #   relabelings only depend on the groups restricted to these taxa
+        previousKeys = findGroupKeys(polytomyIndex, set(previous.loadTree().get_leaves_identifiers()))
+        newSources = set(newSources)
+        logger.logUpdate(len(newSources), len(restored))
+        for (position, polytomy) in enumerate(polytomyIndex.polytomies):
+            if restored[position][0] or 0 in previousKeys[position] or \
+                    newSources.intersection(polytomyIndex.informativeSources(polytomy)):
+                continue
+            restored[position] = previous.restore(previousKeys[position], reconcilers[position])
+            if restored[position][0]:
+                logger.logReused()
+                if checkpoint:
+                    checkpoint.record(groupKeys[position], reconcilers[position], restored[position][1])
+
+    return (restored, groupKeys)
+
+
+
+def refinePolytomy(polytomy, sourceTrees, logger, options, polytomyIndex = None):
+    '''
+        Resolve a polytomy with the reconciler named by the options.  Return
+        the bipartitions to add below the polytomy, or None if no source tree
+        is informative about it.
+    '''
+    with logger.phase("polytomy", degree = polytomy.degree, reconciler = options.reconciler):
+        if options.reconciler == "qmc":
+            with logger.phase("encode") as record:
+                (quartetTrees, delabeling) = encodeSourceTrees(polytomy, sourceTrees, logger, options, polytomyIndex)
+                record["quartets"] = len(quartetTrees)
 
             if quartetTrees:    # not empty list of quartet trees with which to resolve polytomy
                 quartetTrees = selectSubset(quartetTrees, options)
-                bipartitionsToAdd[polytomy] = reconcileTrees(quartetTrees, delabeling, options)
-    elif options.reconciler.endswith("mrp") or options.reconciler.endswith("fml") or options.reconciler.endswith("rml"):
-        for polytomy in xfindPolytomies(tree):
-            (newSourceTrees, delabeling) = relabelSourceTrees(polytomy, sourceTrees, logger, options)
+                return reconcileTrees(quartetTrees, polytomy.degree, options, logger)
+        elif options.reconciler.endswith("mrp") or options.reconciler.endswith("fml") or \
+                options.reconciler.endswith("rml"):
+            with logger.phase("relabel") as record:
+                (newSourceTrees, delabeling) = relabelSourceTrees(polytomy, sourceTrees, logger, options,
+                                                                  polytomyIndex)
+                record["trees"] = len(newSourceTrees)
 
             if newSourceTrees:  # there are new source trees with which to resolve polytomy
-                bipartitionsToAdd[polytomy] = reconcileTrees(newSourceTrees, delabeling, options)
-
-    # add new bipartitions to the original SCM tree
-    expandTree(bipartitionsToAdd)
-
-    # print output to stdout, diagnostic info to stderr
-    if options.writeData:
-        f = open(baseName + ".SuperFineTree." + options.writeData, 'w')
-        f.write(str(tree))
-        f.write(';\n')
-        f.close()
+                return reconcileTrees(newSourceTrees, polytomy.degree, options, logger)
 
-    else:
-        print(str(tree) + ';')
-    #logger.printInfo()
+    return None
 
 
 
@@ -107,6 +287,19 @@ def mergeTrees(sources, options):
 
 
 
+def mergeNewTrees(tree, sources):
+    '''
+        Merge new source trees into an existing SCM tree using the strict
+        consensus merger.
+    '''
+    sourceTrees = copy.deepcopy(sources)
+    scm = SCMAdapter(sourceTrees, "")
+    mergerTree = addDegreeInfo(scm.merge_into(tree))
+
+    return (mergerTree)
+
+
+
 def addQuartets(quartetTrees, newQuartetTrees):
     '''
         Add the new quartet trees to the list of quartet trees.
@@ -117,7 +310,25 @@ def addQuartets(quartetTrees, newQuartetTrees):
 
 
 
-def relabelSourceTrees(polytomy, sourceTrees, logger, options):
+def findInformativeViews(polytomy, sourceTrees, polytomyIndex = None):
+    '''
+        Return relabeled views of the source trees which are informative about
+        the polytomy (i.e. relabeled with at least 4 unique labels), and a data
+        structure mapping back to the original labels.  Source trees known to
+        be uninformative from the polytomy index (if given) aren't looked at.
+    '''
+    if polytomyIndex != None:
+        return polytomyIndex.getInformativeViews(polytomy)
+
+    (relabeling, delabeling) = buildRelabeling(polytomy)
+    defaultLabel = len(set(relabeling.values()))
+
+    views = [RelabeledView(sourceTree, relabeling, defaultLabel) for sourceTree in sourceTrees]
+    return ([view for view in views if view.isInformative()], delabeling)
+
+
+
+def relabelSourceTrees(polytomy, sourceTrees, logger, options, polytomyIndex = None):
     '''
         Relabel leaves in source trees with labels {1, ..., d} where d is the 
         degree of the polytomy.  Replace subtrees rooted at interior nodes whose
@@ -127,31 +338,30 @@ def relabelSourceTrees(polytomy, sourceTrees, logger, options):
     '''
 
     newSourceTrees = []
-    (relabeling, delabeling) = buildRelabeling(polytomy)
 
-    for sourceTree in sourceTrees:
-        relabeledSourceTree = relabelTree(sourceTree, relabeling)
-        relabeledSourceTree = collapseTree(relabeledSourceTree)
-        newSourceTrees.append(relabeledSourceTree)
+    # source trees relabeled with less than 4 unique labels are uninformative,
+    #   and aren't even copied
+    (views, delabeling) = findInformativeViews(polytomy, sourceTrees, polytomyIndex)
+    for view in views:
+        newSourceTrees.append(collapseTree(view.materialize()))
 
     newSourceTrees = removeUninformativeRelabeledTrees(newSourceTrees)
+    logger.logInfo(len(newSourceTrees))
     return(newSourceTrees, delabeling)
 
 
 
-def encodeSourceTrees(polytomy, sourceTrees, logger, options):
+def encodeSourceTrees(polytomy, sourceTrees, logger, options, polytomyIndex = None):
     '''
         Encode all source trees into a single list of quartet trees.
     '''
     quartetTrees = {}
 
-    (relabeling, delabeling) = buildRelabeling(polytomy)
+    (views, delabeling) = findInformativeViews(polytomy, sourceTrees, polytomyIndex)
 
     # find quartet trees
-    for sourceTree in sourceTrees:
-        relabeledSourceTree = relabelTree(sourceTree, relabeling)
-
-        treeToEncode = collapseTree(relabeledSourceTree)
+    for view in views:
+        treeToEncode = collapseTree(view.materialize())
 
         qtrees = findDisplayedQtrees(treeToEncode)
         quartetTrees = addQuartets(quartetTrees, qtrees)
@@ -173,26 +383,94 @@ def selectSubset(quartetTrees, options):
 
 
 
-def reconcileTrees(trees, delabeling, options):
+def findReconcilerTiers(trees, options):
     '''
-        Infer a tree from a set of quartet trees using QMC, MRP, or MRL
-        as a black box subroutine.  Map this inferred tree to implied 
-        bipartitions in the SCM merger tree using the given delabeling.
+        Return the reconcilers to try in turn on a polytomy, each with a name
+        for the run report.  Under a time limit (options.timeout) on all of
+        them, MRP runs for nine tenths of it at most, then falls back to a
+        tenth of the ratchet iterations for the time left; when every tier
+        runs out of time, the polytomy is left unresolved.
     '''
+    timeout = options.timeout
     if options.reconciler == "qmc": # QMC
         quartetTrees = trees
-        reconciler = QMCAdapter(quartetTrees)
+        return [("qmc", QMCAdapter(quartetTrees, timeout))]
     elif options.reconciler.endswith("mrp"): # MRP
         sourceTrees = trees
-        reconciler = MRPAdapter(sourceTrees, options.numIters, options.reconciler)
+        fewerIters = max(1, options.numIters // 10)
+        fallback = timeout and fewerIters < options.numIters
+        tiers = [("%s (%d ratchet iterations)" % (options.reconciler, options.numIters),
+                  MRPAdapter(sourceTrees, options.numIters, options.reconciler, options.compress,
+                             timeout * 0.9 if fallback else timeout))]
+        if fallback:
+            tiers.append(("%s (%d ratchet iterations)" % (options.reconciler, fewerIters),
+                          MRPAdapter(sourceTrees, fewerIters, options.reconciler, options.compress, timeout)))
+        return tiers
     elif options.reconciler.endswith("fml") or options.reconciler.endswith("rml"): # MRL
         sourceTrees = trees
-        reconciler = MRLAdapter(sourceTrees, options.reconciler)
+        return [(options.reconciler, MRLAdapter(sourceTrees, options.reconciler, options.compress, timeout))]
     else: # None
-        pass
+        return []
 
-    tree = reconciler.get_tree()
-    return findImpliedBipartitions(tree, delabeling)
+
+
+class UnfinishedBipartitions(list):
+    '''
+        The bipartitions of a polytomy whose reconciler ran out of time: those
+        found by a fallback tier, or none if every tier ran out.  A run with
+        more time may find others, so they are not journaled to a checkpoint.
+    '''
+    pass
+
+
+
+def reconcileTrees(trees, degree, options, logger = None):
+    '''
+        Infer a tree from a set of quartet trees using QMC, MRP, or MRL
+        as a black box subroutine.  Map this inferred tree to implied
+        bipartitions over the groups of the polytomy, whose degree (that of
+        its node) is logged with any fallback.
+        The subroutine calls share the per-polytomy time limit (if any): a
+        call still running past its share is cancelled, and the next tier is
+        tried for the time left, and the bipartitions found then (or none) are
+        UnfinishedBipartitions.
+    '''
+    if logger == None:
+        logger = Logger()
+
+    tiers = findReconcilerTiers(trees, options)
+    deadline = time.time() + options.timeout if options.timeout else None
+    for (tier, (name, reconciler)) in enumerate(tiers):
+        start = time.time()
+        fallback = tiers[tier + 1][0] if tier + 1 < len(tiers) else "unresolved"
+        if deadline != None:
+            if deadline - start <= 0:
+                logger.logFallback(degree, name, fallback, 0.0)
+                continue
+            reconciler.timeout = min(reconciler.timeout, deadline - start)
+        try:
+            with logger.phase("reconcile", reconciler = name, trees = len(trees)) as record:
+                tree = reconciler.get_tree()
+                if hasattr(reconciler, "patterns"):
+                    (record["sites"], record["patterns"]) = (reconciler.sites, reconciler.patterns)
+        except ReconcilerTimeout:
+            logger.logFallback(degree, name, fallback, time.time() - start)
+            continue
+
+        if options.compress and hasattr(reconciler, "patterns"):
+            logger.logCompression(degree, reconciler.sites, reconciler.patterns)
+
+        with logger.phase("decode") as record:
+            bipartitions = findImpliedBipartitions(tree)
+            record["bipartitions"] = len(bipartitions)
+        if tier > 0:
+            bipartitions = UnfinishedBipartitions(bipartitions)
+        return (bipartitions)
+
+    # every tier ran out of time: leave the polytomy unresolved
+    if tiers:
+        logger.logTimedOut()
+    return UnfinishedBipartitions()
 
 
 
@@ -221,13 +499,8 @@ def relabelTree(source, relabeling):
     '''
         Relabel the leaves of a source tree with the given relabeling.
     '''
-    sourceTree = copy.deepcopy(source)
     defaultLabel = len(set(relabeling.values()))
-
-    for leaf in sourceTree.get_leaves():
-        leaf.set_leaf_identifier(relabeling.get(leaf.identifier, # key
-                                                defaultLabel))   # default value
-    return(sourceTree)
+    return RelabeledView(source, relabeling, defaultLabel).materialize()
 
 
 
@@ -343,37 +616,124 @@ def removeUninformativeQTrees(quartetTrees):
 
 
 
-def findImpliedBipartitions(reconciledTree, delabeling):
+def decodeGroupTree(reconciledTree):
     '''
-        Find the bipartitions implied by the subroutine. Return as a list of
-        lists of subtrees.
+        Decode a tree whose leaves are labeled by polytomy group numbers, given
+        in Newick format (as output by the subroutine) or as a Tree.  Return the
+        group bitmask of each node, its parent's index, and whether it is a
+        leaf, with nodes indexed in preorder.  Branch lengths, support values,
+        and comments are skipped over in a single scan of the Newick string.
     '''
-    ####################################################################################################################
-    # inserted by: diogo telmo neves - dneves@di.uminho.pt
-    #
-    import re
-    reconciledTree = re.sub(r"\)[0-9]+(\.[0-9]+)?", ")", reconciledTree, flags=re.MULTILINE)
-    #
-    ####################################################################################################################
+    masks = []
+    parents = []
+    leaves = []
+
+    if not isinstance(reconciledTree, str):
+        if (reconciledTree == None):
+            return (masks, parents, leaves)
+        stack = [(reconciledTree, -1)]
+        while stack:
+            (node, parent) = stack.pop()
+            parents.append(parent)
+            if isNonLeaf(node):
+                masks.append(0)
+                leaves.append(False)
+                for edge in reversed(node.get_edges()):
+                    stack.append((edge[0], len(masks) - 1))
+            else:
+                masks.append(1 << int(node.identifier))
+                leaves.append(True)
+
+        for node in range(len(masks) - 1, 0, -1):
+            masks[parents[node]] |= masks[node]
+        return (masks, parents, leaves)
+
+    delimiters = "(),:;[ \t\r\n"
+    (position, end) = (0, len(reconciledTree))
+    current = -1        # index of the innermost open node
+    while position < end:
+        character = reconciledTree[position]
+
+        if character == '(':
+            masks.append(0)
+            parents.append(current)
+            leaves.append(False)
+            current = len(masks) - 1
+            position += 1
+
+        elif character == ')':
+            if parents[current] >= 0:
+                masks[parents[current]] |= masks[current]
+            current = parents[current]
+            position += 1
+            # skip the node's label (e.g. a support value)
+            while position < end and reconciledTree[position] not in delimiters:
+                position += 1
+
+        elif character == ':':
+            # skip the branch length
+            position += 1
+            while position < end and reconciledTree[position] not in delimiters:
+                position += 1
+
+        elif character == '[':
+            position = reconciledTree.index(']', position) + 1
+
+        elif character in ",; \t\r\n":
+            position += 1
 
-    bipartitions = []
-    tree = parse_tree(reconciledTree)
+        else:
+            start = position
+            while position < end and reconciledTree[position] not in delimiters:
+                position += 1
+            mask = 1 << int(reconciledTree[start:position])
+            masks.append(mask)
+            parents.append(current)
+            leaves.append(True)
+            if current >= 0:
+                masks[current] |= mask
+
+    return (masks, parents, leaves)
 
-    for (src, dest) in getInternalEdges(tree):
-        # find bipartition induced by the given edge
-        setA = [label for label in dest.get_leaves_identifiers()]
-        setB = [label for label in tree.get_leaves_identifiers() if label not in setA]
 
-        # Parent of the polytomy (if one exists) is always given by the largest
-        #   label number. We want to store the bipartition leaf set which does
-        #   *not* include it.
-        identifierIntegers = [int(leaf) for leaf in tree.get_leaves_identifiers()]
-        maxElement = str(max(identifierIntegers))
 
-        if maxElement not in setA:
-            bipartitions.extend([[delabeling[int(label)] for label in setA]])
+def findImpliedBipartitions(reconciledTree):
+    '''
+        Find the bipartitions implied by the subroutine, i.e. by the internal
+        edges of the reconciled tree (as found by getInternalEdges()).  Return
+        them as group bitmasks, each bit standing for a polytomy subtree.
+    '''
+    (masks, parents, leaves) = decodeGroupTree(reconciledTree)
+
+    # cases: null tree, singleton tree
+    if len(masks) == 0 or leaves[0]:
+        return []
+
+    # as in getInternalEdges(), a root of degree 2 has its pair of edges
+    #   treated as a single internal edge, and a root of degree 1 is skipped
+    rootChildren = [node for node in range(1, len(masks)) if parents[node] == 0]
+    skipped = set()
+    if len(rootChildren) == 2:
+        skipped.add(rootChildren[1])
+        if leaves[rootChildren[1]]:
+            skipped.add(rootChildren[0])
+    elif len(rootChildren) == 1:
+        skipped.add(rootChildren[0])
+
+    # Parent of the polytomy (if one exists) is always given by the largest
+    #   group number. We want to store the bipartition side which does *not*
+    #   include it.
+    allGroups = masks[0]
+    parentGroup = 1 << (allGroups.bit_length() - 1)
+
+    bipartitions = []
+    for node in range(1, len(masks)):
+        if leaves[node] or node in skipped:
+            continue
+        if masks[node] & parentGroup:
+            bipartitions.append(allGroups ^ masks[node])
         else:
-            bipartitions.extend([[delabeling[int(label)] for label in setB]])
+            bipartitions.append(masks[node])
 
     return (bipartitions)
 
@@ -383,43 +743,30 @@ def expandTree(bipartitionsToAdd):
     '''Add newly found bipartitions to the original SCM tree.'''
 
     for polytomy in bipartitionsToAdd.keys():
-        bipartitions = bipartitionsToAdd[polytomy]
-
-        # categorize bipartitions by size (i.e. # of subtrees)
-        sizes = {}
-        for bipartition in bipartitions:
-            length = len(bipartition)
-            #if (sizes.has_key(length)):
-            if (length in sizes.keys()):
-                sizes[length].append(bipartition)
-            else:
-                sizes[length] = [bipartition]
-
-        # iterate over bipartitions, smallest to largest
-        for size in sorted(sizes.keys()):
-            for bipartition in sizes[size]:
-
-                # find leaves which must be positioned on one side of the new
-                #   bipartition
-                bipartitionLeaves = []
-                for subtree in bipartition:
-                    bipartitionLeaves.extend(subtree.get_leaves_identifiers())
-
-                # find branches to relocate below the new edge (i.e. all
-                #   polytomy-incident branches s.t. all of their leaf
-                #   descendants are in bipartitionLeaves)
-                branchesToMove = []
-                for edge in polytomy.get_edges():
-                    problemLabels = [label for label in edge[0].get_leaves_identifiers()
-                                           if label not in bipartitionLeaves]
-                    if len(problemLabels) == 0:
-                        branchesToMove.append(edge)
-
-                # construct subtree to be positioned below the new edge
-                newSubtree = Tree()
-                for edge in branchesToMove:
+        # each branch incident on the polytomy is represented (as is each
+        #   bipartition) by the bitmask of the polytomy subtrees below it
+        branches = [(edge, 1 << i) for (i, edge) in enumerate(polytomy.get_edges())]
+        bipartitions = [(countBits(mask), mask) for mask in bipartitionsToAdd[polytomy]]
+
+        # iterate over bipartitions, smallest (i.e. fewest subtrees) to largest
+        bipartitions.sort(key = lambda bipartition: bipartition[0])
+        for (size, bipartitionMask) in bipartitions:
+
+            # relocate below the new edge all polytomy-incident branches s.t.
+            #   all of their polytomy subtrees are in the bipartition
+            newSubtree = Tree()
+            newMask = 0
+            remainingBranches = []
+            for (edge, mask) in branches:
+                if mask & ~bipartitionMask:
+                    remainingBranches.append((edge, mask))
+                else:
                     newSubtree.add_edge(edge)
-                    polytomy._edges.remove(edge)
+                    newMask |= mask
+
+            # attach new subtree to the polytomy node
+            remainingBranches.append(((newSubtree, None, None), newMask))
+            branches = remainingBranches
 
-                # attach new subtree to the polytomy node
-                polytomy.add_edge((newSubtree, None, None))
+        polytomy._edges = [edge for (edge, mask) in branches]
+        polytomy._leaves_cache = None
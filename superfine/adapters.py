@@ -34,26 +34,135 @@ import sys
 import tempfile
 import random
 import os
+import threading
+import time
 from subprocess import Popen, PIPE
 from dendropy.dataio import trees_from_newick
 from dendropy.scripts.strict_consensus_merge import strict_consensus_merge
-from spruce.mrp import matrixRepresentation, writeRatchetInputFile, getConsensusTreesFromPaupFiles, readTreesFromRatchet
+from spruce.mrp import matrixRepresentation, compressMatrix, writeRatchetInputFile, getConsensusTreesFromPaupFiles, \
+    readTreesFromRatchet
 from spruce.unrooted import readNewickFile
 from newick_modified.tree import Tree, parse_tree
 from matrix_representation.MatrixRepresentation import MatrixRepresentation
 
 
-def call_command(command, input):
-    """Call the command as a subprocess with the given input, and return output and error streams."""
+class ReconcilerTimeout(Exception):
+    """Raised when a subprocess is killed for running past its time limit."""
+
+    def __init__(self, command, timeout):
+        Exception.__init__(self, "%s killed after %s seconds" % (command, timeout))
+        self.command = command
+        self.timeout = timeout
+
+
+# functions called as f(command, pid, start, end, returncode) each time a subprocess ends (e.g. to trace it)
+command_observers = []
+
+
+def report_command(command, pipe, start):
+    """Report a subprocess which has ended, started at the given time, to the command observers."""
+    end = time.time()
+    for observer in command_observers:
+        observer(command, pipe.pid, start, end, pipe.returncode)
+
+
+def start_timer(pipe, timeout):
+    """Start a timer that kills the subprocess after timeout seconds (if given); return it and its expiry flag."""
+    expired = []
+    if timeout is None:
+        return None, expired
+
+    def kill():
+        expired.append(True)
+        try:
+            pipe.kill()
+        except OSError:     # the subprocess has just exited
+            pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    timer.start()
+    return timer, expired
+
+
+def stop_timer(timer, expired, command, timeout):
+    """Cancel the timer; raise ReconcilerTimeout if it went off."""
+    if timer is not None:
+        timer.cancel()
+    if expired:
+        raise ReconcilerTimeout(command, timeout)
+
+
+def call_command(command, input, timeout=None, stdout=PIPE):
+    """
+    Call the command as a subprocess with the given input, and return output and error streams.  If a timeout (in
+    seconds) is given, the subprocess is killed once it runs for longer, and ReconcilerTimeout is raised.
+    """
     try:
-        pipe = Popen(command, stdin = PIPE, stdout = PIPE, stderr = PIPE)
-        (output, err) = pipe.communicate(input)
-        return output, err
+        start = time.time()
+        pipe = Popen(command, stdin = PIPE, stdout = stdout, stderr = PIPE)
+    except OSError:
+        print("Execution of %s failed" % command)
+        sys.exit(1)
+
+    (timer, expired) = start_timer(pipe, timeout)
+    (output, err) = pipe.communicate(input)
+    report_command(command, pipe, start)
+    stop_timer(timer, expired, command, timeout)
+    return output, err
+
 
+def stream_command(command, lines, chunk_size=10000, timeout=None):
+    """
+    Call the command as a subprocess, writing the given lines (from any iterable) to its input in chunks while its
+    output is being read, and return output and error streams.  Only one chunk of input is held in memory at a time.
+    The timeout is as in call_command().
+    """
+    try:
+        start = time.time()
+        pipe = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
     except OSError:
         print("Execution of %s failed" % command)
         sys.exit(1)
 
+    def write_input():
+        try:
+            separator = ""
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) == chunk_size:
+                    pipe.stdin.write(separator + '\n'.join(chunk))
+                    (separator, chunk) = ('\n', [])
+            if chunk:
+                pipe.stdin.write(separator + '\n'.join(chunk))
+        except (IOError, OSError):  # the command quit early; its error stream tells why
+            pass
+        finally:
+            try:
+                pipe.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    (timer, expired) = start_timer(pipe, timeout)
+    errors = []
+    threads = [threading.Thread(target=write_input),
+               threading.Thread(target=lambda: errors.append(pipe.stderr.read()))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    output = pipe.stdout.read()
+    for thread in threads:
+        thread.join()
+    pipe.stdout.close()
+    pipe.stderr.close()
+    pipe.wait()
+    report_command(command, pipe, start)
+    stop_timer(timer, expired, command, timeout)
+
+    return output, errors[0]
+
 
 class SCMAdapter(object):
     """This class is an adapter for the strict consensus merger (SCM) functionality provided by DendroPy."""
@@ -124,30 +233,63 @@ class SCMAdapter(object):
         # assert: len(self.trees) == 1
         return (self.trees[0])
 
+    def merge_into(self, tree):
+        '''
+            Merge the trees, one at a time, into an existing merger tree; the
+            tree whose leaf set has the largest intersection with the merger
+            tree's goes first.
+        '''
+        while self.trees:
+            leaves = set(tree.get_leaves_identifiers())
+            overlaps = [self.getOverlap(leaves, leafSet) for leafSet in self.getLeafSets()]
+            index = overlaps.index(max(overlaps))
+            if overlaps[index] <= 3: # insufficient overlap for merger
+                raise ValueError("Insufficient overlap for SCM step (%d trees left)" % len(self.trees))
+
+            newTree = self.pairwiseMerger(str(tree), str(self.trees.pop(index)))
+            tree = parse_tree(newTree)
+
+        return (tree)
+
 
 class QMCAdapter(object):
     """This class is an adapter for supertree construction functionality provided by Quartets MaxCut (QMC)."""
 
-    def __init__(self, quartetTrees):
+    def __init__(self, quartetTrees, timeout = None):
         self.trees = quartetTrees
+        self.timeout = timeout
 
     def get_tree(self):
-        inputs = ["%s:%s" % (self.trees[qTree], qTree) for qTree in sorted(self.trees.keys())]
-        input = '\n'.join(inputs)
-        (output, err) = call_command ("find-cut", input)
+        # weighted quartet trees are streamed to find-cut without first being joined into a single input string;
+        #   sorting their keys alone keeps the input the same whatever order they were found in (e.g. by workers)
+        inputs = ("%s:%s" % (self.trees[qTree], qTree) for qTree in sorted(self.trees))
+        (output, err) = stream_command(["find-cut"], inputs, timeout=self.timeout)
         return (output)
 
 
 class MRPAdapter(object):
     """This class is an adapter for supertree construction functionality using MRP provided by PAUP*."""
 
-    def __init__(self, sourceTrees, numIters = 100, mrpType = 'gmrp'):
+    def __init__(self, sourceTrees, numIters = 100, mrpType = 'gmrp', compress = False, timeout = None):
         self.trees = sourceTrees
         self.numIters = numIters
         self.mrpType = mrpType
+        self.compress = compress
+        self.timeout = timeout
+        # sizes of the matrix before and after site-pattern compression
+        self.sites = 0
+        self.patterns = 0
 
     def get_tree(self):
         matrix = matrixRepresentation(self.trees)
+        self.sites = self.patterns = len(matrix[1])
+
+        weights = None
+        if self.compress:
+            (taxa, columns, weights) = compressMatrix(matrix)
+            matrix = (taxa, columns)
+            self.patterns = len(columns)
+
         if (len(matrix[0]) == 0 or len(matrix[1]) == 0):
             return (str(Tree()))
 
@@ -156,27 +298,26 @@ class MRPAdapter(object):
         f.close()
 
         f = open (prefix, 'w')
-        writeRatchetInputFile(matrix, f, filePrefix = prefix, numRatchetIterations = self.numIters)
+        writeRatchetInputFile(matrix, f, filePrefix = prefix, numRatchetIterations = self.numIters,
+                              characterWeights = weights)
         f.close()
 
-        pipe = Popen("paup -n %s" % prefix, shell = True, stdout = PIPE, stderr = PIPE)
-        (out, err) = pipe.communicate()
+        try:
+            call_command(["paup", "-n", prefix], None, self.timeout)
 
-        if self.mrpType == 'gmrp':
-            trees = getConsensusTreesFromPaupFiles(prefix)
-            output = trees['gmrp']
+            if self.mrpType == 'gmrp':
+                trees = getConsensusTreesFromPaupFiles(prefix)
+                output = trees['gmrp']
 
-        elif self.mrpType == 'rmrp':
-            mpTrees = readTreesFromRatchet(prefix + '.tre')
-            output = random.choice(mpTrees)
+            elif self.mrpType == 'rmrp':
+                mpTrees = readTreesFromRatchet(prefix + '.tre')
+                output = random.choice(mpTrees)
 
-        os.remove(prefix)
-        os.remove(prefix + ".log")
-        os.remove(prefix + ".gmrp")
-        os.remove(prefix + ".smrp")
-        os.remove(prefix + ".mmrp")
-        os.remove(prefix + ".tre")
-        os.remove(prefix + ".tre.nex")
+        finally:
+            # a killed PAUP* run may not have written all of its files
+            for suffix in ("", ".log", ".gmrp", ".smrp", ".mmrp", ".tre", ".tre.nex"):
+                if os.path.exists(prefix + suffix):
+                    os.remove(prefix + suffix)
 
         return output
 
@@ -201,15 +342,22 @@ class MRLAdapter(object):
     __author__ = "dneves@di.uminho.pt"
     __date__ = "$May 27, 2013 9:37:49 AM$"
 
-    def __init__(self, source_trees, method="fml"):
+    def __init__(self, source_trees, method="fml", compress=False, timeout=None):
         """
         Creates an instance of ``MRLAdapter``.
 
         :param source_trees: The source trees
         :param method: The chosen maximum likelihood (ML) method (default: fml --> run FastTree analysis)
+        :param compress: If ``True`` then the ML method is given a supermatrix without duplicated sites
+        :param timeout: If given, the ML method is killed after running for this many seconds
         """
         self.source_trees = source_trees
         self.method = method
+        self.compress = compress
+        self.timeout = timeout
+        # sizes of the supermatrix before and after site-pattern compression
+        self.sites = 0
+        self.patterns = 0
 
     def get_tree(self):
         """
@@ -219,7 +367,9 @@ class MRLAdapter(object):
 
         :return: A ``newick_modified.tree.Tree`` that is computed from the source trees (``self.source_trees``).
         """
-        supermatrix = MatrixRepresentation(self.source_trees)
+        supermatrix = MatrixRepresentation(self.source_trees, compress=self.compress)
+        self.sites = supermatrix.number_of_original_sites
+        self.patterns = supermatrix.number_of_sites
 
         if supermatrix.number_of_sites:
             # just to get the temporary filename
@@ -239,9 +389,16 @@ class MRLAdapter(object):
                 tree = Tree()   # for now a dumb tree is returned...                                                   #
                 ########################################################################################################
             else:   # fml --> FastTree (default ML method)
-                pipe = Popen("FastTree -gtr -nosupport -nt < {0}.mr > {0}.tmp".format(filename),
-                             shell=True, stdout=PIPE, stderr=PIPE)
-                (out, err) = pipe.communicate()
+                out = open(filename + ".tmp", 'w')
+                try:
+                    call_command(["FastTree", "-gtr", "-nosupport", "-nt", filename + ".mr"], None, self.timeout,
+                                 stdout=out)
+                except ReconcilerTimeout:
+                    out.close()
+                    for suffix in (".mr", ".tmp"):
+                        os.remove(filename + suffix)
+                    raise
+                out.close()
                 tree = readNewickFile(filename + ".tmp")
 
             # house cleaning...
@@ -0,0 +1,202 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module runs SuperFine on many datasets in a single process, on one
+    pool of worker processes, so that interpreter startup, imports and
+    worker spin-up are paid once.  The SCM trees of the datasets are merged
+    concurrently, then the relabeling and reconciling tasks of all of their
+    polytomies are interleaved, largest first (see
+    superfine.parallel.runRefinements()).
+'''
+
+import glob, itertools, json, os, sys, time
+from contextlib import ExitStack
+from multiprocessing import Pool
+
+from newick_modified.tree import parse_tree
+from spruce.unrooted import addDegreeInfo
+from superfine.SuperFine import finishTree, indexPolytomies, mergeTrees, readSourceTrees, writeTree
+from superfine.logger import Logger
+from superfine.parallel import Refinement, _getSourceTrees, openQueue, runRefinements
+from superfine.sharedtrees import SharedSourceTrees, isAvailable, startTracker
+
+
+# keys of the datasets, by which workers keep their source trees
+_datasetKeys = itertools.count()
+
+
+def findInputs(patterns):
+    '''
+        Return the input files named by the given paths or glob patterns, in
+        order and without repeats.  A pattern matching no file is an error.
+    '''
+    inputs = []
+    for pattern in patterns:
+        matches = [pattern] if os.path.isfile(pattern) else sorted(glob.glob(pattern))
+        if not matches:
+            raise IOError("no input file matches %s" % pattern)
+        inputs.extend([match for match in matches if match not in inputs])
+    return (inputs)
+
+
+
+def _mergeDataset(task):
+    '''
+        Merge the source trees of a dataset into its SCM tree in a worker
+        process.  Return it in Newick format (or the error which stopped the
+        merger) and a log of the merger.
+    '''
+    (owner, dataset, options) = task
+    logger = Logger()
+    try:
+        sourceTrees = _getSourceTrees(dataset)
+        with logger.phase("scm", trees = len(sourceTrees)) as record:
+            tree = mergeTrees(sourceTrees, options)
+            record["taxa"] = len(tree.get_leaves_identifiers())
+    except Exception as e:
+        return (owner, None, describeError(e), logger)
+    return (owner, str(tree) + ";", None, logger)
+
+
+
+def describeError(e):
+    return "%s: %s" % (e.__class__.__name__, e)
+
+
+
+def runBatch(inputs, options, pool = None):
+    '''
+        Run SuperFine on each input file, on the given pool (or on a new pool
+        of options.jobs worker processes).  The SCM and SuperFine trees of each
+        dataset are written next to its input file, as with options.writeData.
+        Return the logger of each dataset and the error (or None) which
+        stopped it; a dataset which fails at any step leaves the others be.
+    '''
+    loggers = [Logger() for input in inputs]
+    errors = [None] * len(inputs)
+    datasets = [(next(_datasetKeys), input) for input in inputs]
+
+    def readDataset(owner):
+        try:
+            return readSourceTrees(inputs[owner], loggers[owner])
+        except Exception as e:
+            errors[owner] = describeError(e)
+            return None
+
+    ownPool = pool == None
+    if ownPool:
+        startTracker()      # before the workers fork, so that they share it
+        pool = Pool(options.jobs)
+    stores = []
+    try:
+        # merge the SCM trees on the workers while the source trees are read here
+        merging = pool.imap_unordered(_mergeDataset, [(owner, dataset, options)
+                                                      for (owner, dataset) in enumerate(datasets)])
+        sourceTrees = [readDataset(owner) for owner in range(len(inputs))]
+
+        trees = [None] * len(inputs)
+        for (owner, newick, error, log) in merging:
+            loggers[owner].merge(log)
+            if errors[owner] or error:
+                errors[owner] = errors[owner] or error
+                continue
+            try:
+                trees[owner] = addDegreeInfo(parse_tree(newick))
+                writeTree(trees[owner], inputs[owner], "scmTree", options.writeData)
+            except Exception as e:
+                (trees[owner], errors[owner]) = (None, describeError(e))
+
+        # refine the SCM trees, interleaving the tasks of all the datasets
+        (owners, refinements) = ([], [])
+        with ExitStack() as stack:
+            for owner in [owner for owner in range(len(inputs)) if trees[owner] != None]:
+                record = stack.enter_context(loggers[owner].phase("refine"))
+                try:
+                    (polytomyIndex, polytomyOptions, restored, groupKeys) = indexPolytomies(
+                        trees[owner], sourceTrees[owner], options, loggers[owner])
+                except Exception as e:
+                    errors[owner] = describeError(e)
+                    continue
+                record["polytomies"] = len(polytomyIndex.polytomies)
+                # workers relabel the source trees packed in shared memory,
+                #   rather than parse the input file again
+                dataset = datasets[owner]
+                if isAvailable():
+                    stores.append(SharedSourceTrees.create(sourceTrees[owner]))
+                    dataset = (dataset[0], stores[-1])
+                owners.append(owner)
+                refinements.append(Refinement(polytomyIndex, polytomyOptions, restored, loggers[owner],
+                                              dataset = dataset))
+            refineErrors = [None] * len(refinements)
+            results = runRefinements(pool, refinements, options.jobs, openQueue(options), refineErrors)
+
+        for (owner, bipartitionsToAdd, error) in zip(owners, results, refineErrors):
+            if error:
+                errors[owner] = error
+                continue
+            try:
+                finishTree(trees[owner], bipartitionsToAdd, inputs[owner], options, loggers[owner])
+            except Exception as e:
+                errors[owner] = describeError(e)
+    finally:
+        if ownPool:
+            pool.close()
+            pool.join()
+        for store in stores:
+            store.close()
+
+    return (loggers, errors)
+
+
+
+def writeBatchStats(file, inputs, loggers, errors, seconds, jobs):
+    '''Write the stats of each dataset of a batch (see Logger.writeStats()), and its totals, to a JSON file.'''
+    datasets = []
+    for (input, logger, error) in zip(inputs, loggers, errors):
+        stats = logger.getStats(input)
+        if error:
+            stats["error"] = error
+        datasets.append(stats)
+
+    stats = {"datasets": datasets,
+             "failed": len([error for error in errors if error]),
+             "jobs": jobs,
+             "wallSeconds": round(seconds, 6)}
+    f = open(file, 'w')
+    json.dump(stats, f, indent = 1, sort_keys = True)
+    f.write("\n")
+    f.close()
+
+
+
+def SuperFineBatch(patterns, options):
+    '''Main loop of batch mode.'''
+    start = time.time()
+    inputs = findInputs(patterns)
+    (loggers, errors) = runBatch(inputs, options)
+
+    if options.stats:
+        writeBatchStats(options.stats, inputs, loggers, errors, time.time() - start, options.jobs)
+    for (input, logger, error) in zip(inputs, loggers, errors):
+        if error:
+            sys.stderr.write("%s: failed: %s\n" % (input, error))
+        elif options.verbose:
+            sys.stderr.write("%s:\n" % input)
+            logger.printInfo()
+    return (len([error for error in errors if error]))
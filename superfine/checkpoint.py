@@ -0,0 +1,294 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains code which checkpoints a SuperFine run, so that a run
+    which dies during refinement can be resumed.  A checkpoint directory holds
+
+        meta.json           digests of the source trees file and of each tree,
+        scm.tre             the SCM tree, and
+        polytomies.jsonl    a journal of the polytomies resolved so far.
+
+    Each journal entry keys a polytomy's bipartitions by a fingerprint of its
+    groups (the leaf sets of its children and of the rest of the tree) and of
+    the reconciler used.  Groups are hashed as the XOR of their taxa's hashes,
+    so that the rest of the tree costs nothing to hash, and the fingerprint
+    does not depend on where the SCM tree is rooted.  Bipartitions are stored
+    over groups sorted by hash, so they can be restored into any polytomy with
+    the same groups.
+
+    A checkpoint also serves to update a run with new source trees: the SCM
+    tree of the previous run is merged with the new trees, and polytomies are
+    looked up in its journal by the hashes of their groups restricted to the
+    previous run's taxa.
+'''
+
+import hashlib
+import json
+import os
+from functools import reduce
+from operator import xor
+
+from spruce.unrooted import readMultipleTreesFromFile, readNewickFile
+
+
+class CheckpointError(Exception):
+    '''Raised when a checkpoint directory belongs to another run, or cannot be updated.'''
+    pass
+
+
+
+def hashLabel(identifier):
+    '''Return a 160-bit integer hash of a leaf label.'''
+    return int(hashlib.sha1(str(identifier).encode("utf-8")).hexdigest(), 16)
+
+
+
+def hashFile(file):
+    '''Return the SHA-1 digest of a file's contents.'''
+    digest = hashlib.sha1()
+    f = open(file, 'rb')
+    try:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    finally:
+        f.close()
+    return (digest.hexdigest())
+
+
+
+def hashSources(input):
+    '''Return the SHA-1 digests of the source trees in a file.'''
+    return [hashlib.sha1(source.strip().encode("utf-8")).hexdigest() for source in readMultipleTreesFromFile(input)]
+
+
+
+def findGroupKeys(polytomyIndex, taxa = None):
+    '''
+        Return, for each polytomy of the index, the hashes of its groups: those
+        of its children (by group number), then that of the rest of the tree,
+        unless the polytomy is the root (or the rest is empty).  If a set of
+        taxa is given, groups are restricted to them, so that a group without
+        any of them hashes to 0.
+    '''
+    hashes = {}
+    def hashGroup(leaves):
+        if taxa != None:
+            leaves = [identifier for identifier in leaves if identifier in taxa]
+        return reduce(xor, [hashes.setdefault(identifier, hashLabel(identifier)) for identifier in leaves], 0)
+
+    tree = polytomyIndex.tree
+    allTaxa = hashGroup(tree.get_leaves_identifiers())
+    groupKeys = []
+    for polytomy in polytomyIndex.polytomies:
+        keys = [hashGroup(leaves) for leaves in polytomyIndex.childLeaves(polytomy)]
+        rest = reduce(xor, keys, allTaxa)
+        if rest:
+            keys.append(rest)
+        groupKeys.append(keys)
+    return (groupKeys)
+
+
+
+def describeReconciler(options):
+    '''Return the reconciler settings that a polytomy's bipartitions depend on.'''
+    if options.reconciler.endswith("mrp"):
+        return "%s/%d" % (options.reconciler, options.numIters)
+    return (options.reconciler)
+
+
+
+class Journal(object):
+    '''
+        The bipartitions found for polytomies, keyed by the fingerprints of
+        their groups and reconcilers (see Checkpoint), held in memory.  A
+        journal can stand in for a checkpoint in restorePolytomies() and
+        refinePolytomies(), e.g. to reuse polytomies across runs on the same
+        source trees in a long-running process.
+    '''
+
+    def __init__(self):
+        self._results = {}      # polytomy fingerprint -> bipartitions over sorted groups (or None)
+
+    def close(self):
+        pass
+
+    def _append(self, fingerprint, sortedMasks):
+        '''Persist a new entry; a journal held in memory has nothing to do.'''
+        pass
+
+    def _fingerprint(self, groupKeys, reconciler):
+        '''Return the fingerprint of a polytomy, and the order of its groups by hash.'''
+        order = sorted(range(len(groupKeys)), key = groupKeys.__getitem__)
+        digest = hashlib.sha1(reconciler.encode("utf-8"))
+        for group in order:
+            digest.update((":%x" % groupKeys[group]).encode("utf-8"))
+        return (digest.hexdigest(), order)
+
+    def restore(self, groupKeys, reconciler):
+        '''
+            Return a pair (found, bipartitions), where found is True if the
+            polytomy with the given group hashes has been resolved with the
+            reconciler, and bipartitions are the (group bitmask) bipartitions
+            found for it then, or None if it could not be resolved.
+        '''
+        (fingerprint, order) = self._fingerprint(groupKeys, reconciler)
+        if fingerprint not in self._results:
+            return (False, None)
+        if self._results[fingerprint] is None:
+            return (True, None)
+
+        # orient the bipartitions away from the parent group (or, at the root,
+        # from the last child), so that they nest as expandTree() expects
+        parent = len(groupKeys) - 1
+        allGroups = (1 << len(groupKeys)) - 1
+        bipartitions = []
+        for sortedMask in self._results[fingerprint]:
+            mask = 0
+            for (rank, group) in enumerate(order):
+                if sortedMask >> rank & 1:
+                    mask |= 1 << group
+            if mask >> parent & 1:
+                mask ^= allGroups
+            bipartitions.append(mask)
+        return (True, bipartitions)
+
+    def record(self, groupKeys, reconciler, bipartitions):
+        '''Journal the bipartitions (or None) found for the polytomy with the given group hashes.'''
+        (fingerprint, order) = self._fingerprint(groupKeys, reconciler)
+        if bipartitions is None:
+            sortedMasks = None
+        else:
+            sortedMasks = []
+            allGroups = (1 << len(groupKeys)) - 1
+            for mask in bipartitions:
+                sortedMask = 0
+                for (rank, group) in enumerate(order):
+                    if mask >> group & 1:
+                        sortedMask |= 1 << rank
+                if sortedMask & 1:  # take the side without the group of smallest hash
+                    sortedMask ^= allGroups
+                sortedMasks.append(sortedMask)
+
+        self._results[fingerprint] = sortedMasks
+        self._append(fingerprint, sortedMasks)
+
+
+
+class Checkpoint(Journal):
+    '''
+        A checkpoint directory of a SuperFine run on a source trees file.  The
+        directory is created if need be; a CheckpointError is raised if it
+        holds the checkpoint of a run on other source trees.  Without a source
+        trees file, an existing checkpoint is opened read-only (e.g. that of
+        the previous run, when updating it with new source trees).
+    '''
+
+    def __init__(self, directory, input = None):
+        self.directory = directory
+        metaFile = os.path.join(directory, "meta.json")
+        if input == None:
+            if not os.path.exists(metaFile):
+                raise CheckpointError("%s holds no checkpoint" % directory)
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(metaFile):
+            f = open(metaFile, 'r')
+            try:
+                self.meta = json.load(f)
+            finally:
+                f.close()
+            if input != None and self.meta.get("input") != hashFile(input):
+                raise CheckpointError("%s holds the checkpoint of a run on other source trees" % directory)
+        else:
+            self.meta = {"input": hashFile(input), "sources": hashSources(input)}
+            self.__write("meta.json", json.dumps(self.meta) + "\n")
+
+        Journal.__init__(self)
+        journal = os.path.join(directory, "polytomies.jsonl")
+        if os.path.exists(journal):
+            f = open(journal, 'r')
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # a line cut short by the end of the previous run
+                    continue
+                self._results[entry["polytomy"]] = entry["bipartitions"]
+            f.close()
+        self.__journal = None
+        if input != None:
+            self.__journal = open(journal, 'a')
+
+    def __write(self, name, data):
+        '''Write a file of the checkpoint atomically, so an interrupted run never leaves it half written.'''
+        path = os.path.join(self.directory, name)
+        f = open(path + ".tmp", 'w')
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(path + ".tmp", path)
+
+    def close(self):
+        '''Close the journal.'''
+        if self.__journal:
+            self.__journal.close()
+
+    def findNewSources(self, input):
+        '''
+            Return the indices of the source trees in a file which the run of
+            the checkpoint did not have.  Raise a CheckpointError if that run
+            had source trees which the file lacks, as these cannot be taken
+            out of the SCM tree.
+        '''
+        if "sources" not in self.meta:
+            raise CheckpointError("%s does not record the source trees of its run" % self.directory)
+
+        previous = {}
+        for digest in self.meta["sources"]:
+            previous[digest] = previous.get(digest, 0) + 1
+        newSources = []
+        for (i, digest) in enumerate(hashSources(input)):
+            if previous.get(digest, 0) > 0:
+                previous[digest] -= 1
+            else:
+                newSources.append(i)
+
+        if sum(previous.values()) > 0:
+            raise CheckpointError("%d source trees of the run in %s are missing from %s"
+                                  % (sum(previous.values()), self.directory, input))
+        return (newSources)
+
+    def loadTree(self):
+        '''Return the saved SCM tree, or None if there is none.'''
+        path = os.path.join(self.directory, "scm.tre")
+        if not os.path.exists(path):
+            return None
+        return readNewickFile(path)
+
+    def saveTree(self, tree):
+        '''Save the SCM tree.'''
+        self.__write("scm.tre", str(tree) + ";\n")
+
+    def _append(self, fingerprint, sortedMasks):
+        '''Journal a new entry to the checkpoint directory.'''
+        self.__journal.write(json.dumps({"polytomy": fingerprint, "bipartitions": sortedMasks}) + "\n")
+        self.__journal.flush()
+        os.fsync(self.__journal.fileno())
@@ -18,7 +18,36 @@
 ##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
 ###########################################################################
 
-import sys
+import json, os, sys, time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+def getCpuTime():
+    '''Return the user plus system CPU time of this process, in seconds.'''
+    times = os.times()
+    return (times[0] + times[1])
+
+
+
+def getPeakRss(who = "self"):
+    '''
+        Return the peak resident set size, in kilobytes, of this process (or,
+        if who is "children", of the largest of its waited-for child processes,
+        e.g. PAUP* or FastTree), or None where it cannot be found.
+    '''
+    if resource == None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    if sys.platform == "darwin":    # reported in bytes
+        return (usage.ru_maxrss // 1024)
+    return (usage.ru_maxrss)
+
+
 
 class Logger(object):
     '''This class logs useful information.'''
@@ -26,6 +55,29 @@ class Logger(object):
     def __init__(self):
         self.unresolvablePolytomies = 0
         self.resolvablePolytomies = 0
+        # resolvable polytomies left unresolved as every reconciler ran out of time
+        self.timedOutPolytomies = 0
+        # (polytomy degree, # of sites, # of site patterns) per compressed matrix
+        self.compressions = []
+        # (polytomy degree, reconciler, fallback, seconds) per timed-out reconciler
+        self.fallbacks = []
+        # (polytomy degree, reconciler) per polytomy given a reconciler by the "auto" rules
+        self.choices = []
+        # polytomies whose bipartitions were restored from a checkpoint
+        self.restoredPolytomies = 0
+        # when updating a previous run: # of new source trees, # of polytomies,
+        #   and # of polytomies whose bipartitions were reused from that run
+        self.update = None
+        self.reusedPolytomies = 0
+        # a record per phase of the run (see phase()); polytomy records hold
+        #   those of their steps
+        self.phases = []
+        self.__openPhases = []
+        # a superfine.profiling.Profiler, if stages and polytomies are profiled
+        self.profiler = None
+        # Chrome trace events of the phases and of the subprocesses run, if
+        #   the run is traced (see startTrace())
+        self.events = None
 
     def logInfo(self, quartetTrees):
         '''Increment resolvable or unresolvable count.'''
@@ -34,13 +86,166 @@ class Logger(object):
         else:
             self.resolvablePolytomies += 1
 
+    def logTimedOut(self):
+        '''Count a resolvable polytomy left unresolved for lack of time.'''
+        self.timedOutPolytomies += 1
+
+    def logCompression(self, degree, sites, patterns):
+        '''Record the matrix size before and after site-pattern compression.'''
+        self.compressions.append((degree, sites, patterns))
+
+    def logFallback(self, degree, reconciler, fallback, seconds):
+        '''Record a reconciler cancelled for running out of time, and what was used instead.'''
+        self.fallbacks.append((degree, reconciler, fallback, seconds))
+
+    def logChoice(self, degree, reconciler):
+        '''Record the reconciler picked for a polytomy.'''
+        self.choices.append((degree, reconciler))
+
+    def logRestored(self):
+        '''Count a polytomy restored from a checkpoint.'''
+        self.restoredPolytomies += 1
+
+    def logUpdate(self, newSources, polytomies):
+        '''Record the update of a previous run with new source trees.'''
+        self.update = (newSources, polytomies)
+
+    def logReused(self):
+        '''Count a polytomy reused from the run being updated.'''
+        self.reusedPolytomies += 1
+
+    @contextmanager
+    def phase(self, name, **counts):
+        '''
+            Record a phase of the run: its wall and CPU times, the peak RSS of
+            this process and of its child processes by its end, and the given
+            counts (e.g. trees, quartets, sites or degree).  The record is
+            yielded, so that counts known only within the phase can be added
+            to it.  Phases opened within a phase are recorded as its steps.
+            Top-level phases (stages) and polytomies are profiled if the
+            logger has a profiler.
+        '''
+        record = {"phase": name}
+        record.update(counts)
+        if self.__openPhases:
+            self.__openPhases[-1].setdefault("steps", []).append(record)
+        else:
+            self.phases.append(record)
+
+        self.__openPhases.append(record)
+        profiled = self.profiler != None and (len(self.__openPhases) == 1 or name == "polytomy")
+        if profiled:
+            self.profiler.enter()
+        (wallStart, cpuStart) = (time.time(), getCpuTime())
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = e.__class__.__name__
+            raise
+        finally:
+            record["wallSeconds"] = round(time.time() - wallStart, 6)
+            record["cpuSeconds"] = round(getCpuTime() - cpuStart, 6)
+            record["peakRssKb"] = getPeakRss()
+            record["peakChildRssKb"] = getPeakRss("children")
+            if profiled:
+                self.profiler.exit(record)
+            self.__openPhases.pop()
+            if self.events != None:
+                self.events.append({"name": name, "cat": "phase", "ph": "X",
+                                    "ts": int(wallStart * 1e6), "dur": int(record["wallSeconds"] * 1e6),
+                                    "pid": os.getpid(), "tid": os.getpid(),
+                                    "args": dict([(key, value) for (key, value) in record.items() if key != "steps"])})
+
+    def startTrace(self):
+        '''Start recording trace events of the phases, and of the subprocesses reported with logCommand().'''
+        self.events = []
+
+    def logCommand(self, command, pid, start, end, returncode):
+        '''Record a subprocess (e.g. PAUP* or FastTree) in the trace, if the run is traced.'''
+        if self.events != None:
+            self.events.append({"name": os.path.basename(command[0]), "cat": "process", "ph": "X",
+                                "ts": int(start * 1e6), "dur": int((end - start) * 1e6),
+                                "pid": os.getpid(), "tid": pid,
+                                "args": {"argv": list(command), "pid": pid, "exitCode": returncode}})
+
+    def writeTrace(self, file):
+        '''
+            Write the trace events in the Chrome trace event format (as read by
+            chrome://tracing and Perfetto), with a track per process (this one
+            and each worker) and one per subprocess.
+        '''
+        metadata = []
+        for pid in sorted(set([event["pid"] for event in self.events])):
+            name = "superfine" if pid == os.getpid() else "worker %d" % pid
+            metadata.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+            metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": pid, "args": {"name": "phases"}})
+        for event in self.events:
+            if event["cat"] == "process":
+                metadata.append({"name": "thread_name", "ph": "M", "pid": event["pid"], "tid": event["tid"],
+                                 "args": {"name": "%s (pid %d)" % (event["name"], event["tid"])}})
+
+        f = open(file, 'w')
+        json.dump({"traceEvents": metadata + sorted(self.events, key = lambda event: event["ts"]),
+                   "displayTimeUnit": "ms"}, f)
+        f.write("\n")
+        f.close()
+
+    def getStats(self, input):
+        '''Return the phase records, the counts of the run report, and the fallback of each timed-out reconciler.'''
+        return {"input": input,
+                "phases": self.phases,
+                "polytomies": {"resolvable": self.resolvablePolytomies,
+                               "unresolvable": self.unresolvablePolytomies,
+                               "timedOut": self.timedOutPolytomies,
+                               "restored": self.restoredPolytomies,
+                               "reused": self.reusedPolytomies,
+                               "fallbacks": len(self.fallbacks)},
+                "fallbacks": [{"degree": degree, "reconciler": reconciler, "fallback": fallback,
+                               "seconds": round(seconds, 6)}
+                              for (degree, reconciler, fallback, seconds) in self.fallbacks]}
+
+    def writeStats(self, file, input):
+        '''Write the statistics of the run (see getStats()) to a JSON file.'''
+        f = open(file, 'w')
+        json.dump(self.getStats(input), f, indent = 1, sort_keys = True)
+        f.write("\n")
+        f.close()
+
+    def merge(self, other):
+        '''
+            Add the records of another logger (e.g. a worker process's) to this
+            one; its phases become steps of the phase open in this one.
+        '''
+        self.unresolvablePolytomies += other.unresolvablePolytomies
+        self.resolvablePolytomies += other.resolvablePolytomies
+        self.timedOutPolytomies += other.timedOutPolytomies
+        self.compressions.extend(other.compressions)
+        self.fallbacks.extend(other.fallbacks)
+        self.choices.extend(other.choices)
+        self.restoredPolytomies += other.restoredPolytomies
+        self.reusedPolytomies += other.reusedPolytomies
+        if self.__openPhases:
+            self.__openPhases[-1].setdefault("steps", []).extend(other.phases)
+        else:
+            self.phases.extend(other.phases)
+        if self.profiler != None and other.profiler != None:
+            self.profiler.merge(other.profiler)
+        if self.events != None and other.events != None:
+            self.events.extend(other.events)
+
     def printInfo(self):
         '''Print diagnostic info to stderr.'''
-        # print info on resolvables
-        if self.resolvablePolytomies == 1:
+        # print info on resolvables, and on those which ran out of time
+        resolved = self.resolvablePolytomies - self.timedOutPolytomies
+        if resolved == 1:
             sys.stderr.write("1 polytomy successfully resolved.\n")
         else:
-            sys.stderr.write(self.resolvablePolytomies.__repr__() + " polytomies successfully resolved.\n")
+            sys.stderr.write(resolved.__repr__() + " polytomies successfully resolved.\n")
+        if self.timedOutPolytomies == 1:
+            sys.stderr.write("1 polytomy left unresolved: every reconciler ran out of time.\n")
+        elif self.timedOutPolytomies > 1:
+            sys.stderr.write("%d polytomies left unresolved: every reconciler ran out of time.\n"
+                             % self.timedOutPolytomies)
 
         # print info on unresolvables
         if self.unresolvablePolytomies == 0:
@@ -49,3 +254,43 @@ class Logger(object):
             sys.stderr.write("1 polytomy could *not* be resolved.\n")
         else:
             sys.stderr.write(self.unresolvablePolytomies.__repr__() + " polytomies could *not* be resolved.\n")
+
+        # print info on polytomies resolved by an earlier, interrupted run
+        if self.restoredPolytomies == 1:
+            sys.stderr.write("1 polytomy restored from checkpoint.\n")
+        elif self.restoredPolytomies > 1:
+            sys.stderr.write("%d polytomies restored from checkpoint.\n" % self.restoredPolytomies)
+
+        # print info on the update of a previous run
+        if self.update:
+            (newSources, polytomies) = self.update
+            sys.stderr.write("%d new source trees merged; %d of %d polytomies recomputed, %d reused.\n"
+                             % (newSources, polytomies - self.reusedPolytomies - self.restoredPolytomies,
+                                polytomies, self.reusedPolytomies))
+
+        # print info on site-pattern compression
+        for (degree, sites, patterns) in self.compressions:
+            if sites == 0:
+                continue
+            reduction = 100.0 * (sites - patterns) / sites
+            sys.stderr.write("Polytomy of degree %d: %d sites compressed to %d site patterns (%.1f%% reduction).\n"
+                             % (degree, sites, patterns, reduction))
+
+        # print info on automatically picked reconcilers
+        counts = {}
+        for (degree, reconciler) in self.choices:
+            counts[reconciler] = counts.get(reconciler, 0) + 1
+        for reconciler in sorted(counts.keys()):
+            sys.stderr.write("%d polytomies assigned to %s (largest degree %d).\n"
+                             % (counts[reconciler], reconciler,
+                                max([degree for (degree, choice) in self.choices if choice == reconciler])))
+
+        # print info on reconcilers which ran out of time
+        for (degree, reconciler, fallback, seconds) in self.fallbacks:
+            sys.stderr.write("Polytomy of degree %d: %s cancelled after %.1f seconds; fell back to %s.\n"
+                             % (degree, reconciler, seconds, fallback))
+
+        # print info on the time taken by each phase
+        for record in self.phases:
+            sys.stderr.write("Phase %s: %.2f seconds (%.2f seconds of CPU time).\n"
+                             % (record["phase"], record["wallSeconds"], record["cpuSeconds"]))
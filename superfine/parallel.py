@@ -0,0 +1,465 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains code which spreads the refinement of the SCM tree's
+    polytomies over a single pool of worker processes.  Source trees are
+    relabeled (and encoded into quartet trees) in chunks, so that a single
+    large polytomy keeps all workers busy, and polytomies are then reconciled
+    concurrently.  Tasks are scheduled largest first.
+'''
+
+import os, time
+from collections import Counter, OrderedDict
+from contextlib import ExitStack
+from multiprocessing import Pool
+
+from newick_modified.tree import parse_tree
+from spruce.unrooted import readMultipleTreesFromFile
+
+from superfine.SuperFine import UnfinishedBipartitions, collapseTree, findDisplayedQtrees, reconcileTrees, \
+    removeUninformativeRelabeledTrees, removeUninformativeQTrees, selectSubset
+from superfine.adapters import command_observers
+from superfine.checkpoint import describeReconciler
+from superfine.logger import Logger
+from superfine.profiling import Profiler
+from superfine.relabeling import RelabeledView
+from superfine.sharedtrees import SharedSourceTrees, isAvailable
+
+
+# number of datasets whose source trees a worker process keeps parsed
+CACHED_DATASETS = 64
+
+# source trees in a worker process, by dataset key: those installed by
+#   _setSourceTrees() are under None, and those loaded by _getSourceTrees()
+#   are kept for the most recently used datasets
+_sourceTrees = OrderedDict()
+
+
+def _setSourceTrees(sourceTrees):
+    '''Keep the source trees in a worker process.'''
+    _sourceTrees[None] = sourceTrees
+
+
+
+def _getSourceTrees(dataset):
+    '''
+        Return the source trees of a dataset in a worker process.  A dataset is
+        None (for the source trees installed by _setSourceTrees()), or a (key,
+        sources) pair, the sources being the name of a file of source trees,
+        the source trees themselves in Newick format (both of which are parsed
+        once per worker), or the source trees packed in shared memory.
+    '''
+    if dataset == None:
+        return _sourceTrees[None]
+
+    (key, sources) = dataset
+    if key in _sourceTrees:
+        if isinstance(sources, SharedSourceTrees) and not sources.owner:
+            sources.close()     # attached again by unpickling the task
+        _sourceTrees.move_to_end(key)
+        return _sourceTrees[key]
+
+    if isinstance(sources, SharedSourceTrees):
+        _sourceTrees[key] = sources
+    else:
+        if isinstance(sources, str):
+            sources = readMultipleTreesFromFile(sources)
+        _sourceTrees[key] = [parse_tree(source) for source in sources]
+    while len(_sourceTrees) > CACHED_DATASETS + (None in _sourceTrees):
+        oldest = [cached for cached in _sourceTrees if cached != None][0]
+        evicted = _sourceTrees.pop(oldest)
+        if isinstance(evicted, SharedSourceTrees) and not evicted.owner:
+            evicted.close()
+    return _sourceTrees[key]
+
+
+
+def _startLog(profile, trace, slowest = 0):
+    '''Return a log for a task of a worker process, profiled and traced as the main process is.'''
+    logger = Logger()
+    if profile:
+        logger.profiler = Profiler(None, slowest)
+    if trace:
+        logger.startTrace()
+    return (logger)
+
+
+
+def _relabelChunk(task):
+    '''
+        Relabel and collapse a chunk of source trees for a polytomy.  Return
+        the partial count table of their quartet trees if encoding (with the
+        chunk's first source tree index), or the collapsed trees themselves
+        (with their source tree indices) otherwise, and, if the main process
+        is profiled or traced, a log of the chunk.
+    '''
+    (owner, position, dataset, relabeling, defaultLabel, sourceIndices, encode, instrumented) = task
+    sourceTrees = _getSourceTrees(dataset)
+    logger = None
+    if instrumented:
+        logger = _startLog(*instrumented)
+
+    def relabel():
+        if isinstance(sourceTrees, SharedSourceTrees):
+            labels = sourceTrees.relabelTaxa(relabeling, defaultLabel)
+            views = [sourceTrees.view(i, labels) for i in sourceIndices]
+        else:
+            views = [RelabeledView(sourceTrees[i], relabeling, defaultLabel) for i in sourceIndices]
+        trees = [collapseTree(view.materialize()) for view in views]
+        if not encode:
+            return list(zip(sourceIndices, trees))
+
+        quartetTrees = Counter()
+        for tree in trees:
+            quartetTrees.update(findDisplayedQtrees(tree))
+        return [(min(sourceIndices), quartetTrees)]
+
+    if logger:
+        with logger.phase("relabel", polytomy = position, trees = len(sourceIndices)):
+            result = relabel()
+    else:
+        result = relabel()
+    return (owner, position, result, logger)
+
+
+
+def _reconcile(task):
+    '''Reconcile the relabeled trees of a polytomy; return its bipartitions and a log of the call.'''
+    (owner, position, trees, degree, options, submitted) = task
+    logger = _startLog(options.profile, options.trace, options.profileSlowest)
+    command_observers.append(logger.logCommand)
+    try:
+        with logger.phase("polytomy", degree = degree, reconciler = options.reconciler, worker = os.getpid(),
+                          queuedSeconds = round(time.time() - submitted, 6)):
+            bipartitions = reconcileTrees(trees, degree, options, logger)
+    except SystemExit as e:
+        # the adapters exit when a reconciler cannot be run; a worker which
+        #   exits takes its task with it, and the pool would wait on it forever
+        raise RuntimeError("%s reconciler exited with status %s" % (options.reconciler, e.code))
+    finally:
+        command_observers.remove(logger.logCommand)
+    return (owner, position, bipartitions, logger)
+
+
+
+def _isolateTask(task):
+    '''
+        Run a task of one of the datasets sharing a pool; return no error and
+        its result, or the error which stopped it and the task's owner.
+    '''
+    (function, task) = task
+    try:
+        return (None, function(task))
+    except Exception as e:
+        return ("%s: %s" % (e.__class__.__name__, e), task[0])
+
+
+
+def splitSources(polytomyIndex, jobs, pending = None):
+    '''
+        Split the informative source trees of each polytomy (each one whose
+        entry in pending is True, if given) into chunks, with about four chunks
+        per worker overall, and more of them for polytomies with more (and
+        larger) informative source trees.  Return a list of (polytomy
+        position, source tree indices) pairs, largest first.
+    '''
+    if pending == None:
+        pending = [True] * len(polytomyIndex.polytomies)
+    costs = [len(taxonIds) for taxonIds in polytomyIndex.sourceTaxonIds]
+    polytomyCosts = [sum([costs[i] for i in polytomyIndex.informativeSources(polytomy)]) if pending[position] else 0
+                     for (position, polytomy) in enumerate(polytomyIndex.polytomies)]
+    totalCost = max(1, sum(polytomyCosts))
+
+    chunks = []
+    for (position, polytomy) in enumerate(polytomyIndex.polytomies):
+        sources = sorted(polytomyIndex.informativeSources(polytomy), key = lambda i: -costs[i])
+        if not sources or not pending[position]:
+            continue
+        numChunks = min(len(sources), max(1, int(round(4.0 * jobs * polytomyCosts[position] / totalCost))))
+        for chunk in range(numChunks):
+            # deal the source trees out, so chunks have similar costs
+            sourceIndices = sources[chunk::numChunks]
+            chunks.append((sum([costs[i] for i in sourceIndices]), position, sourceIndices))
+
+    chunks.sort(key = lambda chunk: -chunk[0])
+    return [(position, sourceIndices) for (cost, position, sourceIndices) in chunks]
+
+
+
+def findInstrumentation(logger):
+    '''Return whether the workers' tasks are to be (profiled, traced), as the logger is, or None.'''
+    if logger and (logger.profiler != None or logger.events != None):
+        return (logger.profiler != None, logger.events != None)
+    return None
+
+
+
+def buildRelabelTasks(polytomyIndex, jobs, encode, pending = None, instrumented = None, owner = 0, dataset = None):
+    '''
+        Return the tasks relabeling the informative source trees of every
+        polytomy (every one whose entry in pending is True, if given) in chunks,
+        each with the total number of taxa of its source trees, largest first.
+        The owner (an index among the datasets sharing a pool) is handed back
+        with each chunk's result, and the dataset tells the workers where to
+        find the source trees (see _getSourceTrees()).
+    '''
+    tasks = []
+    relabelings = {}
+    for (position, sourceIndices) in splitSources(polytomyIndex, jobs, pending):
+        if position not in relabelings:
+            relabelings[position] = polytomyIndex.getRelabeling(polytomyIndex.polytomies[position])
+        (relabeling, delabeling) = relabelings[position]
+        cost = sum([len(polytomyIndex.sourceTaxonIds[i]) for i in sourceIndices])
+        tasks.append((cost, (owner, position, dataset, relabeling, len(delabeling), sourceIndices, encode[position],
+                             instrumented)))
+    return (tasks)
+
+
+
+def mergeRelabeled(results, position, result):
+    '''Add the result of a chunk to those of its polytomy, as they come in.'''
+    results[position].extend(result)
+
+
+
+def sortRelabeled(results, encode):
+    '''
+        Put the results of the chunks of each polytomy back in the order of
+        their source trees, whatever order the workers returned them in: the
+        relabeled trees of the polytomies which are not encoded, and the
+        partial count tables of the others, which are then merged by addition.
+        A merged table thus holds its quartet trees in the same order on every
+        run with the same number of jobs.
+    '''
+    for position in range(len(results)):
+        pairs = sorted(results[position], key = lambda pair: pair[0])
+        if encode[position]:
+            results[position] = Counter()
+            for (i, quartetTrees) in pairs:
+                results[position].update(quartetTrees)
+        else:
+            results[position] = [tree for (i, tree) in pairs]
+    return (results)
+
+
+
+class Refinement(object):
+    '''
+        The refinement of the polytomies of one SCM tree on a pool of worker
+        processes, which it may share with the refinements of other datasets:
+        it hands out its relabeling tasks, then its reconciling tasks, and
+        takes in their results.  Each polytomy is resolved with its own
+        options, unless it is found in restored (see restorePolytomies()); the
+        others are journaled to the checkpoint (if given) as they are resolved,
+        unless their reconcilers run out of time.
+    '''
+
+    def __init__(self, polytomyIndex, polytomyOptions, restored, logger, checkpoint = None, groupKeys = None,
+                 dataset = None):
+        self.polytomyIndex = polytomyIndex
+        self.polytomyOptions = polytomyOptions
+        self.logger = logger
+        self.checkpoint = checkpoint
+        self.groupKeys = groupKeys
+        self.dataset = dataset
+        self.encode = [polytomyOption.reconciler == "qmc" for polytomyOption in polytomyOptions]
+        self.reconcilers = [describeReconciler(polytomyOption) for polytomyOption in polytomyOptions]
+
+        self.pending = [not found for (found, bipartitions) in restored]
+        self.reconciled = {}
+        for (position, (found, bipartitions)) in enumerate(restored):
+            if found and bipartitions is not None:
+                self.reconciled[position] = (bipartitions, Logger())
+        self.results = [[] for encode in self.encode]
+
+    def relabelTasks(self, jobs, owner = 0):
+        '''Return the relabeling tasks, each with its cost.'''
+        return buildRelabelTasks(self.polytomyIndex, jobs, self.encode, self.pending,
+                                 findInstrumentation(self.logger), owner, self.dataset)
+
+    def addRelabeled(self, position, result, log):
+        if log:
+            self.logger.merge(log)
+        mergeRelabeled(self.results, position, result)
+
+    def sortRelabeled(self):
+        '''Merge the results of the chunks in the order of their source trees; return the number of quartet trees.'''
+        sortRelabeled(self.results, self.encode)
+        return sum([len(self.results[position]) for position in range(len(self.results))
+                    if self.encode[position] and self.pending[position]])
+
+    def reconcileTasks(self, owner = 0):
+        '''
+            Return the reconciling tasks of the polytomies left to resolve once
+            their source trees are relabeled (and sortRelabeled()), each with
+            its size.
+        '''
+        tasks = []
+        for (position, polytomy) in enumerate(self.polytomyIndex.polytomies):
+            if not self.pending[position]:
+                continue
+            # subtrees stay in this process; reconciling only needs the trees
+            options = self.polytomyOptions[position]
+            if self.encode[position]:
+                quartetTrees = removeUninformativeQTrees(dict(self.results[position]))
+                self.logger.logInfo(len(quartetTrees))
+                if quartetTrees:
+                    quartetTrees = selectSubset(quartetTrees, options)
+                    tasks.append((len(quartetTrees), (owner, position, quartetTrees, polytomy.degree, options)))
+            else:
+                newSourceTrees = removeUninformativeRelabeledTrees(self.results[position])
+                self.logger.logInfo(len(newSourceTrees))
+                if newSourceTrees:
+                    size = sum([len(tree.get_leaves_identifiers()) for tree in newSourceTrees])
+                    tasks.append((size, (owner, position, newSourceTrees, polytomy.degree, options)))
+        self.results = None
+
+        if self.checkpoint:  # polytomies left without a task cannot be resolved
+            queued = set([task[1] for (size, task) in tasks])
+            for position in range(len(self.pending)):
+                if self.pending[position] and position not in queued:
+                    self.checkpoint.record(self.groupKeys[position], self.reconcilers[position], None)
+        return (tasks)
+
+    def addReconciled(self, position, bipartitions, log):
+        self.reconciled[position] = (bipartitions, log)
+        if self.checkpoint and not isinstance(bipartitions, UnfinishedBipartitions):
+            self.checkpoint.record(self.groupKeys[position], self.reconcilers[position], bipartitions)
+
+    def finish(self):
+        '''Merge the logs of the polytomies, and return the bipartitions keyed by polytomy.'''
+        bipartitionsToAdd = {}
+        for position in sorted(self.reconciled.keys()):
+            (bipartitions, log) = self.reconciled[position]
+            bipartitionsToAdd[self.polytomyIndex.polytomies[position]] = bipartitions
+            self.logger.merge(log)
+        return (bipartitionsToAdd)
+
+
+
+def runTasks(pool, function, tasks, errors = None):
+    '''
+        Run function(task) for each task on the pool (or work queue), and yield
+        the results as they come.  The error raised by a task is raised here,
+        unless errors is given: the error is then put in the entry of the
+        task's owner (the first item of a task and of its result), whose other
+        results are dropped.
+    '''
+    if errors == None:
+        for result in pool.imap_unordered(function, tasks):
+            yield result
+        return
+    for (error, result) in pool.imap_unordered(_isolateTask, [(function, task) for task in tasks]):
+        if error:
+            errors[result] = errors[result] or error
+        elif errors[result[0]] == None:
+            yield result
+
+
+
+def relabelRefinements(pool, refinements, jobs, errors = None):
+    '''
+        Relabel the source trees of the polytomies of one or more refinements
+        on a shared pool, interleaving their tasks, largest first, and merge
+        the results of each one (see Refinement.sortRelabeled()).  Errors are
+        as in runRefinements().
+    '''
+    with ExitStack() as stack:
+        records = [stack.enter_context(refinement.logger.phase("relabel", polytomies = sum(refinement.pending)))
+                   for refinement in refinements]
+        tasks = []
+        for (owner, refinement) in enumerate(refinements):
+            tasks.extend(refinement.relabelTasks(jobs, owner))
+        tasks.sort(key = lambda task: -task[0])
+        for (owner, position, result, log) in runTasks(pool, _relabelChunk, [task for (cost, task) in tasks],
+                                                       errors):
+            refinements[owner].addRelabeled(position, result, log)
+        for (owner, (refinement, record)) in enumerate(zip(refinements, records)):
+            if errors == None or errors[owner] == None:
+                record["quartets"] = refinement.sortRelabeled()
+
+
+
+def runRefinements(pool, refinements, jobs, queue = None, errors = None):
+    '''
+        Run the refinements of one or more datasets on a shared pool: the
+        relabeling tasks of all of them, then their reconciling tasks, are
+        interleaved, largest first.  The reconciling tasks are run on the
+        workers of a work queue instead, if one is given (see
+        superfine.workqueue).  Return the bipartitions of each one.  If errors
+        is given (with an entry per refinement), a refinement whose task fails
+        gets the error in its entry, and None for bipartitions, while the
+        others carry on; otherwise the error is raised.
+    '''
+    def failed(owner):
+        return errors != None and errors[owner] != None
+
+    relabelRefinements(pool, refinements, jobs, errors)
+
+    tasks = []
+    for (owner, refinement) in enumerate(refinements):
+        if not failed(owner):
+            tasks.extend(refinement.reconcileTasks(owner))
+    tasks.sort(key = lambda task: -task[0])
+
+    submitted = time.time()
+    tasks = [task + (submitted,) for (size, task) in tasks]
+    for (owner, position, bipartitions, log) in runTasks(queue or pool, _reconcile, tasks, errors):
+        refinements[owner].addReconciled(position, bipartitions, log)
+
+    return [None if failed(owner) else refinement.finish() for (owner, refinement) in enumerate(refinements)]
+
+
+
+def openQueue(options):
+    '''Return the work queue named by options.queue, or None.'''
+    if not options.queue:
+        return None
+    from superfine.workqueue import WorkQueue
+    return WorkQueue(options.queue, options.lease)
+
+
+
+def refinePolytomies(polytomyIndex, polytomyOptions, restored, logger, options, checkpoint = None, groupKeys = None):
+    '''
+        Find the bipartitions with which to refine each polytomy of the SCM
+        tree, as the main SuperFine loop does, using options.jobs worker
+        processes (and the workers of the work queue options.queue, if
+        given, to reconcile polytomies).  Each polytomy is resolved with its own options, unless it
+        is found in restored (see restorePolytomies()); the others are
+        journaled to the checkpoint (if given) as they are resolved.  Return
+        the bipartitions keyed by polytomy.
+    '''
+    refinement = Refinement(polytomyIndex, polytomyOptions, restored, logger, checkpoint, groupKeys)
+    # workers attach to the source trees in shared memory, rather than each
+    #   getting (or touching, after fork()) its own copy of the Tree objects
+    sourceTrees = polytomyIndex.sourceTrees
+    if isAvailable():
+        sourceTrees = SharedSourceTrees.create(sourceTrees)
+    pool = Pool(options.jobs, _setSourceTrees, (sourceTrees,))
+    try:
+        (bipartitionsToAdd,) = runRefinements(pool, [refinement], options.jobs, openQueue(options))
+    finally:
+        pool.close()
+        pool.join()
+        if isinstance(sourceTrees, SharedSourceTrees):
+            sourceTrees.close()
+
+    return (bipartitionsToAdd)
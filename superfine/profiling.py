@@ -0,0 +1,192 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains code which profiles a SuperFine run with cProfile.
+    Each stage of the run (the top-level phases of its log) is profiled
+    separately, and so is each polytomy, of which the slowest are kept.  Only
+    one profiler runs at a time: a region (e.g. a polytomy) opened within
+    another (e.g. the refinement stage) pauses it, and its statistics are
+    added to the outer region's when it closes.  Worker processes profile the
+    chunks and polytomies they are given, and send the statistics back with
+    their logs, to be added to the stage they ran in and kept per worker.
+
+    Statistics are written in the pstats format, and as collapsed stacks for
+    flame graph tools.  As cProfile only records caller-callee pairs, the
+    stacks are found by splitting each function's time among its callers in
+    proportion to the time spent under each of them.
+'''
+
+import cProfile, heapq, os, pstats
+
+
+class RawStats(object):
+    '''Raw profile statistics, in the form in which pstats.Stats loads them from a profiler.'''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+
+def mergeStats(stats, otherStats):
+    '''Return the sum of two raw profile statistics (either of which may be None).'''
+    if stats == None or otherStats == None:
+        return (otherStats if stats == None else stats)
+    merged = pstats.Stats(RawStats(dict(stats)))
+    merged.add(RawStats(otherStats))
+    return (merged.stats)
+
+
+
+def formatFunction(function):
+    '''Return a frame label for a function of the raw profile statistics.'''
+    (filename, line, name) = function
+    if filename == "~":     # a built-in function
+        return (name.replace(";", ","))
+    return ("%s (%s:%d)" % (name, os.path.basename(filename), line)).replace(";", ",")
+
+
+
+def collapseStacks(stats, maxDepth = 100):
+    '''
+        Return the call stacks of raw profile statistics, collapsed into a
+        mapping from semicolon-separated frame labels (root first) to the
+        seconds spent in the last frame.  Stacks of negligible time (less than
+        a hundred-thousandth of the total) are left out.
+    '''
+    callees = {}
+    for (function, (cc, nc, tt, ct, callers)) in stats.items():
+        for (caller, edge) in callers.items():
+            # cProfile records (cc, nc, tt, ct) per caller; profile, the calls only
+            edgeTime = edge[3] if isinstance(edge, tuple) else ct * edge / max(1, nc)
+            callees.setdefault(caller, []).append((function, edgeTime))
+
+    # the time of a function not spent under its recorded callers (e.g. those
+    #   called before profiling started) makes up a stack of its own
+    roots = []
+    for (function, (cc, nc, tt, ct, callers)) in stats.items():
+        recorded = sum([edge[3] if isinstance(edge, tuple) else ct * edge / max(1, nc)
+                        for (caller, edge) in callers.items() if caller in stats])
+        if ct - recorded > 0:
+            roots.append((function, ct - recorded, (function,)))
+    minimum = 1e-5 * sum([seconds for (root, seconds, path) in roots])
+    stacks = {}
+    pending = [root for root in roots if root[1] > minimum]
+    while pending:
+        (function, seconds, path) = pending.pop()
+        (cc, nc, tt, ct, callers) = stats[function]
+        scale = min(1.0, seconds / ct) if ct > 0 else 0.0
+        if tt * scale > minimum:
+            stack = ";".join([formatFunction(frame) for frame in path])
+            stacks[stack] = stacks.get(stack, 0.0) + tt * scale
+        if len(path) >= maxDepth:
+            continue
+        for (callee, edgeTime) in callees.get(function, []):
+            if edgeTime * scale > minimum and callee not in path:  # recursion is cut short
+                pending.append((callee, edgeTime * scale, path + (callee,)))
+    return (stacks)
+
+
+
+class Profiler(object):
+    '''
+        Profiles the stages and polytomies of a run, writing the statistics
+        of each stage to the directory as it ends, and those of the slowest
+        polytomies and of each worker process on close().  Without a
+        directory (in a worker process), the statistics are only collected.
+    '''
+
+    def __init__(self, directory = None, slowest = 0):
+        self.directory = directory
+        self.slowest = slowest
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # (seconds, worker pid, sequence number, degree, raw stats) of the
+        #   slowest polytomies, as a heap
+        self.polytomies = []
+        # worker pid -> raw stats of the work done in the worker process
+        self.workers = {}
+        self.__sequence = 0
+        self.__regions = []     # [profiler, raw stats of the regions nested in it] per open region
+
+    def enter(self):
+        '''Start profiling a region, pausing the region it is opened in.'''
+        if self.__regions:
+            self.__regions[-1][0].disable()
+        profiler = cProfile.Profile()
+        self.__regions.append([profiler, None])
+        profiler.enable()
+
+    def exit(self, record):
+        '''Stop profiling the region of the phase record, and resume the region it was opened in.'''
+        (profiler, nested) = self.__regions.pop()
+        profiler.disable()
+        profiler.create_stats()
+        stats = mergeStats(profiler.stats, nested)
+
+        if record["phase"] == "polytomy":
+            self.keepPolytomy(record["wallSeconds"], os.getpid(), record.get("degree"), stats)
+        if self.__regions:
+            self.__regions[-1][1] = mergeStats(self.__regions[-1][1], stats)
+            self.__regions[-1][0].enable()
+        elif self.directory:
+            self.writeStats(record["phase"], stats)
+        else:
+            self.workers[os.getpid()] = mergeStats(self.workers.get(os.getpid()), stats)
+
+    def keepPolytomy(self, seconds, worker, degree, stats):
+        '''Keep the statistics of a polytomy if it is one of the slowest.'''
+        if self.slowest <= 0:
+            return
+        self.__sequence += 1
+        polytomy = (seconds, worker, self.__sequence, degree, stats)
+        if len(self.polytomies) < self.slowest:
+            heapq.heappush(self.polytomies, polytomy)
+        else:
+            heapq.heappushpop(self.polytomies, polytomy)
+
+    def merge(self, other):
+        '''Add the statistics collected by a worker process's profiler to the region open in this one.'''
+        for (worker, stats) in other.workers.items():
+            self.workers[worker] = mergeStats(self.workers.get(worker), stats)
+            if self.__regions:
+                self.__regions[-1][1] = mergeStats(self.__regions[-1][1], stats)
+        for (seconds, worker, sequence, degree, stats) in other.polytomies:
+            self.keepPolytomy(seconds, worker, degree, stats)
+
+    def writeStats(self, name, stats):
+        '''Write raw profile statistics to name.pstats and name.collapsed in the directory.'''
+        path = os.path.join(self.directory, name)
+        pstats.Stats(RawStats(stats)).dump_stats(path + ".pstats")
+
+        f = open(path + ".collapsed", 'w')
+        for (stack, seconds) in sorted(collapseStacks(stats).items()):
+            f.write("%s %d\n" % (stack, int(round(seconds * 1e6))))   # in microseconds
+        f.close()
+
+    def close(self):
+        '''Write the statistics of the slowest polytomies, slowest first, and of each worker process.'''
+        for (rank, (seconds, worker, sequence, degree, stats)) in enumerate(sorted(self.polytomies, reverse = True)):
+            self.writeStats("polytomy-%02d-degree%s" % (rank + 1, degree), stats)
+        for (worker, stats) in sorted(self.workers.items()):
+            self.writeStats("worker-%d" % worker, stats)
@@ -0,0 +1,194 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains read-only views of source trees relabeled by polytomy
+    group numbers.
+'''
+
+from bisect import bisect_right
+
+from newick_modified.tree import *
+from spruce.unrooted import isNonLeaf
+
+
+class RelabeledView(object):
+    '''
+        A source tree seen with its leaves relabeled by polytomy group numbers.
+        Labels are mapped through the relabeling on demand; a relabeled tree is
+        only built (by materialize()) once the view is known to be informative.
+    '''
+
+    def __init__(self, source, relabeling, defaultLabel):
+        self.source = source
+        self.relabeling = relabeling
+        self.defaultLabel = defaultLabel
+        self.__labels = None
+
+    def labels(self):
+        '''Return the relabeled leaves, in the order of the source tree's leaves.'''
+        if self.__labels is None:
+            if isNonLeaf(self.source):
+                identifiers = self.source.get_leaves_identifiers()
+            else:
+                identifiers = [self.source.identifier]
+            self.__labels = [self.relabeling.get(identifier, self.defaultLabel) for identifier in identifiers]
+        return (self.__labels)
+
+    def isInformative(self):
+        '''Return True if the relabeled tree has at least four unique labels.'''
+        return len(set(self.labels())) >= 4
+
+    def materialize(self):
+        '''Return a new, relabeled copy of the source tree; the source tree is left untouched.'''
+        if not isNonLeaf(self.source):
+            return Leaf(self.relabeling.get(self.source.identifier, self.defaultLabel))
+
+        tree = Tree()
+        stack = [(self.source, tree)]
+        while stack:
+            (node, copy) = stack.pop()
+            for (child, bootstrap, length) in node.get_edges():
+                if isNonLeaf(child):
+                    childCopy = Tree()
+                    stack.append((child, childCopy))
+                else:
+                    childCopy = Leaf(self.relabeling.get(child.identifier, self.defaultLabel))
+                copy._edges.append((childCopy, bootstrap, length))
+        return (tree)
+
+
+
+class PolytomyIndex(object):
+    '''
+        Index the polytomies of an SCM tree, built in a single traversal of
+        the tree.  Each taxon (including taxa found only in source trees) gets
+        an integer id, the leaves of the tree being numbered in preorder, so
+        that the leaves below each node have consecutive ids.  A polytomy
+        then only keeps the first id below each of its children, by group
+        number: a taxon falls into the group of the child below which its id
+        is, and taxa outside of the polytomy into the parent group (numbered
+        by the polytomy's number of children, as in relabelTree()).  The
+        source trees informative about each polytomy, i.e. with at least four
+        unique groups, are found up front.
+    '''
+
+    def __init__(self, tree, sourceTrees):
+        self.tree = tree
+        self.sourceTrees = sourceTrees
+        self.polytomies = []        # in the order of xfindPolytomies()
+        self.taxonIds = {}          # taxon identifier -> taxon id
+        self.sourceTaxonIds = []    # taxon ids of each source tree's leaves
+
+        # find leaves in preorder, and the range of them below each node
+        leafOrder = []
+        ranges = {}
+        stack = [(tree, False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited:
+                ranges[id(node)] = (ranges[id(node)], len(leafOrder))
+            elif isNonLeaf(node):
+                if node.degree > 3:
+                    self.polytomies.append(node)
+                ranges[id(node)] = len(leafOrder)
+                stack.append((node, True))
+                for edge in reversed(node.get_edges()):
+                    stack.append((edge[0], False))
+            else:
+                ranges[id(node)] = (len(leafOrder), len(leafOrder) + 1)
+                leafOrder.append(node.identifier)
+
+        for identifier in leafOrder:
+            self.taxonIds.setdefault(identifier, len(self.taxonIds))
+        for source in sourceTrees:
+            identifiers = source.get_leaves_identifiers() if isNonLeaf(source) else [source.identifier]
+            self.sourceTaxonIds.append([self.taxonIds.setdefault(identifier, len(self.taxonIds))
+                                        for identifier in identifiers])
+
+        self.__leafOrder = leafOrder
+        self.__positions = {}       # id(polytomy) -> position in self.polytomies
+        self.__children = []        # (child, range of its leaves) for each polytomy child
+        self.__starts = []          # (first taxon id below each child, end of the last child's ids) per polytomy
+        self.__informativeSources = []
+        for (position, polytomy) in enumerate(self.polytomies):
+            children = [(edge[0], ranges[id(edge[0])]) for edge in polytomy.get_edges()]
+            starts = ([start for (child, (start, end)) in children], ranges[id(polytomy)][1])
+
+            self.__positions[id(polytomy)] = position
+            self.__children.append(children)
+            self.__starts.append(starts)
+            groupCounts = [len(set([self.__findGroup(starts, taxonId) for taxonId in taxonIds]))
+                           for taxonIds in self.sourceTaxonIds]
+            self.__informativeSources.append([(i, count) for (i, count) in enumerate(groupCounts) if count >= 4])
+
+    @staticmethod
+    def __findGroup(starts, taxonId):
+        (starts, end) = starts
+        if starts[0] <= taxonId < end:
+            return bisect_right(starts, taxonId) - 1
+        return len(starts)
+
+    def group(self, polytomy, taxonId):
+        '''Return the polytomy's group number of a taxon id.'''
+        return self.__findGroup(self.__starts[self.__positions[id(polytomy)]], taxonId)
+
+    def getRelabeling(self, polytomy):
+        '''
+            Return a mapping from leaf labels to polytomy group numbers and a
+            mapping from polytomy group numbers to polytomy subtrees, as
+            buildRelabeling() does, without traversing the polytomy's subtrees.
+        '''
+        children = self.__children[self.__positions[id(polytomy)]]
+        relabeling = {}
+        delabeling = {}
+        for (group, (child, (start, end))) in enumerate(children):
+            for identifier in self.__leafOrder[start:end]:
+                relabeling[identifier] = group
+            delabeling[group] = child
+        return (relabeling, delabeling)
+
+    def childLeaves(self, polytomy):
+        '''Return the leaf labels below each of the polytomy's children, by group number.'''
+        children = self.__children[self.__positions[id(polytomy)]]
+        return [self.__leafOrder[start:end] for (child, (start, end)) in children]
+
+    def informativeSources(self, polytomy):
+        '''Return the indices of the source trees which are informative about the polytomy.'''
+        return [i for (i, count) in self.__informativeSources[self.__positions[id(polytomy)]]]
+
+    def estimateQuartets(self, polytomy):
+        '''
+            Return an estimate of the number of quartet trees encoding the
+            source trees informative about the polytomy, from the number of
+            groups found in each of them.
+        '''
+        return sum([count * (count - 1) * (count - 2) * (count - 3) // 24
+                    for (i, count) in self.__informativeSources[self.__positions[id(polytomy)]]])
+
+    def getInformativeViews(self, polytomy):
+        '''
+            Return the relabeled views of the source trees which are informative
+            about the polytomy, and the mapping from polytomy group numbers to
+            polytomy subtrees.
+        '''
+        (relabeling, delabeling) = self.getRelabeling(polytomy)
+        views = [RelabeledView(self.sourceTrees[i], relabeling, len(delabeling))
+                 for i in self.informativeSources(polytomy)]
+        return (views, delabeling)
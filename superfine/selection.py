@@ -0,0 +1,111 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains the rule tables used to pick a reconciler for each
+    polytomy (the "auto" reconciler).  A rule table is a list of rules, tried
+    in order; the first rule whose bounds all hold for a polytomy gives its
+    reconciler.  A rule may bound the polytomy's degree (that of its node, as
+    set by addDegreeInfo()), the number of source trees informative about
+    it, and the estimated number of quartet trees encoding them, e.g.
+
+        [{"maxDegree": 15, "maxQuartets": 500000, "reconciler": "qmc"},
+         {"maxDegree": 60, "reconciler": "gmrp"},
+         {"reconciler": "fml"}]
+
+    The last rule must have no bounds, so that every polytomy is matched.
+    Tables can be produced by benchmarks/calibrateReconcilers.py, whose
+    report, written to defaultRules.json next to this module, gives the
+    default table.
+'''
+
+import json
+import os
+
+
+RECONCILERS = ("qmc", "gmrp", "rmrp", "fml", "rml")
+
+# rule keys, and the polytomy features they bound
+BOUNDS = {"minDegree": "degree", "maxDegree": "degree",
+          "minSources": "sources", "maxSources": "sources",
+          "minQuartets": "quartets", "maxQuartets": "quartets"}
+
+# the calibration report holding the default rule table
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "defaultRules.json")
+
+
+def validateRules(rules):
+    '''Raise ValueError unless the rules make up a valid rule table; return them otherwise.'''
+    if not isinstance(rules, list) or len(rules) == 0:
+        raise ValueError("a rule table must be a non-empty list of rules")
+
+    for rule in rules:
+        if not isinstance(rule, dict) or rule.get("reconciler") not in RECONCILERS:
+            raise ValueError("each rule must name a reconciler, one of {%s}: %s" % (", ".join(RECONCILERS), rule))
+        for key in rule.keys():
+            if key == "reconciler":
+                continue
+            if key not in BOUNDS:
+                raise ValueError("unknown rule bound '%s'; bounds are %s" % (key, ", ".join(sorted(BOUNDS.keys()))))
+            if isinstance(rule[key], bool) or not isinstance(rule[key], (int, float)) or not rule[key] >= 0:
+                raise ValueError("rule bound '%s' must be a non-negative number: %r" % (key, rule[key]))
+
+    if len(rules[-1]) != 1:
+        raise ValueError("the last rule must have no bounds")
+
+    return (rules)
+
+
+
+def readRules(file):
+    '''Read a rule table from a JSON file.'''
+    f = open(file, 'r')
+    try:
+        rules = json.load(f)
+    finally:
+        f.close()
+
+    # a calibration report holds its rule table along with its measurements
+    if isinstance(rules, dict) and "rules" in rules:
+        rules = rules["rules"]
+
+    return validateRules(rules)
+
+
+
+def matchRule(rules, degree, sources, quartets):
+    '''Return the reconciler given by the first rule which the polytomy's features satisfy.'''
+    features = {"degree": degree, "sources": sources, "quartets": quartets}
+    for rule in rules:
+        matched = True
+        for (key, bound) in rule.items():
+            if key == "reconciler":
+                continue
+            feature = features[BOUNDS[key]]
+            if (key.startswith("min") and feature < bound) or (key.startswith("max") and feature > bound):
+                matched = False
+                break
+        if matched:
+            return (rule["reconciler"])
+
+    raise ValueError("no rule matches a polytomy of degree %d" % degree)
+
+
+
+DEFAULT_RULES = readRules(DEFAULT_RULES_FILE)
@@ -0,0 +1,379 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains a long-running SuperFine server, which takes jobs on
+    a Unix domain socket and runs them on a warm pool of worker processes, so
+    that small jobs do not pay for interpreter startup, imports and worker
+    spin-up.  Jobs and replies are JSON objects, one per line.  A job is
+
+        {"trees": [NEWICK, ...], "options": {...}, "stats": true}
+
+    where the options (reconciler, numIters, compress and timeout, named as
+    by runSuperFine.py) override the server's, and stats asks for the phase
+    records of the run.  The server streams back the events of the job:
+
+        {"event": "accepted", "job": N, "waiting": N}
+        {"event": "scm", "job": N, "tree": NEWICK}
+        {"event": "result", "job": N, "tree": NEWICK, "stats": {...}}
+
+    or {"event": "error", "job": N, "error": MESSAGE} in place of the last
+    ones.  A connection may send several jobs, each being run once the
+    previous one is done.
+
+    At most maxJobs jobs run at once, and at most maxQueued more wait for
+    them; further jobs are turned down as busy, so that clients back off.
+    Parsed source trees and SCM trees are cached by the digest of the source
+    trees, and so are the polytomies resolved for them (see Journal), so
+    that resubmitted jobs, or jobs with other options on the same trees,
+    reuse them.  Source trees are also packed in shared memory for workers
+    to relabel (see superfine.sharedtrees), once per digest; the block is
+    released once its cache entry is evicted and no job runs on it.
+'''
+
+import copy, hashlib, json, os, signal, socket, socketserver, threading
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from newick_modified.tree import parse_tree
+from spruce.unrooted import addDegreeInfo
+from superfine.SuperFine import expandTree, indexPolytomies
+from superfine.batch import _mergeDataset
+from superfine.checkpoint import Journal
+from superfine.logger import Logger
+from superfine.parallel import CACHED_DATASETS, Refinement, runRefinements
+from superfine.sharedtrees import SharedSourceTrees, isAvailable, startTracker
+
+
+# options which a job may set, with their types
+JOB_OPTIONS = {"reconciler": (str,), "numIters": (int,), "compress": (bool,), "timeout": (int, float, type(None))}
+RECONCILERS = ("qmc", "gmrp", "rmrp", "fml", "rml", "auto")
+
+
+def _startWorker():
+    '''Leave interrupts to the server, which terminates its workers as it stops.'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+
+class JobError(Exception):
+    '''Raised when a job is malformed, or cannot be run.'''
+    pass
+
+
+
+class SharedDataset(object):
+    '''
+        The source trees of a dataset packed in shared memory, held by the
+        server's cache and by the jobs running on them; the block is released
+        once neither holds it.
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        self.jobs = 0
+        self.cached = True
+
+    def release(self):
+        if self.jobs == 0 and not self.cached:
+            self.store.close()
+
+
+
+class Cache(object):
+    '''
+        A thread-safe map which keeps its most recently used entries, and
+        hands those it drops to evict (if given).
+    '''
+
+    def __init__(self, size, evict = None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evict = evict
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.entries:
+                return (default)
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def setdefault(self, key, value):
+        '''Return the entry for the key, adding the given value if there is none.'''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                (evicted, evictedValue) = self.entries.popitem(last = False)
+                if self.evict:
+                    self.evict(evictedValue)
+            return (value)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+
+def readJob(line, defaults):
+    '''
+        Return the source trees of a job given as a line of JSON, the options
+        with which to run it (a copy of the defaults, with its own), and
+        whether its stats are asked for.  Raise a JobError if it is malformed.
+    '''
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        raise JobError("malformed job: %s" % e)
+    if not isinstance(job, dict) or not isinstance(job.get("trees"), list) or \
+            not all([isinstance(tree, str) for tree in job["trees"]]) or not job["trees"]:
+        raise JobError("a job needs a list of source trees in Newick format")
+
+    options = copy.copy(defaults)
+    for (name, value) in job.get("options", {}).items():
+        if name not in JOB_OPTIONS:
+            raise JobError("unknown option %s" % name)
+        valid = isinstance(value, JOB_OPTIONS[name])
+        if isinstance(value, bool):     # which is a subclass of int
+            valid = bool in JOB_OPTIONS[name]
+        elif name == "reconciler":
+            valid = valid and value in RECONCILERS
+        elif name in ("numIters", "timeout") and valid and value != None:
+            valid = value > 0
+        if not valid:
+            raise JobError("bad value for option %s: %r" % (name, value))
+        setattr(options, name, value)
+    return ([tree.strip().rstrip(";") for tree in job["trees"]], options, bool(job.get("stats")))
+
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    '''Run the jobs sent on a connection, one at a time, streaming back their events.'''
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    self.server.submit(line.decode("utf-8"), self.send)
+        except (BrokenPipeError, ConnectionResetError):    # the client went away
+            pass
+
+    def send(self, event):
+        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+
+class SuperFineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+        A SuperFine server listening on the Unix domain socket at path, with a
+        pool of options.jobs worker processes; options are the defaults of
+        its jobs, and options.maxJobs and options.maxQueued bound the jobs
+        running and waiting.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, path, options):
+        self.options = copy.copy(options)
+        self.options.writeData = self.options.stats = None
+        self.jobs = max(options.jobs, 1)
+        startTracker()      # before the workers fork, so that they share it
+        self.pool = Pool(self.jobs, _startWorker)
+
+        self.slots = threading.BoundedSemaphore(options.maxJobs)
+        self.lock = threading.Lock()
+        self.admitted = 0       # jobs running or waiting for a slot
+        self.jobIds = 0
+        self.sourceTrees = Cache(CACHED_DATASETS)      # digest -> parsed source trees
+        self.scmTrees = Cache(CACHED_DATASETS)         # digest -> SCM tree in Newick format
+        self.journals = Cache(CACHED_DATASETS)         # digest -> Journal of the resolved polytomies
+        self.stores = Cache(CACHED_DATASETS, self.evictStore)  # digest -> SharedDataset, under self.lock
+
+        if os.path.exists(path):   # a socket left behind by a server which died
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, JobHandler)
+
+    def submit(self, line, send):
+        '''Run a job once a slot is free, unless too many jobs are waiting already.'''
+        with self.lock:
+            self.jobIds += 1
+            job = self.jobIds
+        try:
+            (trees, options, stats) = readJob(line, self.options)
+        except JobError as e:
+            send({"event": "error", "job": job, "error": str(e)})
+            return
+
+        with self.lock:
+            waiting = self.admitted - self.options.maxJobs
+            if waiting >= self.options.maxQueued:
+                send({"event": "error", "job": job, "error": "busy: %d jobs waiting" % waiting})
+                return
+            self.admitted += 1
+        try:
+            send({"event": "accepted", "job": job, "waiting": max(waiting, 0)})
+            with self.slots:
+                try:
+                    (tree, logger) = self.runJob(job, trees, options, send)
+                except (BrokenPipeError, ConnectionResetError):
+                    raise
+                except JobError as e:
+                    send({"event": "error", "job": job, "error": str(e)})
+                    return
+                except Exception as e:
+                    send({"event": "error", "job": job, "error": "%s: %s" % (e.__class__.__name__, e)})
+                    return
+            result = {"event": "result", "job": job, "tree": tree}
+            if stats:
+                result["stats"] = logger.getStats(None)
+                del result["stats"]["input"]
+            send(result)
+        finally:
+            with self.lock:
+                self.admitted -= 1
+
+    def runJob(self, job, trees, options, send):
+        '''Run SuperFine on the source trees of a job; return the SuperFine tree in Newick format, and the log.'''
+        logger = Logger()
+        digest = hashlib.sha1("\n".join(trees).encode("utf-8")).hexdigest()
+        dataset = (digest, tuple(trees))
+
+        # merge the SCM tree on a worker while the source trees are parsed here
+        newick = self.scmTrees.get(digest)
+        if newick == None:
+            merging = self.pool.apply_async(_mergeDataset, ((job, dataset, options),))
+        sourceTrees = self.sourceTrees.get(digest)
+        with logger.phase("read", trees = len(trees), cached = sourceTrees != None):
+            if sourceTrees == None:
+                sourceTrees = self.sourceTrees.setdefault(digest, [parse_tree(tree) for tree in trees])
+        if newick == None:
+            (owner, newick, error, log) = merging.get()
+            logger.merge(log)
+            if error:
+                raise JobError(error)
+            self.scmTrees.setdefault(digest, newick)
+        else:
+            with logger.phase("scm", trees = len(trees), cached = True):
+                pass
+        send({"event": "scm", "job": job, "tree": newick})
+        tree = addDegreeInfo(parse_tree(newick))
+
+        # polytomies resolved with a timeout may have fallen back, so they are not reused
+        journal = None
+        if options.timeout == None:
+            journal = self.journals.setdefault(digest, Journal())
+        with logger.phase("refine") as record:
+            (polytomyIndex, polytomyOptions, restored, groupKeys) = indexPolytomies(tree, sourceTrees, options, logger,
+                                                                                    journal)
+            record["polytomies"] = len(polytomyIndex.polytomies)
+            # workers relabel the source trees packed in shared memory, unless
+            #   every polytomy was restored from the journal
+            shared = None
+            if isAvailable() and not all([found for (found, bipartitions) in restored]):
+                shared = self.acquireStore(digest, sourceTrees)
+                dataset = (digest, shared.store)
+            try:
+                refinement = Refinement(polytomyIndex, polytomyOptions, restored, logger, journal, groupKeys,
+                                        dataset)
+                (bipartitionsToAdd,) = runRefinements(self.pool, [refinement], self.jobs)
+            finally:
+                if shared:
+                    self.releaseStore(shared)
+
+        with logger.phase("expand", bipartitions = sum([len(bipartitions)
+                                                        for bipartitions in bipartitionsToAdd.values()])):
+            expandTree(bipartitionsToAdd)
+        return (str(tree) + ";", logger)
+
+    def acquireStore(self, digest, sourceTrees):
+        '''Return the SharedDataset of the source trees with the digest, packing them if need be; see releaseStore().'''
+        with self.lock:
+            shared = self.stores.get(digest)
+            if shared:
+                shared.jobs += 1
+                return (shared)
+        store = SharedSourceTrees.create(sourceTrees)
+        with self.lock:
+            shared = self.stores.setdefault(digest, SharedDataset(store))
+            if shared.store is not store:     # packed by another job in the meantime
+                store.close()
+            shared.jobs += 1
+            return (shared)
+
+    def releaseStore(self, shared):
+        '''Let go of a SharedDataset at the end of a job.'''
+        with self.lock:
+            shared.jobs -= 1
+            shared.release()
+
+    def evictStore(self, shared):
+        '''Let go of a SharedDataset dropped from the cache (with self.lock held).'''
+        shared.cached = False
+        shared.release()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        with self.lock:
+            while self.stores.entries:
+                self.evictStore(self.stores.entries.popitem()[1])
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+
+def submitJob(path, trees, options = {}, stats = False):
+    '''
+        Submit a job to the server listening on the Unix domain socket at path;
+        yield its events as they are streamed back.
+    '''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    try:
+        connection.sendall((json.dumps({"trees": trees, "options": options, "stats": stats}) + "\n").encode("utf-8"))
+        replies = connection.makefile("rb")
+        for line in replies:
+            event = json.loads(line.decode("utf-8"))
+            yield event
+            if event["event"] in ("result", "error"):
+                break
+        replies.close()
+    finally:
+        connection.close()
+
+
+
+def SuperFineServe(path, options):
+    '''Main loop of server mode: serve until interrupted or terminated.'''
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    server = SuperFineServer(path, options)
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        server.server_close()
@@ -0,0 +1,228 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module packs parsed source trees into flat arrays in a block of
+    shared memory, which worker processes attach to without copying it, in
+    place of a pickled (or, after fork(), copy-on-write) graph of Tree
+    objects per worker.  The block holds, after a header of counts,
+
+        lengths, bootstraps    float64 per node (NaN for None),
+        offsets                int32 per tree, the number of its first node,
+        parents                int32 per node, the node number of its parent
+                               within its tree (-1 for the root),
+        taxa                   int32 per node, its taxon id (-1 for internal
+                               nodes), and
+        names                  the taxon identifiers, one per line,
+
+    with the nodes of each tree in preorder, so that each node's children come
+    after it in the order of its edges.  A store pickles as the name of its
+    block, so it can be handed to pool initializers or put in tasks.
+    Shared memory needs Python 3.8; isAvailable() tells if there is any.
+'''
+
+import struct
+from array import array
+
+from newick_modified.tree import Leaf, Tree
+from spruce.unrooted import isNonLeaf
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:     # before Python 3.8
+    shared_memory = None
+
+
+HEADER = struct.Struct("<qqq")      # trees, nodes, bytes of taxon names
+
+
+def isAvailable():
+    return shared_memory != None
+
+
+
+def startTracker():
+    '''
+        Start this process's resource tracker, if there is shared memory; a
+        pool forked afterwards shares it.  A worker forked before it runs
+        starts a tracker of its own on attaching to a block, which unlinks the
+        block when the worker exits, from under the process which owns it.
+    '''
+    if isAvailable():
+        resource_tracker.ensure_running()
+
+
+
+def packTrees(sourceTrees):
+    '''
+        Return the arrays encoding the source trees (lengths, bootstraps,
+        offsets, parents and taxa; see above), and the taxon identifiers by
+        taxon id.
+    '''
+    (lengths, bootstraps) = (array('d'), array('d'))
+    (offsets, parents, taxa) = (array('i'), array('i'), array('i'))
+    (names, taxonIds) = ([], {})
+    nan = float("nan")
+
+    for source in sourceTrees:
+        start = len(parents)
+        offsets.append(start)
+        stack = [(source, -1, None, None)]
+        while stack:
+            (node, parent, bootstrap, length) = stack.pop()
+            number = len(parents) - start
+            parents.append(parent)
+            lengths.append(nan if length == None else length)
+            bootstraps.append(nan if bootstrap == None else bootstrap)
+            if isNonLeaf(node):
+                taxa.append(-1)
+                for (child, childBootstrap, childLength) in reversed(node.get_edges()):
+                    stack.append((child, number, childBootstrap, childLength))
+            else:
+                if node.identifier not in taxonIds:
+                    taxonIds[node.identifier] = len(names)
+                    names.append(node.identifier)
+                taxa.append(taxonIds[node.identifier])
+    offsets.append(len(parents))
+    return ((lengths, bootstraps, offsets, parents, taxa), names)
+
+
+
+class SharedSourceTrees(object):
+    '''
+        A read-only sequence of source trees packed in shared memory.  The
+        process which packs them (with create()) owns the block, and unlinks
+        it on close(); others attach to it by unpickling the store.
+    '''
+
+    def __init__(self, memory, owner = False):
+        self.memory = memory
+        self.owner = owner
+        (self.numTrees, numNodes, namesSize) = HEADER.unpack_from(memory.buf, 0)
+
+        buf = memory.buf
+        self.__views = []
+        def take(start, count, typecode, itemSize):
+            view = buf[start:start + count * itemSize].cast(typecode)
+            self.__views.append(view)
+            return (view, start + count * itemSize)
+
+        position = HEADER.size
+        (self.lengths, position) = take(position, numNodes, 'd', 8)
+        (self.bootstraps, position) = take(position, numNodes, 'd', 8)
+        (self.offsets, position) = take(position, self.numTrees + 1, 'i', 4)
+        (self.parents, position) = take(position, numNodes, 'i', 4)
+        (self.taxa, position) = take(position, numNodes, 'i', 4)
+        (self.__names, _) = take(position, namesSize, 'B', 1)
+        self.__identifiers = None
+
+    @staticmethod
+    def create(sourceTrees):
+        '''Pack the source trees into a new block of shared memory.'''
+        (arrays, names) = packTrees(sourceTrees)
+        names = "\n".join(names).encode("utf-8")
+        parts = [HEADER.pack(len(arrays[2]) - 1, len(arrays[3]), len(names))] + \
+                [part.tobytes() for part in arrays] + [names]
+
+        memory = shared_memory.SharedMemory(create = True, size = max(sum([len(part) for part in parts]), 1))
+        position = 0
+        for part in parts:
+            memory.buf[position:position + len(part)] = part
+            position += len(part)
+        return SharedSourceTrees(memory, True)
+
+    def __getstate__(self):
+        return {"name": self.memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(shared_memory.SharedMemory(name = state["name"]))
+
+    def __len__(self):
+        return (self.numTrees)
+
+    def identifiers(self):
+        '''Return the taxon identifiers by taxon id, decoded once per process.'''
+        if self.__identifiers == None:
+            names = bytes(self.__names).decode("utf-8")
+            self.__identifiers = names.split("\n") if names else []
+        return (self.__identifiers)
+
+    def relabelTaxa(self, relabeling, defaultLabel):
+        '''Return the array mapping taxon ids to labels through a relabeling.'''
+        return [relabeling.get(identifier, defaultLabel) for identifier in self.identifiers()]
+
+    def view(self, index, labels):
+        '''Return a view of a source tree relabeled by the array mapping taxon ids to labels.'''
+        return PackedView(self, index, labels)
+
+    def __getitem__(self, index):
+        '''Return a source tree, rebuilt as a Tree.'''
+        return self.view(index, self.identifiers()).materialize()
+
+    def close(self):
+        '''Detach from the block, and unlink it if this process owns it.'''
+        for view in self.__views:
+            view.release()
+        self.__views = []
+        self.memory.close()
+        if self.owner:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:     # unlinked already
+                pass
+
+
+
+class PackedView(object):
+    '''
+        A packed source tree seen with its leaves relabeled, as RelabeledView
+        sees a Tree: labels are looked up on demand, and a relabeled tree is
+        only built by materialize().
+    '''
+
+    def __init__(self, store, index, labels):
+        self.store = store
+        (self.start, self.end) = (store.offsets[index], store.offsets[index + 1])
+        self.taxonLabels = labels
+        self.__labels = None
+
+    def labels(self):
+        '''Return the relabeled leaves, in the order of the source tree's leaves.'''
+        if self.__labels is None:
+            taxa = self.store.taxa
+            self.__labels = [self.taxonLabels[taxa[node]] for node in range(self.start, self.end) if taxa[node] >= 0]
+        return (self.__labels)
+
+    def isInformative(self):
+        '''Return True if the relabeled tree has at least four unique labels.'''
+        return len(set(self.labels())) >= 4
+
+    def materialize(self):
+        '''Return a new, relabeled Tree of the source tree.'''
+        store = self.store
+        nodes = []
+        for node in range(self.start, self.end):
+            taxon = store.taxa[node]
+            copy = Tree() if taxon < 0 else Leaf(self.taxonLabels[taxon])
+            parent = store.parents[node]
+            if parent >= 0:
+                (bootstrap, length) = (store.bootstraps[node], store.lengths[node])
+                nodes[parent]._edges.append((copy, None if bootstrap != bootstrap else bootstrap,
+                                             None if length != length else length))
+            nodes.append(copy)
+        return (nodes[0])
@@ -0,0 +1,103 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    SuperFine testing suite
+'''
+
+import os
+import sys
+
+from newick_modified.tree import *
+from spruce.unrooted import *
+from runSuperFine import parse_options
+
+
+def makeOptions(**values):
+    '''Return the options of a run of runSuperFine.py with its defaults, but for the given values.'''
+    (input, options) = parse_options(["input"])
+    for (name, value) in values.items():
+        setattr(options, name, value)
+    return (options)
+
+
+def collapseEdges(tree, rng, probability):
+    '''Contract each internal edge of a tree with the given probability, creating polytomies.'''
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        (edges, pending) = ([], list(node.get_edges()))
+        while pending:
+            edge = pending.pop(0)
+            if isNonLeaf(edge[0]) and rng.random() < probability:
+                pending = list(edge[0].get_edges()) + pending
+            else:
+                edges.append(edge)
+        node._edges = edges
+        node._leaves_cache = None
+        stack.extend([edge[0] for edge in edges if isNonLeaf(edge[0])])
+    return addDegreeInfo(tree)
+
+
+def randomTopology(rng, labels):
+    '''Return a random binary (unrooted) tree, in Newick format, on the given labels.'''
+    clades = [str(label) for label in labels]
+    while len(clades) > 3:
+        rng.shuffle(clades)
+        clades = clades[2:] + ["(%s,%s)" % (clades[0], clades[1])]
+    return "(%s);" % ",".join(clades)
+
+
+FIND_CUT = '''#!%s
+import sys, tempfile, time
+data = sys.stdin.read()
+time.sleep(%r)
+if %r:
+    f = tempfile.NamedTemporaryFile('w', dir = %r, suffix = ".quartets", delete = False)
+    f.write(data)
+    f.close()
+groups = sorted(set([int(group) for line in data.split()
+                     for group in line.split(":")[1].replace("|", ",").split(",")]))
+if %r != None and len(groups) > %r:
+    print("crashed")
+    sys.exit(1)
+tree = str(groups[0])
+for group in groups[1:]:
+    tree = "(%%s,%%d)" %% (tree, group)
+print(tree + ";")
+'''
+
+
+def installFindCut(directory, log = None, delay = 0, maxGroups = None):
+    '''
+        Put a stand-in for find-cut (QMC) in the directory, first on the PATH:
+        it answers with a caterpillar tree on the groups of the quartet trees
+        it reads, after the given delay (in seconds), and keeps a copy of each
+        input in the log directory, if given.  It fails, with garbage for an
+        answer, on more than maxGroups groups, if given.  Return the previous PATH, to be
+        restored.
+    '''
+    path = os.path.join(directory, "find-cut")
+    f = open(path, 'w')
+    f.write(FIND_CUT % (sys.executable, delay, log, log, maxGroups, maxGroups))
+    f.close()
+    os.chmod(path, 0o755)
+    previous = os.environ["PATH"]
+    os.environ["PATH"] = directory + os.pathsep + previous
+    return (previous)
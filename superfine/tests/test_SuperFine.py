@@ -0,0 +1,213 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the refinement of the SCM tree.
+'''
+
+import copy
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+from superfine.SuperFine import *
+from superfine.tests import collapseEdges, makeOptions, randomTopology
+from spruce.tests import datasetPath
+
+
+def listFindImpliedBipartitions(reconciledTree, delabeling):
+    '''Reference search for implied bipartitions, as lists of polytomy subtrees.'''
+    reconciledTree = re.sub(r"\)[0-9]+(\.[0-9]+)?", ")", reconciledTree, flags=re.MULTILINE)
+
+    bipartitions = []
+    tree = parse_tree(reconciledTree)
+
+    for (src, dest) in getInternalEdges(tree):
+        setA = [label for label in dest.get_leaves_identifiers()]
+        setB = [label for label in tree.get_leaves_identifiers() if label not in setA]
+
+        identifierIntegers = [int(leaf) for leaf in tree.get_leaves_identifiers()]
+        maxElement = str(max(identifierIntegers))
+
+        if maxElement not in setA:
+            bipartitions.extend([[delabeling[int(label)] for label in setA]])
+        else:
+            bipartitions.extend([[delabeling[int(label)] for label in setB]])
+
+    return (bipartitions)
+
+
+def listExpandTree(bipartitionsToAdd):
+    '''Reference insertion of bipartitions, by leaf label lists.'''
+
+    for polytomy in bipartitionsToAdd.keys():
+        bipartitions = bipartitionsToAdd[polytomy]
+
+        sizes = {}
+        for bipartition in bipartitions:
+            sizes.setdefault(len(bipartition), []).append(bipartition)
+
+        for size in sorted(sizes.keys()):
+            for bipartition in sizes[size]:
+                bipartitionLeaves = []
+                for subtree in bipartition:
+                    bipartitionLeaves.extend(subtree.get_leaves_identifiers())
+
+                branchesToMove = []
+                for edge in polytomy.get_edges():
+                    problemLabels = [label for label in edge[0].get_leaves_identifiers()
+                                           if label not in bipartitionLeaves]
+                    if len(problemLabels) == 0:
+                        branchesToMove.append(edge)
+
+                newSubtree = Tree()
+                for edge in branchesToMove:
+                    newSubtree.add_edge(edge)
+                    polytomy._edges.remove(edge)
+
+                polytomy.add_edge((newSubtree, None, None))
+
+
+def randomReconcilerOutput(rng, groups):
+    '''Return a random binary tree on the given groups, formatted as a subroutine might output it.'''
+    reconciledTree = randomTopology(rng, groups)
+    style = rng.randint(0, 2)
+    if style == 1:      # branch lengths
+        reconciledTree = re.sub(r"([0-9)])(?=[,)])", lambda m: "%s:%.5f" % (m.group(1), rng.random()),
+                                reconciledTree)
+    elif style == 2:    # support values
+        reconciledTree = re.sub(r"\)(?=[,)])", lambda m: ")%.2f" % rng.random(), reconciledTree)
+    return (reconciledTree + "\n")
+
+
+class FindImpliedBipartitionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(8)
+
+    def assertMatchesReference(self, reconciledTree, numGroups):
+        delabeling = dict([(i, i) for i in range(numGroups)])
+        expected = [sum([1 << i for i in bipartition])
+                    for bipartition in listFindImpliedBipartitions(reconciledTree, delabeling)]
+        self.assertEqual(findImpliedBipartitions(reconciledTree), expected)
+        self.assertEqual(findImpliedBipartitions(parse_tree(re.sub(r"\)[0-9]+(\.[0-9]+)?", ")", reconciledTree))),
+                         expected)
+
+    def testRecordedOutputs(self):
+        outputs = ["((0,1),(2,3));\n",
+                   "((0:0.1,1:0.2)0.95:0.3,(2,(3,4)1:0.1):0.0,5);",
+                   "(0,(1,(2,(3,4))));",
+                   "((0,(1,2)),3);",
+                   "(((0,1),(2,3)));",
+                   "((0,1),2,\n(3,4)100);",
+                   "(0,1,2);"]
+        for output in outputs:
+            self.assertMatchesReference(output, 6)
+
+    def testRandomOutputs(self):
+        for trial in range(200):
+            numGroups = self.random.randint(4, 30)
+            self.assertMatchesReference(randomReconcilerOutput(self.random, range(numGroups)), numGroups)
+
+
+class ExpandTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(3)
+
+    def findReconciledTrees(self, tree):
+        '''Resolve each polytomy of a tree by a random (reconciled) tree on its groups.'''
+        reconciledTrees = {}
+        for polytomy in xfindPolytomies(tree):
+            (relabeling, delabeling) = buildRelabeling(polytomy)
+            groups = list(range(len(delabeling) + (polytomy is not tree)))
+            reconciledTrees[polytomy] = (randomReconcilerOutput(self.random, groups), delabeling)
+        return (reconciledTrees)
+
+    def testMatchesListInsertion(self):
+        for replicate in range(3):
+            tree = readNewickFile(datasetPath("simulated", "100-taxa", "50", "sm_data.%d.model_tree" % replicate))
+            tree = collapseEdges(tree, self.random, 0.6)
+            self.assertTrue(max([polytomy.degree for polytomy in xfindPolytomies(tree)]) > 6)
+
+            reconciledTrees = self.findReconciledTrees(tree)
+            (expected, expectedReconciledTrees) = copy.deepcopy((tree, reconciledTrees))
+            listExpandTree(dict([(polytomy, listFindImpliedBipartitions(reconciledTree, delabeling))
+                                 for (polytomy, (reconciledTree, delabeling)) in expectedReconciledTrees.items()]))
+            expandTree(dict([(polytomy, findImpliedBipartitions(reconciledTree))
+                             for (polytomy, (reconciledTree, delabeling)) in reconciledTrees.items()]))
+
+            self.assertEqual(str(tree), str(expected))
+            self.assertEqual(len(set(xfindBipartitions(tree))), len(set(tree.get_leaves_identifiers())) - 3)
+
+    def testPartialResolution(self):
+        tree = addDegreeInfo(parse_tree("(a,b,c,d,e,(f,g),h)"))
+        expandTree({tree: [0b11, 0b111, 0b1100000]})
+        self.assertEqual(str(tree), "(d,e,((f,g),h),(c,(a,b)))")
+
+
+class ReconcilerTiersTest(unittest.TestCase):
+
+    def setUp(self):
+        # a stand-in for PAUP* which never finishes
+        self.directory = tempfile.mkdtemp()
+        f = open(os.path.join(self.directory, "paup"), 'w')
+        f.write("#!/bin/sh\nexec sleep 30\n")
+        f.close()
+        os.chmod(os.path.join(self.directory, "paup"), 0o755)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = self.directory + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.directory)
+
+    def testFallbacksShareTimeLimit(self):
+        trees = [parse_tree("((0,1),(2,3),4)"), parse_tree("((0,2),(1,4),3)")]
+        options = makeOptions(reconciler = "gmrp", timeout = 1.0)
+        logger = Logger()
+        start = time.time()
+        self.assertEqual(reconcileTrees(trees, 5, options, logger), [])
+        self.assertTrue(time.time() - start < 1.6)
+        self.assertEqual(logger.timedOutPolytomies, 1)
+
+        self.assertEqual([(degree, fallback) for (degree, reconciler, fallback, seconds) in logger.fallbacks],
+                         [(5, "gmrp (10 ratchet iterations)"), (5, "unresolved")])
+        self.assertTrue(0.8 < logger.fallbacks[0][3] < 1.0)
+        self.assertTrue(sum([seconds for (degree, reconciler, fallback, seconds) in logger.fallbacks]) < 1.3)
+
+    def testFallbackReportsNodeDegree(self):
+        # a polytomy of five children below the root has degree six
+        tree = addDegreeInfo(parse_tree("((0,1,2,3,4),5,6)"))
+        (polytomy,) = [node for node in xfindPolytomies(tree)]
+        sourceTrees = [parse_tree("((0,1),(2,3),(4,5))"), parse_tree("((0,2),(1,4),(3,6))")]
+        logger = Logger()
+        refinePolytomy(polytomy, sourceTrees, logger, makeOptions(reconciler = "gmrp", timeout = 0.2))
+        self.assertEqual(polytomy.degree, 6)
+        self.assertEqual(logger.phases[0]["degree"], 6)
+        self.assertEqual([degree for (degree, reconciler, fallback, seconds) in logger.fallbacks], [6, 6])
+        self.assertEqual((logger.resolvablePolytomies, logger.timedOutPolytomies), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the interfaces with other software.
+'''
+
+import time
+import unittest
+
+from superfine.adapters import ReconcilerTimeout, call_command, stream_command
+
+
+class StreamCommandTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        lines = ("%d:%d,%d|%d,%d" % (i % 7, i, i + 1, i + 2, i + 3) for i in range(25000))
+        (output, err) = stream_command(["cat"], lines, chunk_size=1000)
+        self.assertEqual(output, '\n'.join(["%d:%d,%d|%d,%d" % (i % 7, i, i + 1, i + 2, i + 3)
+                                            for i in range(25000)]))
+        self.assertEqual(err, "")
+
+    def testConcurrentOutput(self):
+        # more output than a pipe buffer holds, produced while input is still being written
+        (output, err) = stream_command(["sed", "s/$/ padding padding padding/"], (str(i) for i in range(100000)))
+        self.assertEqual(len(output.splitlines()), 100000)
+
+    def testCommandQuitsEarly(self):
+        (output, err) = stream_command(["head", "-n", "1"], (str(i) for i in range(200000)))
+        self.assertEqual(output, "0\n")
+
+    def testMissingCommand(self):
+        self.assertRaises(SystemExit, stream_command, ["no-such-command-for-superfine"], ["1:0,1|2,3"])
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def testKilledAfterTimeout(self):
+        start = time.time()
+        self.assertRaises(ReconcilerTimeout, call_command, ["sleep", "10"], None, 0.2)
+        self.assertRaises(ReconcilerTimeout, stream_command, ["sleep", "10"], ["1:0,1|2,3"], timeout=0.2)
+        self.assertTrue(time.time() - start < 5)
+
+    def testFinishesInTime(self):
+        (output, err) = call_command(["cat"], b"0,1|2,3", 10)
+        self.assertEqual(output, b"0,1|2,3")
+        (output, err) = stream_command(["cat"], ["1:0,1|2,3"], timeout=10)
+        self.assertEqual(output, "1:0,1|2,3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of batch mode.
+'''
+
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from superfine.SuperFine import *
+from superfine.batch import SuperFineBatch, findInputs, runBatch
+from superfine.tests import installFindCut, makeOptions, randomTopology
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(5)
+        self.directory = tempfile.mkdtemp()
+        # many small source trees of a random tree leave polytomies, which the
+        #   stand-in for find-cut resolves (but for those of over 12 groups)
+        os.mkdir(os.path.join(self.directory, "bin"))
+        self.path = installFindCut(os.path.join(self.directory, "bin"), maxGroups = 12)
+        self.inputs = [self.writeUnresolved("sm_data.%d.source_trees" % dataset, 20 + 10 * dataset)
+                       for dataset in range(3)]
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.directory)
+
+    def writeSources(self, name, sources):
+        path = os.path.join(self.directory, name)
+        f = open(path, 'w')
+        for source in sources:
+            f.write(source + ";\n")
+        f.close()
+        return (path)
+
+    def writeUnresolved(self, name, numTaxa):
+        '''Write many small source trees of a random tree, which merge into a tree with polytomies.'''
+        taxa = ["t%d" % i for i in range(numTaxa)]
+        model = parse_tree(randomTopology(self.random, taxa))
+        return self.writeSources(name, [str(restrict(model, set(self.random.sample(taxa, 12)))) for i in range(20)])
+
+    def caterpillar(self, taxa):
+        tree = taxa[0]
+        for taxon in taxa[1:]:
+            tree = "(%s,%s)" % (tree, taxon)
+        return (tree)
+
+    def readOutput(self, input, name, suffix):
+        f = open(input.rpartition(".")[0] + "." + name + "." + suffix)
+        tree = f.read()
+        f.close()
+        return (tree)
+
+    def makeOptions(self, writeData, stats = None):
+        return makeOptions(writeData = writeData, jobs = 2, stats = stats)
+
+    def testFindInputs(self):
+        self.assertEqual(findInputs([os.path.join(self.directory, "sm_data.*.source_trees"), self.inputs[1]]),
+                         self.inputs)
+        self.assertRaises(IOError, findInputs, [os.path.join(self.directory, "*.tre")])
+
+    def testMatchesSingleRuns(self):
+        (loggers, errors) = runBatch(self.inputs, self.makeOptions("batch"))
+        self.assertEqual(errors, [None] * len(self.inputs))
+        for (input, logger) in zip(self.inputs, loggers):
+            SuperFine(input, self.makeOptions("single"))
+            for name in ("scmTree", "SuperFineTree"):
+                self.assertEqual(self.readOutput(input, name, "batch"), self.readOutput(input, name, "single"))
+            self.assertEqual([record["phase"] for record in logger.phases],
+                             ["read", "scm", "refine", "expand", "write"])
+            self.assertTrue(logger.phases[2]["polytomies"] > 0)
+            self.assertNotEqual(self.readOutput(input, "SuperFineTree", "batch"),
+                                self.readOutput(input, "scmTree", "batch"))
+
+    def testFailedDataset(self):
+        # source trees on disjoint taxa have no overlap to merge them by
+        disjoint = self.writeSources("disjoint.source_trees", ["((a,b),(c,d),e)", "((f,g),(h,i),j)"])
+        stats = os.path.join(self.directory, "stats.json")
+        (stderr, sys.stderr) = (sys.stderr, io.StringIO())
+        try:
+            failed = SuperFineBatch([disjoint] + self.inputs, self.makeOptions("tre", stats))
+            self.assertTrue(sys.stderr.getvalue().startswith("%s: failed: ValueError" % disjoint))
+        finally:
+            sys.stderr = stderr
+
+        self.assertEqual(failed, 1)
+        f = open(stats)
+        report = json.load(f)
+        f.close()
+        self.assertEqual(report["failed"], 1)
+        self.assertEqual([dataset["input"] for dataset in report["datasets"]], [disjoint] + self.inputs)
+        self.assertTrue("error" in report["datasets"][0])
+        for dataset in report["datasets"][1:]:
+            self.assertEqual(dataset["phases"][-1]["phase"], "write")
+            self.assertTrue(os.path.exists(dataset["input"].rpartition(".")[0] + ".SuperFineTree.tre"))
+
+    def testIsolatedFailures(self):
+        # a malformed input file fails to be read, and two caterpillars with no
+        #   split in common merge into a polytomy of 16 groups, which the
+        #   stand-in for find-cut fails on, amid the others' polytomies
+        malformed = self.writeSources("malformed.source_trees", ["((a,b),(c,d),e)", "((a,b),(c"])
+        order = list(range(0, 16, 2)) + list(range(1, 16, 2))
+        unresolved = self.writeSources("unresolved.source_trees", [self.caterpillar(["c%d" % i for i in range(16)]),
+                                                                   self.caterpillar(["c%d" % i for i in order])])
+        inputs = [self.inputs[0], malformed, self.inputs[1], unresolved, self.inputs[2]]
+
+        (loggers, errors) = runBatch(inputs, self.makeOptions("tre"))
+
+        self.assertTrue(errors[1].startswith("LexerError"))
+        self.assertTrue(errors[3].startswith("ValueError"))
+        self.assertEqual([record["phase"] for record in loggers[3].phases], ["read", "scm", "refine"])
+        for owner in (0, 2, 4):
+            self.assertEqual(errors[owner], None)
+            self.assertEqual(loggers[owner].phases[-1]["phase"], "write")
+            self.assertTrue(loggers[owner].phases[2]["polytomies"] > 0)
+            self.assertTrue(os.path.exists(inputs[owner].rpartition(".")[0] + ".SuperFineTree.tre"))
+        self.assertFalse(os.path.exists(unresolved.rpartition(".")[0] + ".SuperFineTree.tre"))
+
+    def testFreshProcess(self):
+        # the workers of runSuperFine.py fork before the source trees are put
+        #   in shared memory, and must not unlink them when they exit
+        stats = os.path.join(self.directory, "stats.json")
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              "runSuperFine.py")
+        run = subprocess.run([sys.executable, script, "--batch", "-j", "3", "--stats", stats,
+                              os.path.join(self.directory, "sm_data.*.source_trees")],
+                             stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        self.assertEqual(run.returncode, 0, run.stderr.decode())
+        self.assertFalse(b"leaked" in run.stderr)
+        f = open(stats)
+        report = json.load(f)
+        f.close()
+        self.assertEqual(report["failed"], 0)
+        for (input, dataset) in zip(self.inputs, report["datasets"]):
+            self.assertTrue(dataset["polytomies"]["resolvable"] > 0)
+            self.assertTrue(os.path.exists(input.rpartition(".")[0] + ".SuperFineTree.tre"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,290 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the checkpointing of SuperFine runs.
+'''
+
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+from superfine.SuperFine import *
+from superfine.checkpoint import Checkpoint, CheckpointError, Journal, findGroupKeys
+from superfine.relabeling import PolytomyIndex
+from superfine.tests import collapseEdges, installFindCut, makeOptions
+from spruce.tests import datasetPath
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(31)
+        self.directory = tempfile.mkdtemp()
+        self.input = datasetPath("simulated", "100-taxa", "50", "sm_data.4.source_trees")
+        self.sources = readMultipleTreesFromFile(self.input)
+        self.sourceTrees = [parse_tree(source) for source in self.sources]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def randomBipartitions(self, numChildren):
+        '''Return random bipartitions over a polytomy's children, as group bitmasks.'''
+        return [self.random.randint(1, (1 << numChildren) - 2) for i in range(self.random.randint(0, 3))]
+
+    def testRoundTrip(self):
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "50", "sm_data.4.model_tree"))
+        index = PolytomyIndex(collapseEdges(tree, self.random, 0.7), self.sourceTrees)
+        groupKeys = findGroupKeys(index)
+
+        checkpoint = Checkpoint(self.directory, self.input)
+        expected = []
+        for (polytomy, keys) in zip(index.polytomies, groupKeys):
+            self.assertEqual(checkpoint.restore(keys, "qmc"), (False, None))
+            bipartitions = self.randomBipartitions(len(polytomy.get_edges()))
+            if self.random.random() < 0.2:
+                bipartitions = None
+            checkpoint.record(keys, "qmc", bipartitions)
+            if bipartitions and len(keys) == len(polytomy.get_edges()):
+                # at the root, bipartitions come back oriented away from the last child
+                last = len(keys) - 1
+                bipartitions = [mask ^ ((1 << len(keys)) - 1) if mask >> last & 1 else mask
+                                for mask in bipartitions]
+            expected.append(bipartitions)
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.directory, self.input)
+        for (keys, bipartitions) in zip(groupKeys, expected):
+            self.assertEqual(checkpoint.restore(keys, "qmc"), (True, bipartitions))
+            self.assertEqual(checkpoint.restore(keys, "gmrp/100"), (False, None))
+        checkpoint.close()
+
+    def testRootingInvariance(self):
+        inner = PolytomyIndex(addDegreeInfo(parse_tree("((a,b),(c,d),((e,f),(g,h),(i,j),k))")), [])
+        root = PolytomyIndex(addDegreeInfo(parse_tree("((e,f),(g,h),(i,j),k,((a,b),(c,d)))")), [])
+        ([innerKeys], [rootKeys]) = (findGroupKeys(inner), findGroupKeys(root))
+        self.assertEqual(sorted(innerKeys), sorted(rootKeys))
+
+        checkpoint = Checkpoint(self.directory, self.input)
+        checkpoint.record(innerKeys, "qmc", [3, 12])    # ((e,f),(g,h)) and ((i,j),k)
+        self.assertEqual(checkpoint.restore(rootKeys, "qmc"), (True, [3, 12]))
+        checkpoint.record(rootKeys, "fml", [28])        # ((i,j),k,((a,b),(c,d)))
+        self.assertEqual(checkpoint.restore(innerKeys, "fml"), (True, [3]))
+        checkpoint.close()
+
+    def testJournalInMemory(self):
+        index = PolytomyIndex(addDegreeInfo(parse_tree("((a,b),(c,d),((e,f),(g,h),(i,j),k))")), [])
+        [keys] = findGroupKeys(index)
+        journal = Journal()
+        self.assertEqual(journal.restore(keys, "qmc"), (False, None))
+        journal.record(keys, "qmc", [3, 12])
+        journal.record(keys, "fml", None)
+        self.assertEqual(journal.restore(keys, "qmc"), (True, [3, 12]))
+        self.assertEqual(journal.restore(keys, "fml"), (True, None))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def testTreeAndJournal(self):
+        checkpoint = Checkpoint(self.directory, self.input)
+        self.assertEqual(checkpoint.loadTree(), None)
+        tree = mergeTrees(self.sourceTrees, None)
+        checkpoint.saveTree(tree)
+        checkpoint.record([1, 2, 3, 4], "qmc", [3])
+        checkpoint.close()
+
+        # a journal entry cut short by a crash is ignored
+        f = open(os.path.join(self.directory, "polytomies.jsonl"), 'a')
+        f.write('{"polytomy": "0123')
+        f.close()
+
+        checkpoint = Checkpoint(self.directory, self.input)
+        self.assertEqual(str(checkpoint.loadTree()), str(tree))
+        self.assertEqual(checkpoint.restore([4, 3, 2, 1], "qmc"), (True, [3]))
+        checkpoint.close()
+
+        otherInput = datasetPath("simulated", "100-taxa", "50", "sm_data.5.source_trees")
+        self.assertRaises(CheckpointError, Checkpoint, self.directory, otherInput)
+
+    def runSuperFine(self, input, jobs, update = None, checkpointDir = None, stats = None, timeout = None):
+        '''Run SuperFine on the input with the checkpoint; return what it prints to stdout and stderr.'''
+        options = makeOptions(verbose = True, jobs = jobs, checkpointDir = checkpointDir or self.directory,
+                              update = update, stats = stats, timeout = timeout)
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        (sys.stdout, sys.stderr) = (io.StringIO(), io.StringIO())
+        try:
+            SuperFine(input, options)
+            return (sys.stdout.getvalue(), sys.stderr.getvalue())
+        finally:
+            (sys.stdout, sys.stderr) = (stdout, stderr)
+
+    def writeSources(self, name, sources):
+        '''Write source trees (in Newick format) to a file in the checkpoint directory; return its path.'''
+        path = os.path.join(self.directory, name)
+        f = open(path, 'w')
+        for source in sources:
+            f.write(source.strip() + ";\n")
+        f.close()
+        return (path)
+
+    def journalRun(self, directory, input):
+        '''
+            Checkpoint a run on the input, journaling random bipartitions for
+            every polytomy, as if it had died just before expanding the tree.
+            Return the SuperFine tree the run would have found.
+        '''
+        sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(input)]
+        checkpoint = Checkpoint(directory, input)
+        tree = mergeTrees(sourceTrees, None)
+        checkpoint.saveTree(tree)
+        index = PolytomyIndex(tree, sourceTrees)
+        bipartitionsToAdd = {}
+        for (polytomy, keys) in zip(index.polytomies, findGroupKeys(index)):
+            bipartitions = self.randomBipartitions(len(polytomy.get_edges()))[:1] or None
+            checkpoint.record(keys, "qmc", bipartitions)
+            if bipartitions:
+                bipartitionsToAdd[polytomy] = bipartitions
+        checkpoint.close()
+        self.assertTrue(bipartitionsToAdd)
+        expandTree(bipartitionsToAdd)
+        return (tree)
+
+    def testResume(self):
+        tree = self.journalRun(self.directory, self.input)
+        numPolytomies = len(list(xfindPolytomies(mergeTrees(self.sourceTrees, None))))
+        for jobs in (1, 2):
+            stats = os.path.join(self.directory, "stats.json")
+            (output, log) = self.runSuperFine(self.input, jobs, stats = stats)
+            self.assertEqual(output, str(tree) + ";\n")
+            self.assertTrue("%d polytomies restored from checkpoint." % numPolytomies in log)
+
+            f = open(stats)
+            phases = json.load(f)["phases"]
+            f.close()
+            self.assertEqual([record["phase"] for record in phases], ["read", "scm", "refine", "expand", "write"])
+            self.assertEqual(phases[0]["trees"], len(self.sourceTrees))
+            self.assertEqual(phases[2]["polytomies"], numPolytomies)
+
+    def testResumeAfterTimeout(self):
+        # polytomies left unresolved when find-cut runs out of time are not
+        #   journaled, so a resumed run without the time limit resolves them
+        findCut = os.path.join(self.directory, "bin")
+        os.mkdir(findCut)
+        runs = [os.path.join(self.directory, "run%d" % jobs) for jobs in (1, 2)]
+        path = installFindCut(findCut, delay = 10)
+        try:
+            unresolved = [self.runSuperFine(self.input, jobs, checkpointDir = runs[jobs - 1], timeout = 0.2)[0]
+                          for jobs in (1, 2)]
+        finally:
+            os.environ["PATH"] = path
+
+        path = installFindCut(findCut)
+        try:
+            (expected, log) = self.runSuperFine(self.input, 1, checkpointDir = os.path.join(self.directory, "fresh"))
+            for jobs in (1, 2):
+                self.assertNotEqual(unresolved[jobs - 1], expected)
+                (output, log) = self.runSuperFine(self.input, jobs, checkpointDir = runs[jobs - 1])
+                self.assertEqual(output, expected)
+        finally:
+            os.environ["PATH"] = path
+
+    def testFindNewSources(self):
+        previousInput = self.writeSources("previous.tre", self.sources[:-2])
+        Checkpoint(os.path.join(self.directory, "previous"), previousInput).close()
+        previous = Checkpoint(os.path.join(self.directory, "previous"))
+        self.assertEqual(previous.findNewSources(previousInput), [])
+        self.assertEqual(previous.findNewSources(self.input), [len(self.sourceTrees) - 2, len(self.sourceTrees) - 1])
+        updatedInput = self.writeSources("updated.tre", self.sources + self.sources[1:2])
+        self.assertEqual(previous.findNewSources(updatedInput), list(range(len(self.sources) - 2, len(self.sources) + 1)))
+        self.assertRaises(CheckpointError, previous.findNewSources, self.writeSources("removed.tre", self.sources[1:]))
+
+        self.assertRaises(CheckpointError, Checkpoint, os.path.join(self.directory, "missing"))
+
+    def testReusePolytomies(self):
+        previousDirectory = os.path.join(self.directory, "previous")
+        previousInput = self.writeSources("previous.tre", self.sources[:-3])
+        self.journalRun(previousDirectory, previousInput)
+        previous = Checkpoint(previousDirectory)
+        newSources = previous.findNewSources(self.input)
+        previousTaxa = set(previous.loadTree().get_leaves_identifiers())
+
+        def findLeafBipartitions(index, bipartitions):
+            '''Map each polytomy's groups (restricted to the previous run's taxa) to its bipartitions' leaf sets.'''
+            leafBipartitions = {}
+            for (polytomy, (found, masks)) in zip(index.polytomies, bipartitions):
+                if not found:
+                    continue
+                groups = [frozenset(previousTaxa.intersection(leaves)) for leaves in index.childLeaves(polytomy)]
+                groups.append(frozenset(previousTaxa.difference(*groups)))
+                sides = []
+                for mask in masks or []:
+                    side = set().union(*[group for (i, group) in enumerate(groups) if mask >> i & 1])
+                    sides.append(frozenset(side if min(previousTaxa) in side else previousTaxa - side))
+                leafBipartitions[frozenset([group for group in groups if group])] = (masks is None, sorted(sides))
+            return (leafBipartitions)
+
+        previousTree = previous.loadTree()
+        previousIndex = PolytomyIndex(previousTree, self.sourceTrees[:-3])
+        previousPolytomies = findLeafBipartitions(previousIndex, [previous.restore(keys, "qmc") for keys in
+                                                                  findGroupKeys(previousIndex)])
+
+        tree = mergeNewTrees(previous.loadTree(), [self.sourceTrees[i] for i in newSources])
+        self.assertEqual(set(tree.get_leaves_identifiers()),
+                         set([leaf for source in self.sourceTrees for leaf in source.get_leaves_identifiers()]))
+        index = PolytomyIndex(tree, self.sourceTrees)
+        polytomyOptions = [makeOptions()] * len(index.polytomies)
+        logger = Logger()
+        (restored, groupKeys) = restorePolytomies(index, polytomyOptions, logger, None, previous, newSources)
+        previous.close()
+
+        reused = findLeafBipartitions(index, restored)
+        self.assertTrue(0 < len(reused) < len(index.polytomies))
+        self.assertEqual(logger.reusedPolytomies, len(reused))
+        for (groups, bipartitions) in reused.items():
+            self.assertEqual(bipartitions, previousPolytomies[groups])
+        for (polytomy, (found, masks)) in zip(index.polytomies, restored):
+            if found:
+                self.assertFalse(set(newSources) & set(index.informativeSources(polytomy)))
+
+    def testUpdate(self):
+        previousDirectory = os.path.join(self.directory, "previous")
+        tree = self.journalRun(previousDirectory, self.input)
+        numPolytomies = len(list(xfindPolytomies(mergeTrees(self.sourceTrees, None))))
+
+        # a new source tree too small to inform any polytomy leaves them all to be reused
+        leaves = self.sourceTrees[0].get_leaves_identifiers()
+        input = self.writeSources("updated.tre", self.sources + ["(%s,%s,%s)" % tuple(leaves[:3])])
+        for jobs in (1, 2):
+            checkpointDir = os.path.join(self.directory, "updated%d" % jobs)
+            (output, log) = self.runSuperFine(input, jobs, previousDirectory, checkpointDir)
+            self.assertEqual(output, str(tree) + ";\n")
+            self.assertTrue("1 new source trees merged; 0 of %d polytomies recomputed, %d reused."
+                            % (numPolytomies, numPolytomies) in log)
+
+            # the updated run's checkpoint holds the reused polytomies
+            (output, log) = self.runSuperFine(input, jobs, None, checkpointDir)
+            self.assertEqual(output, str(tree) + ";\n")
+            self.assertTrue("%d polytomies restored from checkpoint." % numPolytomies in log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the run report and of the phase records.
+'''
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from superfine.adapters import call_command, command_observers
+from superfine.logger import Logger
+
+
+class PhaseTest(unittest.TestCase):
+
+    def testNestedPhases(self):
+        logger = Logger()
+        with logger.phase("read") as record:
+            record["trees"] = 3
+        with logger.phase("refine", polytomies = 2):
+            for degree in (4, 5):
+                with logger.phase("polytomy", degree = degree):
+                    with logger.phase("encode", quartets = degree * 10):
+                        time.sleep(0.01)
+
+        self.assertEqual([record["phase"] for record in logger.phases], ["read", "refine"])
+        self.assertEqual(logger.phases[0]["trees"], 3)
+        polytomies = logger.phases[1]["steps"]
+        self.assertEqual([(record["degree"], record["steps"][0]["quartets"]) for record in polytomies],
+                         [(4, 40), (5, 50)])
+        for record in polytomies:
+            self.assertTrue(record["wallSeconds"] >= record["steps"][0]["wallSeconds"] >= 0.01)
+            self.assertTrue(record["cpuSeconds"] >= 0)
+            if record["peakRssKb"] != None:
+                self.assertTrue(record["peakRssKb"] > 0)
+
+    def testFailedPhase(self):
+        logger = Logger()
+        try:
+            with logger.phase("reconcile"):
+                raise KeyError("cancelled")
+        except KeyError:
+            pass
+        self.assertEqual(logger.phases[0]["error"], "KeyError")
+        self.assertTrue("wallSeconds" in logger.phases[0])
+
+        with logger.phase("decode"):
+            pass
+        self.assertEqual([record["phase"] for record in logger.phases], ["reconcile", "decode"])
+
+    def testMergeWorkerPhases(self):
+        (logger, worker) = (Logger(), Logger())
+        with worker.phase("polytomy", degree = 6):
+            worker.logInfo(10)
+        with logger.phase("refine"):
+            logger.merge(worker)
+        logger.merge(worker)
+        self.assertEqual(logger.resolvablePolytomies, 2)
+        self.assertEqual([record["phase"] for record in logger.phases], ["refine", "polytomy"])
+        self.assertEqual(logger.phases[0]["steps"][0]["degree"], 6)
+
+    def testWriteStats(self):
+        directory = tempfile.mkdtemp()
+        try:
+            logger = Logger()
+            with logger.phase("scm", trees = 5):
+                logger.logInfo(0)
+            logger.logFallback(7, "gmrp (100 ratchet iterations)", "gmrp (10 ratchet iterations)", 2.5)
+            logger.writeStats(os.path.join(directory, "stats.json"), "input.tre")
+            f = open(os.path.join(directory, "stats.json"))
+            stats = json.load(f)
+            f.close()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(stats["input"], "input.tre")
+        self.assertEqual(stats["polytomies"]["unresolvable"], 1)
+        self.assertEqual(stats["phases"][0]["phase"], "scm")
+        self.assertEqual(stats["phases"][0]["trees"], 5)
+        self.assertEqual(stats["polytomies"]["fallbacks"], 1)
+        self.assertEqual(stats["fallbacks"], [{"degree": 7, "reconciler": "gmrp (100 ratchet iterations)",
+                                               "fallback": "gmrp (10 ratchet iterations)", "seconds": 2.5}])
+
+
+    def testPrintTimedOut(self):
+        logger = Logger()
+        for quartets in (10, 0, 12, 8):
+            logger.logInfo(quartets)
+        logger.logFallback(7, "qmc", "unresolved", 2.5)
+        logger.logTimedOut()
+        (stderr, sys.stderr) = (sys.stderr, io.StringIO())
+        try:
+            logger.printInfo()
+            lines = sys.stderr.getvalue().splitlines()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(lines, ["2 polytomies successfully resolved.",
+                                 "1 polytomy left unresolved: every reconciler ran out of time.",
+                                 "1 polytomy could *not* be resolved.",
+                                 "Polytomy of degree 7: qmc cancelled after 2.5 seconds; fell back to unresolved."])
+        self.assertEqual(logger.getStats(None)["polytomies"]["timedOut"], 1)
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def readTrace(self, logger):
+        file = os.path.join(self.directory, "trace.json")
+        logger.writeTrace(file)
+        f = open(file)
+        trace = json.load(f)
+        f.close()
+        return (trace["traceEvents"])
+
+    def testPhaseEvents(self):
+        logger = Logger()
+        with logger.phase("scm"):
+            pass
+        self.assertEqual(logger.events, None)
+
+        logger.startTrace()
+        with logger.phase("refine", polytomies = 1):
+            with logger.phase("polytomy", degree = 5):
+                time.sleep(0.01)
+        events = [event for event in self.readTrace(logger) if event["ph"] == "X"]
+        self.assertEqual([event["name"] for event in events], ["refine", "polytomy"])
+        (refine, polytomy) = events
+        self.assertEqual(polytomy["args"]["degree"], 5)
+        self.assertFalse("steps" in refine["args"])
+        self.assertTrue(refine["ts"] <= polytomy["ts"])
+        self.assertTrue(polytomy["ts"] + polytomy["dur"] <= refine["ts"] + refine["dur"] + 1)
+        self.assertTrue(polytomy["dur"] >= 10000)
+
+    def testCommandEvents(self):
+        logger = Logger()
+        logger.startTrace()
+        command_observers.append(logger.logCommand)
+        try:
+            with logger.phase("reconcile"):
+                call_command([sys.executable, "-c", "import sys; sys.exit(3)"], b"")
+        finally:
+            command_observers.remove(logger.logCommand)
+
+        events = self.readTrace(logger)
+        (command,) = [event for event in events if event.get("cat") == "process"]
+        self.assertEqual(command["args"]["exitCode"], 3)
+        self.assertEqual(command["tid"], command["args"]["pid"])
+        self.assertTrue(command["tid"] != os.getpid())
+        names = [event["args"]["name"] for event in events if event["name"] == "thread_name"]
+        self.assertTrue("%s (pid %d)" % (command["name"], command["tid"]) in names)
+
+    def testMergeWorkerEvents(self):
+        (logger, worker) = (Logger(), Logger())
+        logger.startTrace()
+        worker.startTrace()
+        with worker.phase("polytomy"):
+            pass
+        for event in worker.events:
+            event["pid"] = event["tid"] = os.getpid() + 1
+        with logger.phase("refine"):
+            logger.merge(worker)
+
+        events = self.readTrace(logger)
+        self.assertEqual(sorted([event["name"] for event in events if event["ph"] == "X"]), ["polytomy", "refine"])
+        self.assertEqual(sorted([event["args"]["name"] for event in events if event["name"] == "process_name"]),
+                         ["superfine", "worker %d" % (os.getpid() + 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the parallel refinement of the SCM tree.
+'''
+
+import glob
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from multiprocessing import Pool
+
+from superfine.SuperFine import *
+from superfine.parallel import Refinement, _setSourceTrees, relabelRefinements, runRefinements, splitSources
+from superfine.profiling import Profiler
+from superfine.relabeling import PolytomyIndex
+from superfine.tests import collapseEdges, installFindCut, makeOptions, randomTopology
+from spruce.tests import datasetPath
+
+
+class RefinementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(
+            datasetPath("simulated", "100-taxa", "75", "sm_data.3.source_trees"))]
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "75", "sm_data.3.model_tree"))
+        self.index = PolytomyIndex(collapseEdges(tree, random.Random(29), 0.7), self.sourceTrees)
+        # the workers find the stand-in for find-cut on the PATH they start with
+        self.directory = tempfile.mkdtemp()
+        self.path = installFindCut(self.directory)
+        self.pool = Pool(2, _setSourceTrees, (self.sourceTrees,))
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.directory)
+
+    def makeRefinement(self, encode, logger = None):
+        polytomyOptions = [makeOptions(reconciler = "qmc" if encoded else "gmrp") for encoded in encode]
+        return Refinement(self.index, polytomyOptions, [(False, None)] * len(encode), logger or Logger())
+
+    def relabel(self, encode, logger = None):
+        '''Relabel the source trees of every polytomy on the pool; return the merged results of each one.'''
+        refinement = self.makeRefinement(encode, logger)
+        relabelRefinements(self.pool, [refinement], 2)
+        return (refinement.results)
+
+    def testSplitSources(self):
+        chunks = splitSources(self.index, 2)
+        for (position, polytomy) in enumerate(self.index.polytomies):
+            sources = [i for (chunkPosition, sourceIndices) in chunks if chunkPosition == position
+                         for i in sourceIndices]
+            self.assertEqual(sorted(sources), self.index.informativeSources(polytomy))
+
+    def testMatchesSerialEncoding(self):
+        results = self.relabel([True] * len(self.index.polytomies))
+        for (polytomy, quartetTrees) in zip(self.index.polytomies, results):
+            (expected, delabeling) = encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+            self.assertEqual(removeUninformativeQTrees(dict(quartetTrees)), expected)
+
+        # the chunks are merged in the same order whatever order they come back in
+        again = self.relabel([True] * len(self.index.polytomies))
+        self.assertEqual([list(quartetTrees) for quartetTrees in again],
+                         [list(quartetTrees) for quartetTrees in results])
+
+    def testMatchesSerialRelabeling(self):
+        results = self.relabel([False] * len(self.index.polytomies))
+        for (polytomy, trees) in zip(self.index.polytomies, results):
+            (expected, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+            self.assertEqual([str(tree) for tree in removeUninformativeRelabeledTrees(trees)],
+                             [str(tree) for tree in expected])
+
+    def testMixedReconcilers(self):
+        encode = [position % 2 == 0 for position in range(len(self.index.polytomies))]
+        results = self.relabel(encode)
+        for (polytomy, result, encoded) in zip(self.index.polytomies, results, encode):
+            if encoded:
+                (expected, delabeling) = encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+                self.assertEqual(removeUninformativeQTrees(dict(result)), expected)
+            else:
+                (expected, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+                self.assertEqual([str(tree) for tree in result], [str(tree) for tree in expected])
+
+    def testMatchesSerialRefinement(self):
+        refinement = self.makeRefinement([True] * len(self.index.polytomies))
+        (bipartitionsToAdd,) = runRefinements(self.pool, [refinement], 2)
+        self.assertTrue(bipartitionsToAdd)
+        for polytomy in self.index.polytomies:
+            expected = refinePolytomy(polytomy, self.sourceTrees, Logger(), makeOptions(), self.index)
+            self.assertEqual(bipartitionsToAdd.get(polytomy), expected)
+        # the log of each polytomy reconciled on a worker is merged after the relabeling
+        self.assertEqual([record["phase"] for record in refinement.logger.phases],
+                         ["relabel"] + ["polytomy"] * len(refinement.reconciled))
+
+    def testProfiledWorkers(self):
+        logger = Logger()
+        logger.profiler = Profiler()
+        encode = [True] * len(self.index.polytomies)
+        with logger.phase("refine"):
+            results = self.relabel(encode, logger)
+
+        self.assertEqual(results, self.relabel(encode))
+        # a profiler without a directory keeps its own top-level regions as a worker's
+        profiler = logger.profiler
+        workers = [worker for worker in profiler.workers if worker != os.getpid()]
+        self.assertTrue(0 < len(workers) <= 2)
+        for worker in workers:
+            self.assertTrue([function for function in profiler.workers[worker]
+                             if function[2] == "findDisplayedQtrees"])
+
+    def testTracedWorkers(self):
+        logger = Logger()
+        logger.startTrace()
+        results = self.relabel([False] * len(self.index.polytomies), logger)
+
+        self.assertEqual(len(results), len(self.index.polytomies))
+        chunks = [event for event in logger.events if event["name"] == "relabel" and event["pid"] != os.getpid()]
+        self.assertEqual(sorted(set([event["args"]["polytomy"] for event in chunks])),
+                         list(range(len(self.index.polytomies))))
+        self.assertEqual(sum([event["args"]["trees"] for event in chunks]),
+                         sum([len(trees) for trees in results]))
+        self.assertEqual(logger.phases[0]["phase"], "relabel")
+        self.assertEqual(len(logger.phases[0]["steps"]), len(chunks))
+
+
+class ReconcileInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # many small source trees, none of them on all the taxa, leave large
+        #   polytomies, whose source trees are relabeled in several chunks
+        rng = random.Random(5)
+        taxa = ["t%d" % i for i in range(60)]
+        model = parse_tree(randomTopology(rng, taxa))
+        self.input = os.path.join(self.directory, "sm_data.source_trees")
+        f = open(self.input, 'w')
+        for i in range(40):
+            f.write(str(restrict(model, set(rng.sample(taxa, 12)))) + ";\n")
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def findCutInputs(self, jobs):
+        '''Run SuperFine with QMC on the given number of jobs; return the inputs find-cut was given, sorted.'''
+        directory = tempfile.mkdtemp(dir = self.directory)
+        path = installFindCut(directory, directory)
+        options = makeOptions(jobs = jobs)
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            SuperFine(self.input, options)
+        finally:
+            (sys.stdout, os.environ["PATH"]) = (stdout, path)
+
+        inputs = []
+        for name in glob.glob(os.path.join(directory, "*.quartets")):
+            f = open(name)
+            inputs.append(f.read())
+            f.close()
+        return sorted(inputs)
+
+    def testSameInputOnAnyJobs(self):
+        inputs = self.findCutInputs(1)
+        self.assertTrue(len(inputs) > 1)
+        for attempt in range(2):
+            self.assertEqual(self.findCutInputs(4), inputs)
+
+
+if __name__ == "__main__":
+    unittest.main()
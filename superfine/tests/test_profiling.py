@@ -0,0 +1,132 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the profiling of SuperFine runs.
+'''
+
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from superfine.logger import Logger
+from superfine.profiling import Profiler, collapseStacks
+
+
+def spin(seconds):
+    '''Keep the CPU busy for the given time.'''
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def encode():
+    spin(0.03)
+
+
+def reconcile():
+    spin(0.01)
+    encode()
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testStagesAndPolytomies(self):
+        logger = Logger()
+        logger.profiler = Profiler(self.directory, 2)
+        with logger.phase("read"):
+            encode()
+        with logger.phase("refine"):
+            # times far enough apart to rank the polytomies on a loaded machine
+            for (degree, seconds) in ((4, 0.01), (5, 0.1), (6, 0.3)):
+                with logger.phase("polytomy", degree = degree):
+                    with logger.phase("reconcile"):
+                        spin(seconds)
+            reconcile()
+        logger.profiler.close()
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["%s.%s" % (name, extension)
+                          for name in ("polytomy-01-degree6", "polytomy-02-degree5", "read", "refine")
+                          for extension in ("collapsed", "pstats")])
+
+        # the refinement stage includes its polytomies
+        stats = pstats.Stats(os.path.join(self.directory, "refine.pstats")).stats
+        calls = dict([(function[2], record[1]) for (function, record) in stats.items()])
+        self.assertEqual(calls["spin"], 5)
+        self.assertEqual(calls["reconcile"], 1)
+
+        f = open(os.path.join(self.directory, "refine.collapsed"))
+        stacks = [line.rsplit(" ", 1) for line in f.read().splitlines()]
+        f.close()
+        self.assertTrue([stack for (stack, microseconds) in stacks
+                         if "reconcile (test_profiling.py:46);encode (test_profiling.py:42)" in stack])
+        self.assertTrue(all([int(microseconds) > 0 for (stack, microseconds) in stacks]))
+
+    def testWorkerProfiles(self):
+        worker = Logger()
+        worker.profiler = Profiler(None, 1)
+        with worker.phase("polytomy", degree = 7):
+            reconcile()
+
+        logger = Logger()
+        logger.profiler = Profiler(self.directory, 1)
+        with logger.phase("refine"):
+            logger.merge(worker)
+        logger.profiler.close()
+
+        self.assertEqual(logger.profiler.polytomies[0][3], 7)
+        for name in ("refine", "polytomy-01-degree7", "worker-%d" % os.getpid()):
+            stats = pstats.Stats(os.path.join(self.directory, name + ".pstats")).stats
+            self.assertTrue([function for function in stats if function[2] == "reconcile"])
+
+    def testCollapseStacks(self):
+        from cProfile import Profile
+        profile = Profile()
+        profile.enable()
+        reconcile()
+        encode()
+        profile.disable()
+        profile.create_stats()
+
+        stacks = collapseStacks(profile.stats)
+        # the stacks split up the time spent in the profiled functions, with
+        #   none counted twice
+        total = sum(stacks.values())
+        profiled = sum([tt for (cc, nc, tt, ct, callers) in profile.stats.values()])
+        self.assertTrue(total >= 0.07)
+        self.assertAlmostEqual(total, profiled, delta = 0.01 * profiled)
+        # encode() was called once by reconcile(), and once from outside the profiled code
+        underReconcile = sum([seconds for (stack, seconds) in stacks.items() if stack.startswith("reconcile (")])
+        underEncode = sum([seconds for (stack, seconds) in stacks.items() if stack.startswith("encode (")])
+        self.assertTrue(underReconcile >= 0.035)
+        self.assertTrue(underEncode >= 0.025)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the relabeled views of source trees.
+'''
+
+import copy
+import random
+import unittest
+
+from superfine.SuperFine import *
+from superfine.relabeling import RelabeledView, PolytomyIndex
+from superfine.tests import collapseEdges
+from spruce.tests import datasetPath
+
+
+def copyingRelabelTree(source, relabeling):
+    '''Reference relabeling of a deep copy of the source tree.'''
+    sourceTree = copy.deepcopy(source)
+    defaultLabel = len(set(relabeling.values()))
+
+    for leaf in sourceTree.get_leaves():
+        leaf.set_leaf_identifier(relabeling.get(leaf.identifier, defaultLabel))
+    return (sourceTree)
+
+
+class RelabeledViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(17)
+        self.sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(
+            datasetPath("simulated", "100-taxa", "50", "sm_data.1.source_trees"))]
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "50", "sm_data.1.model_tree"))
+        self.polytomies = list(xfindPolytomies(collapseEdges(tree, self.random, 0.7)))
+
+    def testSmallTree(self):
+        source = parse_tree("((a:1,b:2)90:3,(c,(d,e)),f)")
+        view = RelabeledView(source, {"a": 0, "b": 0, "c": 1, "d": 2}, 3)
+        self.assertEqual(view.labels(), [0, 0, 1, 2, 3, 3])
+        self.assertTrue(view.isInformative())
+        self.assertEqual(str(view.materialize()), "((0:1.0,0:2.0)90.0:3.0,(1,(2,3)),3)")
+        self.assertEqual(str(source), "((a:1.0,b:2.0)90.0:3.0,(c,(d,e)),f)")
+        self.assertFalse(RelabeledView(source, {"a": 0, "c": 1}, 2).isInformative())
+
+    def testMatchesCopyingRelabeling(self):
+        for polytomy in self.polytomies:
+            (relabeling, delabeling) = buildRelabeling(polytomy)
+            for source in self.sourceTrees:
+                expected = copyingRelabelTree(source, relabeling)
+                self.assertEqual(str(relabelTree(source, relabeling)), str(expected))
+
+                view = RelabeledView(source, relabeling, len(delabeling))
+                self.assertEqual(view.labels(), expected.get_leaves_identifiers())
+                self.assertEqual(view.isInformative(), len(collapseTree(expected).get_leaves_identifiers()) > 0)
+
+    def testRelabelAndEncodeSourceTrees(self):
+        for polytomy in self.polytomies:
+            (relabeling, delabeling) = buildRelabeling(polytomy)
+            expectedTrees = removeUninformativeRelabeledTrees(
+                [collapseTree(copyingRelabelTree(source, relabeling)) for source in self.sourceTrees])
+            (newSourceTrees, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+            self.assertEqual([str(tree) for tree in newSourceTrees], [str(tree) for tree in expectedTrees])
+
+            expectedQuartets = {}
+            for tree in expectedTrees:
+                addQuartets(expectedQuartets, findDisplayedQtrees(tree))
+            (quartetTrees, delabeling) = encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+            self.assertEqual(quartetTrees, removeUninformativeQTrees(expectedQuartets))
+
+
+class PolytomyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(23)
+        self.sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(
+            datasetPath("simulated", "100-taxa", "75", "sm_data.2.source_trees"))]
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "75", "sm_data.2.model_tree"))
+        self.tree = collapseEdges(tree, self.random, 0.7)
+        self.index = PolytomyIndex(self.tree, self.sourceTrees)
+
+    def testMatchesRelabeling(self):
+        self.assertEqual(self.index.polytomies, list(xfindPolytomies(self.tree)))
+        for polytomy in self.index.polytomies:
+            (relabeling, delabeling) = buildRelabeling(polytomy)
+            self.assertEqual(self.index.getRelabeling(polytomy), (relabeling, delabeling))
+
+            for (identifier, taxonId) in self.index.taxonIds.items():
+                self.assertEqual(self.index.group(polytomy, taxonId), relabeling.get(identifier, len(delabeling)))
+
+            informative = [i for (i, source) in enumerate(self.sourceTrees)
+                           if RelabeledView(source, relabeling, len(delabeling)).isInformative()]
+            self.assertEqual(self.index.informativeSources(polytomy), informative)
+
+    def testSourceOnlyTaxa(self):
+        sourceTrees = [parse_tree("((a,b),(c,d),(x,y))"), parse_tree("(a,c,e)")]
+        index = PolytomyIndex(addDegreeInfo(parse_tree("(a,b,c,d,(e,f))")), sourceTrees)
+        self.assertEqual(sorted(index.taxonIds.keys()), ["a", "b", "c", "d", "e", "f", "x", "y"])
+        self.assertEqual(index.informativeSources(index.tree), [0])
+        self.assertEqual(index.group(index.tree, index.taxonIds["x"]), 5)
+        self.assertEqual(index.group(index.tree, index.taxonIds["e"]), 4)
+
+    def testRelabelAndEncodeSourceTrees(self):
+        for polytomy in self.index.polytomies:
+            (expectedTrees, expectedDelabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+            (newSourceTrees, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None, self.index)
+            self.assertEqual([str(tree) for tree in newSourceTrees], [str(tree) for tree in expectedTrees])
+            self.assertEqual(delabeling, expectedDelabeling)
+
+            self.assertEqual(encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None, self.index),
+                             encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the rule tables picking each polytomy's reconciler.
+'''
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from superfine.SuperFine import *
+from superfine.selection import DEFAULT_RULES, validateRules, readRules, matchRule
+from superfine.tests import collapseEdges, makeOptions
+from spruce.tests import datasetPath
+
+
+class RulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testValidateRules(self):
+        self.assertEqual(validateRules(DEFAULT_RULES), DEFAULT_RULES)
+        for rules in ([], {"reconciler": "qmc"}, [{"maxDegree": 10}], [{"reconciler": "nj"}],
+                      [{"maxDegree": 10, "reconciler": "qmc"}],
+                      [{"maxDepth": 10, "reconciler": "qmc"}, {"reconciler": "fml"}],
+                      [{"maxDegree": "10", "reconciler": "qmc"}, {"reconciler": "fml"}],
+                      [{"maxDegree": -1, "reconciler": "qmc"}, {"reconciler": "fml"}],
+                      [{"minSources": True, "reconciler": "qmc"}, {"reconciler": "fml"}],
+                      [{"maxQuartets": None, "reconciler": "qmc"}, {"reconciler": "fml"}]):
+            self.assertRaises(ValueError, validateRules, rules)
+
+    def testMatchRule(self):
+        rules = [{"minSources": 2, "maxDegree": 15, "maxQuartets": 100, "reconciler": "qmc"},
+                 {"maxDegree": 60, "reconciler": "gmrp"},
+                 {"reconciler": "fml"}]
+        self.assertEqual(matchRule(rules, 15, 2, 100), "qmc")
+        self.assertEqual(matchRule(rules, 15, 1, 100), "gmrp")
+        self.assertEqual(matchRule(rules, 15, 2, 101), "gmrp")
+        self.assertEqual(matchRule(rules, 16, 2, 0), "gmrp")
+        self.assertEqual(matchRule(rules, 61, 2, 0), "fml")
+
+    def testReadRules(self):
+        rules = [{"maxDegree": 31, "reconciler": "qmc"}, {"reconciler": "gmrp"}]
+        for (name, contents) in (("rules.json", rules), ("report.json", {"buckets": [], "rules": rules})):
+            f = open(os.path.join(self.directory, name), 'w')
+            json.dump(contents, f)
+            f.close()
+            self.assertEqual(readRules(os.path.join(self.directory, name)), rules)
+
+        f = open(os.path.join(self.directory, "invalid.json"), 'w')
+        json.dump([{"maxDegree": 31, "reconciler": "qmc"}], f)
+        f.close()
+        self.assertRaises(ValueError, readRules, os.path.join(self.directory, "invalid.json"))
+
+
+class ChooseReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(
+            datasetPath("simulated", "100-taxa", "75", "sm_data.2.source_trees"))]
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "75", "sm_data.2.model_tree"))
+        self.index = PolytomyIndex(collapseEdges(tree, random.Random(29), 0.8), self.sourceTrees)
+
+    def testEstimateQuartets(self):
+        for polytomy in self.index.polytomies:
+            (newSourceTrees, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None, self.index)
+            counts = [len(set(tree.get_leaves_identifiers())) for tree in newSourceTrees]
+            self.assertEqual(self.index.estimateQuartets(polytomy),
+                             sum([count * (count - 1) * (count - 2) * (count - 3) // 24 for count in counts]))
+
+    def testChooseReconciler(self):
+        options = makeOptions(reconciler = "gmrp")
+        polytomy = self.index.polytomies[0]
+        self.assertTrue(chooseReconciler(polytomy, self.index, options) is options)
+
+        options.reconciler = "auto"
+        options.reconcilerRules = [{"maxDegree": 7, "reconciler": "qmc"}, {"reconciler": "fml"}]
+        logger = Logger()
+        degrees = [polytomy.degree for polytomy in self.index.polytomies]
+        chosen = [chooseReconciler(polytomy, self.index, options, logger).reconciler
+                  for polytomy in self.index.polytomies]
+        self.assertEqual(chosen, [(degree <= 7 and "qmc" or "fml") for degree in degrees])
+        self.assertEqual(logger.choices, list(zip(degrees, chosen)))
+        self.assertEqual(options.reconciler, "auto")
+
+        options.reconcilerRules = None
+        for polytomy in self.index.polytomies:
+            self.assertEqual(chooseReconciler(polytomy, self.index, options).reconciler,
+                             matchRule(DEFAULT_RULES, polytomy.degree,
+                                       len(self.index.informativeSources(polytomy)),
+                                       self.index.estimateQuartets(polytomy)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of server mode.
+'''
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from superfine.SuperFine import *
+from superfine.server import SuperFineServer, submitJob
+from superfine.sharedtrees import isAvailable
+from superfine.tests import installFindCut, makeOptions, randomTopology
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(11)
+        self.directory = tempfile.mkdtemp()
+        # many small source trees, none of them on all the taxa, leave
+        #   polytomies in the SCM tree, which the workers reconcile with a
+        #   stand-in for find-cut
+        self.trees = self.makeTrees()
+        self.findCut = os.path.join(self.directory, "find-cut")
+        os.mkdir(self.findCut)
+        self.path = installFindCut(self.findCut, self.findCut)
+
+        self.socket = os.path.join(self.directory, "superfine.sock")
+        self.server = SuperFineServer(self.socket, self.makeOptions())
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.directory)
+
+    def makeTrees(self):
+        taxa = ["t%d" % i for i in range(40)]
+        model = parse_tree(randomTopology(self.random, taxa))
+        return [str(restrict(model, set(self.random.sample(taxa, 12)))) for i in range(20)]
+
+    def makeOptions(self, writeData = None):
+        return makeOptions(writeData = writeData, jobs = 2, maxJobs = 2, maxQueued = 1)
+
+    def countFindCuts(self):
+        return len([name for name in os.listdir(self.findCut) if name.endswith(".quartets")])
+
+    def runSingle(self, trees):
+        '''Return the SCM and SuperFine trees of a single run on the source trees.'''
+        input = os.path.join(self.directory, "sm_data.source_trees")
+        f = open(input, 'w')
+        f.write("".join([tree + ";\n" for tree in trees]))
+        f.close()
+        SuperFine(input, self.makeOptions("single"))
+        outputs = []
+        for name in ("scmTree", "SuperFineTree"):
+            f = open(os.path.join(self.directory, "sm_data.%s.single" % name))
+            outputs.append(f.read().strip())
+            f.close()
+        return (outputs)
+
+    def testStreamsTrees(self):
+        (scmTree, superFineTree) = self.runSingle(self.trees)
+        self.assertNotEqual(scmTree, superFineTree)
+        findCuts = self.countFindCuts()
+        events = list(submitJob(self.socket, self.trees, stats = True))
+        self.assertEqual([event["event"] for event in events], ["accepted", "scm", "result"])
+        self.assertEqual(events[1]["tree"], scmTree)
+        self.assertEqual(events[2]["tree"], superFineTree)
+        stats = events[2]["stats"]
+        self.assertEqual([record["phase"] for record in stats["phases"]], ["read", "scm", "refine", "expand"])
+        self.assertFalse(stats["phases"][0]["cached"])
+        polytomies = stats["phases"][2]["polytomies"]
+        self.assertEqual(self.countFindCuts(), 2 * findCuts)
+        self.assertEqual(stats["polytomies"]["restored"], 0)
+
+        # a resubmitted job reuses the parsed source trees, the SCM tree and
+        #   the resolved polytomies, and calls no reconciler
+        events = list(submitJob(self.socket, self.trees, stats = True))
+        self.assertEqual(events[2]["tree"], superFineTree)
+        stats = events[2]["stats"]
+        self.assertTrue(stats["phases"][0]["cached"])
+        self.assertTrue(stats["phases"][1]["cached"])
+        self.assertEqual(stats["polytomies"]["restored"], polytomies)
+        self.assertEqual(self.countFindCuts(), 2 * findCuts)
+
+    def isLinked(self, name):
+        '''Return True if there is a block of shared memory of the given name.'''
+        from multiprocessing import shared_memory
+        try:
+            shared_memory.SharedMemory(name = name).close()
+        except FileNotFoundError:
+            return False
+        return True
+
+    @unittest.skipUnless(isAvailable(), "no shared memory")
+    def testReleasesStores(self):
+        self.server.stores.size = 1
+        events = list(submitJob(self.socket, self.trees))
+        self.assertEqual(events[-1]["event"], "result")
+        (shared,) = self.server.stores.entries.values()
+        self.assertEqual(shared.jobs, 0)
+        self.assertTrue(self.isLinked(shared.store.memory.name))
+
+        # the source trees of another job evict the first job's from the cache
+        events = list(submitJob(self.socket, self.makeTrees()))
+        self.assertEqual(events[-1]["event"], "result")
+        self.assertFalse(self.isLinked(shared.store.memory.name))
+        (other,) = self.server.stores.entries.values()
+        self.assertTrue(self.isLinked(other.store.memory.name))
+        self.server.server_close()
+        self.assertFalse(self.isLinked(other.store.memory.name))
+
+    def testRejectsMalformedJobs(self):
+        for (trees, options) in [([], {}), (self.trees, {"jobs": 4}), (self.trees, {"reconciler": "nj"}),
+                                 (self.trees, {"numIters": "many"}), (self.trees, {"numIters": True}),
+                                 (self.trees, {"numIters": -5}), (self.trees, {"timeout": False}),
+                                 (self.trees, {"timeout": -1.5})]:
+            events = list(submitJob(self.socket, trees, options))
+            self.assertEqual([event["event"] for event in events], ["error"])
+
+        events = list(submitJob(self.socket, ["((a,b),(c,d),e)", "((f,g),(h,i),j)"]))
+        self.assertEqual([event["event"] for event in events], ["accepted", "error"])
+        self.assertTrue(events[1]["error"].startswith("ValueError"))
+
+    def testTurnsDownJobsWhenBusy(self):
+        # with find-cut slowed down, four jobs sent at once find both slots
+        #   taken and the one place to wait in, so the last one is turned down
+        installFindCut(self.findCut, self.findCut, 0.5)
+        (lock, running) = (threading.Lock(), [0, 0])     # jobs running now, and at most
+        runJob = self.server.runJob
+        def countJobs(*args):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            try:
+                return runJob(*args)
+            finally:
+                with lock:
+                    running[0] -= 1
+        self.server.runJob = countJobs
+
+        jobs = [self.trees] + [self.makeTrees() for i in range(3)]
+        events = [None] * len(jobs)
+        def submit(i):
+            events[i] = list(submitJob(self.socket, jobs[i]))
+        threads = [threading.Thread(target = submit, args = (i,)) for i in range(len(jobs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        busy = [i for i in range(len(jobs)) if events[i][0]["event"] == "error"]
+        self.assertEqual(len(busy), 1)
+        self.assertEqual(events[busy[0]][0]["error"], "busy: 1 jobs waiting")
+        for i in range(len(jobs)):
+            if i not in busy:
+                self.assertEqual([event["event"] for event in events[i]], ["accepted", "scm", "result"])
+        self.assertEqual(running, [0, 2])
+        self.assertEqual(self.server.admitted, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the shared-memory store of source trees.
+'''
+
+import pickle
+import random
+import unittest
+from multiprocessing import Pool
+
+from superfine.SuperFine import *
+from superfine.parallel import Refinement, relabelRefinements
+from superfine.relabeling import PolytomyIndex, RelabeledView
+from superfine.sharedtrees import SharedSourceTrees, isAvailable
+from superfine.tests import collapseEdges, makeOptions
+from spruce.tests import datasetPath
+
+
+@unittest.skipUnless(isAvailable(), "shared memory needs Python 3.8")
+class SharedSourceTreesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sourceTrees = [parse_tree(source) for source in readMultipleTreesFromFile(
+            datasetPath("simulated", "100-taxa", "75", "sm_data.3.source_trees"))]
+        tree = readNewickFile(datasetPath("simulated", "100-taxa", "75", "sm_data.3.model_tree"))
+        self.index = PolytomyIndex(collapseEdges(tree, random.Random(29), 0.7), self.sourceTrees)
+        self.store = SharedSourceTrees.create(self.sourceTrees)
+
+    def tearDown(self):
+        self.store.close()
+
+    def testRoundTrip(self):
+        self.assertEqual(len(self.store), len(self.sourceTrees))
+        self.assertEqual([str(tree) for tree in self.store], [str(tree) for tree in self.sourceTrees])
+
+        # unpickling a store attaches to its block
+        attached = pickle.loads(pickle.dumps(self.store))
+        self.assertFalse(attached.owner)
+        self.assertEqual(str(attached[2]), str(self.sourceTrees[2]))
+        attached.close()
+
+        store = SharedSourceTrees.create([parse_tree("((a,b)0.5:1.5,(c,d):2,e:0.25)"), Leaf("f")])
+        self.assertEqual([str(tree) for tree in store], ["((a,b)0.5:1.5,(c,d):2.0,e:0.25)", "f"])
+        store.close()
+
+    def testMatchesRelabeledViews(self):
+        for polytomy in self.index.polytomies:
+            (relabeling, delabeling) = self.index.getRelabeling(polytomy)
+            labels = self.store.relabelTaxa(relabeling, len(delabeling))
+            for (i, source) in enumerate(self.sourceTrees):
+                (expected, view) = (RelabeledView(source, relabeling, len(delabeling)), self.store.view(i, labels))
+                self.assertEqual(view.labels(), expected.labels())
+                self.assertEqual(view.isInformative(), expected.isInformative())
+                self.assertEqual(str(view.materialize()), str(expected.materialize()))
+
+    def testWorkersAttach(self):
+        encode = [position % 2 == 0 for position in range(len(self.index.polytomies))]
+        polytomyOptions = [makeOptions(reconciler = "qmc" if encoded else "gmrp") for encoded in encode]
+        refinement = Refinement(self.index, polytomyOptions, [(False, None)] * len(encode), Logger(),
+                                dataset = ("shared", self.store))
+        pool = Pool(2)
+        try:
+            relabelRefinements(pool, [refinement], 2)
+        finally:
+            pool.close()
+            pool.join()
+
+        for (polytomy, result, encoded) in zip(self.index.polytomies, refinement.results, encode):
+            if encoded:
+                (expected, delabeling) = encodeSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+                self.assertEqual(removeUninformativeQTrees(dict(result)), expected)
+            else:
+                (expected, delabeling) = relabelSourceTrees(polytomy, self.sourceTrees, Logger(), None)
+                self.assertEqual([str(tree) for tree in result], [str(tree) for tree in expected])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    Tests of the work queue, with local worker processes.
+'''
+
+import io
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from multiprocessing import Process
+
+from superfine.SuperFine import *
+from superfine.tests import installFindCut, randomTopology
+from superfine.workqueue import TASK_FUNCTIONS, SuperFineWork, WorkQueue, runWorker
+from runSuperFine import parse_options
+
+
+def square(task):
+    return task * task
+
+
+
+def fail(task):
+    raise ValueError("task %d failed" % task)
+
+
+
+def dieOnce(marker):
+    '''Kill the worker the first time, as a lost host would; succeed the second.'''
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return ("done")
+
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = os.path.join(self.directory, "queue")
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+        shutil.rmtree(self.directory)
+
+    def startWorkers(self, count, functions = (square, fail, dieOnce)):
+        functions = TASK_FUNCTIONS + [(function.__module__, function.__name__) for function in functions]
+        for i in range(count):
+            worker = Process(target = runWorker, args = (self.queue, 0.05, 30, functions))
+            worker.start()
+            self.workers.append(worker)
+
+    def testRunsTasks(self):
+        queue = WorkQueue(self.queue)
+        self.startWorkers(3)
+        self.assertEqual(sorted(queue.imap_unordered(square, range(20))), [i * i for i in range(20)])
+        for name in ("pending", "claimed", "done"):
+            self.assertEqual(os.listdir(os.path.join(self.queue, name)), [])
+        self.assertEqual(queue.requeued, 0)
+
+    def testRaisesTaskErrors(self):
+        self.startWorkers(1)
+        self.assertRaises(ValueError, list, WorkQueue(self.queue).imap_unordered(fail, [1, 2]))
+        self.assertEqual(os.listdir(os.path.join(self.queue, "pending")), [])
+
+    def testRefusesOtherFunctions(self):
+        self.startWorkers(1, [square])
+        self.assertRaises(pickle.UnpicklingError, list, WorkQueue(self.queue).imap_unordered(fail, [1]))
+        self.assertRaises(pickle.UnpicklingError, list, WorkQueue(self.queue).imap_unordered(os.system, ["true"]))
+        self.assertEqual(list(WorkQueue(self.queue).imap_unordered(square, [3])), [9])
+
+    def testAbandonedRunLeavesNothing(self):
+        self.startWorkers(2)
+        results = WorkQueue(self.queue).imap_unordered(square, range(6))
+        self.assertTrue(next(results) in [i * i for i in range(6)])
+        # let the workers finish the other tasks, then stop reading their results
+        for attempt in range(300):
+            if len(os.listdir(os.path.join(self.queue, "done"))) == 5:
+                break
+            time.sleep(0.05)
+        results.close()
+        for name in ("pending", "claimed", "done"):
+            self.assertEqual(os.listdir(os.path.join(self.queue, name)), [])
+
+    def testRequeuesLostTasks(self):
+        queue = WorkQueue(self.queue, lease = 0.5)
+        self.startWorkers(2)
+        marker = os.path.join(self.directory, "died")
+        self.assertEqual(list(queue.imap_unordered(dieOnce, [marker])), ["done"])
+        self.assertEqual(queue.requeued, 1)
+        self.assertEqual(len([worker for worker in self.workers if not worker.is_alive()]), 1)
+
+
+class SuperFineQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = os.path.join(self.directory, "queue")
+        # many small source trees leave polytomies to reconcile
+        rng = random.Random(3)
+        taxa = ["t%d" % i for i in range(50)]
+        model = parse_tree(randomTopology(rng, taxa))
+        self.input = os.path.join(self.directory, "sm_data.source_trees")
+        f = open(self.input, 'w')
+        for i in range(30):
+            f.write(str(restrict(model, set(rng.sample(taxa, 12)))) + ";\n")
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runSuperFine(self, arguments):
+        '''Run SuperFine on the input with the given command line options; return the tree it prints.'''
+        (input, options) = parse_options(arguments + [self.input])
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            SuperFine(input, options)
+            return (sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+
+    def startFindCut(self, name):
+        '''Put a stand-in for find-cut on the PATH, logging its inputs to a directory; return the directory.'''
+        directory = os.path.join(self.directory, name)
+        os.mkdir(directory)
+        self.path = installFindCut(directory, directory)
+        return (directory)
+
+    def testLeaseMustOutlastHeartbeats(self):
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            for lease in ("0", "-60", "10"):
+                self.assertRaises(SystemExit, parse_options, ["--queue", self.queue, "--lease", lease, self.input])
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(parse_options(["--queue", self.queue, "--lease", "15", self.input])[1].lease, 15.0)
+
+    def testQueuedRun(self):
+        local = self.startFindCut("local")
+        try:
+            expected = self.runSuperFine(["-j", "2"])
+        finally:
+            os.environ["PATH"] = self.path
+
+        # only the workers can call find-cut
+        remote = self.startFindCut("remote")
+        try:
+            (input, options) = parse_options(["--work", self.queue, "-j", "2", "--idle", "3"])
+            workers = Process(target = SuperFineWork, args = (input, options))
+            workers.start()
+        finally:
+            os.environ["PATH"] = self.path
+        try:
+            self.assertEqual(self.runSuperFine(["--queue", self.queue, "-j", "2"]), expected)
+        finally:
+            workers.join()
+
+        self.assertEqual(workers.exitcode, 0)
+        (localInputs, remoteInputs) = [[name for name in os.listdir(directory) if name.endswith(".quartets")]
+                                       for directory in (local, remote)]
+        self.assertTrue(len(localInputs) > 1)
+        self.assertEqual(len(remoteInputs), len(localInputs))
+        for name in ("pending", "claimed", "done"):
+            self.assertEqual(os.listdir(os.path.join(self.queue, name)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
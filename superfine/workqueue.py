@@ -0,0 +1,297 @@
+###########################################################################
+##    Copyright 2010 Rahul Suri and Tandy Warnow.
+##    This file is part of SuperFine.
+##
+##    SuperFine is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    SuperFine is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with SuperFine.  If not, see <http://www.gnu.org/licenses/>.
+###########################################################################
+
+'''
+    This module contains a work queue in a directory, which spreads the
+    reconciling of polytomies over worker processes on any host which shares
+    the directory (e.g. over NFS).  The queue directory holds
+
+        pending/    tasks waiting for a worker,
+        claimed/    tasks being run, each renamed to carry its worker's name,
+        done/       the results of the tasks, and
+
+    each task file is a pickled (function, argument) pair, so workers run the
+    same code as the coordinator (e.g. superfine.parallel._reconcile() on the
+    relabeled trees or quartet trees of a polytomy).  Files are written under
+    a temporary name and renamed, and a worker claims a task by renaming it,
+    so a task is run by one worker at a time.  Workers touch the tasks they
+    run every so often; a task left untouched for the length of its lease
+    (by the coordinator's clock) is deemed lost with its worker, and put
+    back in pending/ for another worker.  A worker which was only slow may
+    still return its result: the task is still outstanding, so whichever of
+    its results comes first is used, and any later one is dropped.
+
+    Unpickling a file can run any code it names, so anyone who can write to
+    the queue directory can run code as its workers and coordinators: keep
+    it writable by trusted users only.  Workers take the edge off this by
+    refusing tasks which name anything but the functions they run (see
+    TASK_FUNCTIONS) and the classes of their arguments.
+'''
+
+import os, pickle, socket, threading, time, uuid
+from multiprocessing import Process
+
+
+# seconds between scans of the queue directory
+POLL_SECONDS = 0.1
+
+# seconds between touches of a running task by its worker; a coordinator's
+#   lease must be well above this
+HEARTBEAT_SECONDS = 5.0
+
+# the functions which workers run, by module and name
+TASK_FUNCTIONS = [("superfine.parallel", "_reconcile")]
+
+# the classes which the arguments of tasks may hold, besides built-in types
+TASK_CLASSES = [("newick_modified.tree", "Tree"), ("newick_modified.tree", "Leaf"), ("optparse", "Values")]
+
+
+def _writeFile(path, data):
+    '''Write a file of the queue atomically, so that no one reads it half written.'''
+    temporary = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    f = open(temporary, 'wb')
+    f.write(data)
+    f.close()
+    os.rename(temporary, path)
+
+
+
+def _readFile(path):
+    f = open(path, 'rb')
+    try:
+        return pickle.load(f)
+    finally:
+        f.close()
+
+
+
+class TaskUnpickler(pickle.Unpickler):
+    '''An unpickler of task files which refuses any global but the given functions and TASK_CLASSES.'''
+
+    def __init__(self, file, functions):
+        pickle.Unpickler.__init__(self, file)
+        self.functions = functions
+
+    def find_class(self, module, name):
+        if (module, name) not in self.functions and (module, name) not in TASK_CLASSES:
+            raise pickle.UnpicklingError("task refers to %s.%s, which workers do not run" % (module, name))
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+
+def _readTask(path, functions):
+    '''Return the (function, argument) pair of a task file, if the function is one of the given ones.'''
+    f = open(path, 'rb')
+    try:
+        (function, task) = TaskUnpickler(f, functions).load()
+    finally:
+        f.close()
+    if (getattr(function, "__module__", None), getattr(function, "__name__", None)) not in functions:
+        raise pickle.UnpicklingError("task runs %r, which workers do not run" % (function,))
+    return (function, task)
+
+
+
+def _makeDirectories(directory):
+    for name in ("pending", "claimed", "done"):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:     # made by another process in the meantime
+                if not os.path.isdir(path):
+                    raise
+
+
+
+class WorkQueue(object):
+    '''
+        The coordinator's side of a queue directory, which runs tasks as a
+        multiprocessing.Pool does (see imap_unordered()), on the workers
+        serving the directory (see runWorker()).
+    '''
+
+    def __init__(self, directory, lease = 60.0):
+        self.directory = directory
+        self.lease = lease
+        self.requeued = 0
+        _makeDirectories(directory)
+
+    def __path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def imap_unordered(self, function, tasks):
+        '''
+            Queue function(task) for each task, and yield the results as workers
+            return them.  An exception raised by a task is raised here.
+        '''
+        run = uuid.uuid4().hex
+        outstanding = set()
+        for (number, task) in enumerate(tasks):
+            name = "%s-%d" % (run, number)
+            _writeFile(self.__path("pending", name), pickle.dumps((function, task), pickle.HIGHEST_PROTOCOL))
+            outstanding.add(name)
+
+        claims = {}     # claimed file -> (its last modification time, when that was first seen)
+        try:
+            while outstanding:
+                found = False
+                for result in sorted(os.listdir(self.__path("done"))):
+                    (name, _, suffix) = result.rpartition(".")
+                    if suffix != "result" or not name.startswith(run):
+                        continue
+                    (succeeded, value) = _readFile(self.__path("done", result))
+                    os.unlink(self.__path("done", result))
+                    if name not in outstanding:     # a requeued task whose other result came first
+                        continue
+                    outstanding.discard(name)
+                    found = True
+                    if not succeeded:
+                        raise value
+                    yield value
+                if not found:
+                    self.__requeueLost(run, claims)
+                    time.sleep(POLL_SECONDS)
+        finally:
+            # leave nothing of the run for workers to pick up, nor any result
+            #   of it (e.g. one returned twice, or after an error) behind
+            for name in outstanding:
+                try:
+                    os.unlink(self.__path("pending", name))
+                except OSError:
+                    pass
+            for result in os.listdir(self.__path("done")):
+                if result.startswith(run):
+                    try:
+                        os.unlink(self.__path("done", result))
+                    except OSError:
+                        pass
+
+    def __requeueLost(self, run, claims):
+        '''Put back in pending/ the tasks of the run whose workers have not touched them for a lease.'''
+        now = time.time()
+        for claimed in os.listdir(self.__path("claimed")):
+            if not claimed.startswith(run):
+                continue
+            try:
+                modified = os.stat(self.__path("claimed", claimed)).st_mtime
+            except OSError:     # finished in the meantime
+                continue
+            (lastModified, seen) = claims.get(claimed, (None, now))
+            if modified != lastModified:
+                claims[claimed] = (modified, now)
+            elif now - seen > self.lease:
+                try:
+                    os.rename(self.__path("claimed", claimed), self.__path("pending", claimed.split(".")[0]))
+                    self.requeued += 1
+                except OSError:
+                    pass
+                del claims[claimed]
+
+
+
+def claimTask(directory, worker):
+    '''Claim the oldest pending task; return the path of its claimed file, or None if there is none.'''
+    pending = os.path.join(directory, "pending")
+    names = [name for name in os.listdir(pending) if not name.endswith(".tmp")]
+    # tasks are numbered in the order they were queued in
+    for name in sorted(names, key = lambda name: int(name.rpartition("-")[2])):
+        claimed = os.path.join(directory, "claimed", "%s.%s" % (name, worker))
+        try:
+            os.rename(os.path.join(pending, name), claimed)
+        except OSError:     # claimed by another worker
+            continue
+        return (claimed)
+    return None
+
+
+
+def runTask(directory, claimed, heartbeat = HEARTBEAT_SECONDS, functions = TASK_FUNCTIONS):
+    '''
+        Run a claimed task, touching its file as it runs, and write its result
+        to done/.  A task whose function is not one of the given ones fails.
+    '''
+    stopped = threading.Event()
+    def touch():
+        while not stopped.wait(heartbeat):
+            try:
+                os.utime(claimed, None)
+            except OSError:     # requeued after all
+                return
+    beating = threading.Thread(target = touch)
+    beating.daemon = True
+    beating.start()
+
+    try:
+        try:
+            (function, task) = _readTask(claimed, functions)
+            result = (True, function(task))
+        except Exception as e:
+            result = (False, e)
+        except SystemExit as e:     # the adapters exit when a reconciler cannot be run
+            result = (False, RuntimeError("task exited with status %s" % e.code))
+        try:
+            data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps((False, RuntimeError("%s: %s" % (e.__class__.__name__, e))))
+    finally:
+        stopped.set()
+        beating.join()
+
+    name = os.path.basename(claimed).split(".")[0]
+    _writeFile(os.path.join(directory, "done", name + ".result"), data)
+    try:
+        os.unlink(claimed)
+    except OSError:
+        pass
+
+
+
+def runWorker(directory, heartbeat = HEARTBEAT_SECONDS, idle = None, functions = TASK_FUNCTIONS):
+    '''
+        Run the tasks queued in a directory, until interrupted or, if idle is
+        given, until no task has come for idle seconds; only the given
+        functions are run.  Return the number of tasks run.
+    '''
+    _makeDirectories(directory)
+    worker = "%s-%d" % (socket.gethostname().replace(".", "_"), os.getpid())
+    (tasks, lastTask) = (0, time.time())
+    while idle == None or time.time() - lastTask < idle:
+        claimed = claimTask(directory, worker)
+        if claimed == None:
+            time.sleep(POLL_SECONDS)
+            continue
+        runTask(directory, claimed, heartbeat, functions)
+        (tasks, lastTask) = (tasks + 1, time.time())
+    return (tasks)
+
+
+
+def SuperFineWork(directory, options):
+    '''Main loop of worker mode: run options.jobs workers on the queue directory.'''
+    workers = [Process(target = runWorker, args = (directory, HEARTBEAT_SECONDS, options.idle))
+               for i in range(max(options.jobs, 1))]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+            worker.join()